@@ -0,0 +1,139 @@
+"""
+Benchmark of the reference lookups of bill line items as the tables grow.
+
+For tables of 1k to 500k objects, times the lookups of a line item (vendor id
+check, account by RECORDNO, account by title, department by title):
+- table: with LookupTable
+- baseline: with the dicts the sinks used to build and their scans,
+  `id in table.values()` and a loop over the RECORDNO dict
+- bills_payload: the resolution of a bill referencing the same objects, its
+  payload mapped ahead of time, when the singer SDK is installed
+
+The times are per line item, they should stay flat with LookupTable while
+the baseline grows with the tables.
+
+Usage:
+    python benchmarks/lookups.py [--sizes 1000,10000,100000,500000] [--lines 50] [--no-baseline]
+        [--output lookups.json]
+"""
+import argparse
+import json
+import logging
+import random
+import time
+
+from micro import best_resolution, lookup_sink
+from target_intacct.lookups import LookupTable
+
+
+def rows(size, id_pattern, name_pattern, id_field, name_field):
+    return (
+        {"RECORDNO": str(n), id_field: id_pattern.format(n), name_field: name_pattern.format(n)}
+        for n in range(1, size + 1)
+    )
+
+
+def references(size, lines, rng):
+    """Vendor id, account RECORDNO and title, and department title of each line."""
+    picks = []
+    for _line in range(lines):
+        account = rng.randint(1, size)
+        picks.append((f"V{rng.randint(1, size):05d}", str(account), f"Account {account}",
+                      f"Department {rng.randint(1, size)}"))
+    return picks
+
+
+def per_line(function, picks, repeat):
+    """Best time of function over picks, in microseconds per line."""
+    times = []
+    for _i in range(repeat):
+        start = time.perf_counter()
+        function(picks)
+        times.append(time.perf_counter() - start)
+    return min(times) / len(picks) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="1000,10000,100000,500000", help="objects per table")
+    parser.add_argument("--lines", type=int, default=50, help="line items resolved")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-baseline", action="store_true", help="skip the dict scans, slow on large tables")
+    parser.add_argument("--output", help="JSON file the timings are written to")
+    args = parser.parse_args()
+
+    try:
+        sink = lookup_sink(rows=1)
+    except ImportError as e:
+        print(f"Skipping the bills_payload benchmark: {e}")
+        sink = None
+
+    print(f"{'objects':>9}{'build s':>10}{'table us':>11}{'baseline us':>13}{'bills_payload us':>18}")
+    results = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        rng = random.Random(size)
+        picks = references(size, args.lines, rng)
+
+        start = time.perf_counter()
+        vendors = LookupTable(rows(size, "V{:05d}", "Vendor {}", "VENDORID", "NAME"), "NAME", "VENDORID")
+        accounts = LookupTable(rows(size, "{:05d}", "Account {}", "ACCOUNTNO", "TITLE"), "TITLE", "ACCOUNTNO")
+        departments = LookupTable(
+            rows(size, "D{:05d}", "Department {}", "DEPARTMENTID", "TITLE"), "TITLE", "DEPARTMENTID"
+        )
+        build = time.perf_counter() - start
+
+        def resolve_table(picks):
+            for vendor_id, account_recordno, account_title, department in picks:
+                assert vendors.has_id(vendor_id)
+                assert accounts.id_for_recordno(account_recordno)
+                assert accounts.get(account_title)
+                assert departments.get(department)
+
+        timings = {"build_s": build, "table_us": per_line(resolve_table, picks, args.repeat)}
+
+        if not args.no_baseline:
+            vendors_dict = dict(vendors)
+            accounts_dict = dict(accounts)
+            accounts_recordno = {str(n): f"{n:05d}" for n in range(1, size + 1)}
+            departments_dict = dict(departments)
+
+            def resolve_baseline(picks):
+                for vendor_id, account_recordno, account_title, department in picks:
+                    assert vendor_id in vendors_dict.values()
+                    assert next((accounts_recordno.get(x) for x in accounts_recordno if x == account_recordno), None)
+                    assert accounts_dict.get(account_title)
+                    assert departments_dict.get(department)
+
+            timings["baseline_us"] = per_line(resolve_baseline, picks, args.repeat)
+            del vendors_dict, accounts_dict, accounts_recordno, departments_dict
+
+        if sink:
+            sink.vendors, sink.accounts, sink.departments = vendors, accounts, departments
+            record = {
+                "vendorNum": picks[0][0],
+                "createdAt": "2024-01-02T00:00:00Z",
+                "lineItems": [
+                    {"accountId": account_recordno, "totalPrice": 10.0, "departmentName": department}
+                    for _vendor_id, account_recordno, _title, department in picks
+                ],
+            }
+            ms = best_resolution(sink.bills_payload, record, "bills", args.repeat)
+            timings["bills_payload_us"] = ms * 1000 / len(picks)
+
+        print(
+            f"{size:>9}{timings['build_s']:>10.2f}{timings['table_us']:>11.2f}"
+            + (f"{timings['baseline_us']:>13.2f}" if "baseline_us" in timings else f"{'-':>13}")
+            + (f"{timings['bills_payload_us']:>18.2f}" if "bills_payload_us" in timings else f"{'-':>18}")
+        )
+        results.append({"objects": size, "lines": len(picks), **timings})
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"repeat": args.repeat, "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    # singer configures a stderr handler on import, drop the formatted logs instead
+    logging.getLogger().handlers = [logging.NullHandler()]
+    main()
@@ -0,0 +1,199 @@
+"""
+Micro-benchmarks of the CPU-side hot paths of a record upload.
+
+For documents of growing size, times:
+- mapping: UnifiedMapping.prepare_payload of each endpoint of mapping_intacct-v2.json
+- resolution: the reference lookups of bills_payload and journal_entries_payload,
+  with the lookup tables already loaded and the payload mapped ahead of time
+- unparse / serialize: xmltodict.unparse of the request envelope, and the
+  serializer the client uses
+- decode: SageIntacctSDK._handle_response of the create response
+- page: _handle_response of a lookup query page with as many rows as the
+  document has lines, not part of the upload of a record
+
+The dominant step is the slowest of mapping, resolution, serialize and decode.
+
+Usage:
+    python benchmarks/micro.py [--sizes 1,10,100,1000,5000] [--repeat 5] [--output micro.json]
+"""
+import argparse
+import json
+import logging
+import time
+import timeit
+
+import xmltodict
+
+from response_decoding import make_client, query_page
+from target_intacct.emulator import SEED_FIELDS
+from target_intacct.lookups import LookupTable
+from target_intacct.mapping import UnifiedMapping
+from target_intacct.synthetic import SyntheticGenerator
+
+# stream of the synthetic records, mapping endpoint, payload method and object of each endpoint
+ENDPOINTS = {
+    "bills": ("Bills", "bills_payload", "APBILL"),
+    "purchase_invoices": ("PurchaseInvoices", "purchase_invoices_payload", "APBILL"),
+    "journal_entries": ("JournalEntries", "journal_entries_payload", "GLBATCH"),
+    "account_payable_vendors": ("Suppliers", None, "VENDOR"),
+    "apadjustment": ("APAdjustment", None, "APADJUSTMENT"),
+    "purchase_orders": ("PurchaseOrders", None, "PODOCUMENT"),
+}
+# payload methods whose reference resolution is timed
+RESOLVED = {"bills", "journal_entries"}
+
+REFERENCE_ROWS = 1000
+
+
+class PreparedMapping(UnifiedMapping):
+    """Returns the payload mapped ahead of time, so only the resolution is timed."""
+
+    payload = None
+
+    def prepare_payload(self, record, endpoint="invoice", target="intacct"):
+        return PreparedMapping.payload
+
+
+def lookup_sink(rows=REFERENCE_ROWS):
+    """A sink with its lookup tables loaded as the emulator seeds them, without a target."""
+    from target_intacct import sinks
+    from target_intacct.sinks import intacctSink
+
+    sinks.UnifiedMapping = PreparedMapping
+    sink = intacctSink.__new__(intacctSink)
+    sink._config = {}
+    sink.target_name = "intacct-v2"
+
+    def table(object_type, name_field, id_field):
+        fields = SEED_FIELDS[object_type]
+        return LookupTable(
+            (
+                {"RECORDNO": str(n), name_field: fields[name_field].format(n), id_field: fields[id_field].format(n)}
+                for n in range(1, rows + 1)
+            ),
+            name_field,
+            id_field,
+        )
+
+    sink.vendors = table("VENDOR", "NAME", "VENDORID")
+    sink.classes = table("CLASS", "NAME", "CLASSID")
+    sink.projects = table("PROJECT", "NAME", "PROJECTID")
+    sink.locations = table("LOCATION", "NAME", "LOCATIONID")
+    sink.accounts = table("GLACCOUNT", "TITLE", "ACCOUNTNO")
+    sink.departments = table("DEPARTMENT", "TITLE", "DEPARTMENTID")
+    sink.items = table("ITEM", "NAME", "ITEMID")
+    sink.customers = table("CUSTOMER", "NAME", "CUSTOMERID")
+    sink.journal_entries = {}
+    return sink
+
+
+def create_response(object_type):
+    return xmltodict.unparse({
+        "response": {
+            "control": {"status": "success", "senderid": "sender", "controlid": "1", "uniqueid": "false", "dtdversion": "3.0"},
+            "operation": {
+                "authentication": {"status": "success", "sessiontimeout": "2024-01-02T11:11:12+00:00"},
+                "result": {
+                    "status": "success",
+                    "function": "create",
+                    "controlid": "1",
+                    "data": {"@listtype": "objects", "@count": "1", object_type.lower(): {"RECORDNO": "1"}},
+                },
+            },
+        }
+    })
+
+
+def best(function, repeat):
+    """Best time of function in milliseconds."""
+    return min(timeit.repeat(function, number=1, repeat=repeat)) * 1000
+
+
+def best_resolution(method, record, endpoint, repeat):
+    """Best time of a payload method in milliseconds, its payload being mapped untimed."""
+    times = []
+    for _i in range(repeat):
+        PreparedMapping.payload = UnifiedMapping().prepare_payload(record, endpoint, "intacct-v2")
+        start = time.perf_counter()
+        method(record)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="1,10,100,1000,5000", help="lines per document")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="JSON file the timings are written to")
+    args = parser.parse_args()
+
+    client = make_client()
+    client._SageIntacctSDK__session_id = "session"
+    mapping = UnifiedMapping()
+    try:
+        sink = lookup_sink()
+    except ImportError as e:
+        # the sinks need the singer SDK, the other steps are still timed
+        print(f"Skipping the resolution benchmarks: {e}")
+        sink = None
+
+    steps = ["mapping", "resolution", "unparse", "serialize", "decode", "page"]
+    print(f"{'endpoint':<26}{'lines':>6}" + "".join(f"{step:>12}" for step in steps) + "   dominant")
+    results = []
+    for endpoint, (stream, payload_method, object_type) in ENDPOINTS.items():
+        for size in [int(size) for size in args.sizes.split(",")]:
+            generator = SyntheticGenerator(
+                seed=size,
+                lines=size,
+                vendors=REFERENCE_ROWS,
+                accounts=REFERENCE_ROWS,
+                departments=REFERENCE_ROWS,
+                references=REFERENCE_ROWS,
+            )
+            record = json.loads(json.dumps(generator.record(stream, 1)))
+            timings = {}
+
+            timings["mapping"] = best(lambda: mapping.prepare_payload(record, endpoint, "intacct-v2"), args.repeat)
+            payload = mapping.prepare_payload(record, endpoint, "intacct-v2")
+            if sink and endpoint in RESOLVED:
+                method = getattr(sink, payload_method)
+                # without the bill number, the existence check is a request
+                new_record = {key: value for key, value in record.items() if key != "invoiceNumber"}
+                timings["resolution"] = best_resolution(method, new_record, endpoint, args.repeat)
+                PreparedMapping.payload = mapping.prepare_payload(new_record, endpoint, "intacct-v2")
+                payload = method(new_record)["data"]["create"][object_type]
+
+            function = {"@controlid": "1", "create": {object_type: payload}}
+            envelope = client._build_request([function])
+            timings["unparse"] = best(lambda: xmltodict.unparse(envelope), args.repeat)
+            timings["serialize"] = best(lambda: client._serialize_request(envelope), args.repeat)
+
+            body = client._serialize_request(envelope)
+            text = create_response(object_type)
+            page = query_page("GLACCOUNT", size)
+            timings["decode"] = best(
+                lambda: client._handle_response(envelope, body, 200, text, client._endpoint()), args.repeat
+            )
+            timings["page"] = best(
+                lambda: client._handle_response(envelope, body, 200, page, client._endpoint()), args.repeat
+            )
+
+            # the client serializes with its own serializer, xmltodict.unparse is the reference
+            dominant = max((step for step in timings if step not in ("unparse", "page")), key=timings.get)
+            print(
+                f"{endpoint:<26}{size:>6}"
+                + "".join(f"{timings[step]:>10.3f}ms" if step in timings else f"{'-':>12}" for step in steps)
+                + f"   {dominant}"
+            )
+            results.append({"endpoint": endpoint, "lines": size, "ms": timings, "dominant": dominant})
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"repeat": args.repeat, "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    # singer configures a stderr handler on import, drop the formatted logs instead
+    logging.getLogger().handlers = [logging.NullHandler()]
+    main()
@@ -0,0 +1,157 @@
+"""
+Benchmark of the response decoding done by SageIntacctSDK._handle_response.
+
+Compares the previous decoding (xmltodict.parse + json round-trip + deepcopy
+for the credentials redaction) with the current single pass decoding, on
+large `query` pages of vendors and GL accounts.
+
+Usage:
+    python benchmarks/response_decoding.py [--rows 1000] [--repeat 20]
+"""
+import argparse
+import copy
+import json
+import logging
+import timeit
+
+import xmltodict
+
+from target_intacct.client import SageIntacctSDK
+
+
+class OfflineClient(SageIntacctSDK):
+    """Client that skips the login, only used to decode responses."""
+
+    def _connect(self, warm_connections):
+        pass
+
+
+def make_client():
+    return OfflineClient(
+        api_url="https://api.intacct.test/ia/xml/xmlgw.phtml",
+        company_id="company",
+        sender_id="sender",
+        sender_password="sender_password",
+        user_id="user",
+        user_password="user_password",
+        headers={},
+        use_locations=False,
+        location_id=None,
+        warm_connections=0,
+    )
+
+
+def query_page(object_type, rows):
+    """A query response page with `rows` records of object_type."""
+    if object_type == "VENDOR":
+        records = [
+            {
+                "RECORDNO": str(i),
+                "VENDORID": f"V{i:06d}",
+                "NAME": f"Vendor {i} & Sons <Supplies>",
+                "STATUS": "active",
+                "WHENMODIFIED": "01/02/2024 10:11:12",
+            }
+            for i in range(rows)
+        ]
+    else:
+        records = [
+            {
+                "RECORDNO": str(i),
+                "ACCOUNTNO": f"{1000 + i}",
+                "TITLE": f"Account {i}",
+                "ACCOUNTTYPE": "incomestatement",
+                "NORMALBALANCE": "debit",
+            }
+            for i in range(rows)
+        ]
+    response = {
+        "response": {
+            "control": {
+                "status": "success",
+                "senderid": "sender",
+                "controlid": "2024-01-02 10:11:12.000000",
+                "uniqueid": "false",
+                "dtdversion": "3.0",
+            },
+            "operation": {
+                "authentication": {
+                    "status": "success",
+                    "userid": "user",
+                    "companyid": "company",
+                    "locationid": None,
+                    "sessiontimestamp": "2024-01-02T10:11:12+00:00",
+                    "sessiontimeout": "2024-01-02T11:11:12+00:00",
+                },
+                "result": {
+                    "status": "success",
+                    "function": "query",
+                    "controlid": "b7f6a0c8-0000-0000-0000-000000000000",
+                    "data": {
+                        "@listtype": object_type,
+                        "@count": str(rows),
+                        "@totalcount": str(rows),
+                        "@numremaining": "0",
+                        object_type: records,
+                    },
+                },
+            },
+        }
+    }
+    return xmltodict.unparse(response)
+
+
+def previous_decoding(client, dict_body, body, text):
+    """The decoding done before the single pass decoder, with INFO logs."""
+    clean_body = client.clean_creds("request", copy.deepcopy(dict_body))
+    if not "attachmentdata" in str(body):
+        str(clean_body)
+    parsed_response = json.loads(json.dumps(xmltodict.parse(text)))
+    clean_parsed_response = copy.deepcopy(parsed_response)
+    clean_parsed_response = client.clean_creds("response", clean_parsed_response)
+    if not "attachmentdata" in str(body):
+        str(clean_parsed_response)
+    return parsed_response["response"]["operation"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    client = make_client()
+    client._SageIntacctSDK__session_id = "session"
+
+    print(f"{'page':<18}{'previous':>12}{'INFO logs':>12}{'no logs':>12}{'speedup':>10}")
+    for object_type in ["VENDOR", "GLACCOUNT"]:
+        text = query_page(object_type, args.rows)
+        function = {"@controlid": "1", "query": {"object": object_type, "pagesize": args.rows}}
+        dict_body = client._build_request([function])
+        body = client._serialize_request(dict_body)
+
+        def current():
+            return client._handle_response(dict_body, body, 200, text, client._endpoint())
+
+        assert current() == previous_decoding(client, dict_body, body, text)
+
+        previous = min(timeit.repeat(
+            lambda: previous_decoding(client, dict_body, body, text), number=1, repeat=args.repeat
+        ))
+        # logs are formatted but dropped by a NullHandler
+        logging.getLogger().setLevel(logging.INFO)
+        with_logs = min(timeit.repeat(current, number=1, repeat=args.repeat))
+        logging.getLogger().setLevel(logging.WARNING)
+        without_logs = min(timeit.repeat(current, number=1, repeat=args.repeat))
+
+        label = f"{object_type} x{args.rows}"
+        print(
+            f"{label:<18}{previous * 1000:>10.1f}ms{with_logs * 1000:>10.1f}ms"
+            f"{without_logs * 1000:>10.1f}ms{previous / without_logs:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    # singer configures a stderr handler on import, drop the formatted logs instead
+    logging.getLogger().handlers = [logging.NullHandler()]
+    main()
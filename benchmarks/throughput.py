@@ -0,0 +1,275 @@
+"""
+End-to-end throughput benchmark of the target against the local gateway emulator.
+
+Runs the target-intacct-v2 CLI once per stream on the synthetic Singer records
+of target_intacct.synthetic, with a fresh emulator for each run, and reports
+the records/s, the p50/p95/p99 time spent uploading each record, the API calls
+and the peak RSS of the target process. The results are written as JSON so releases can be compared.
+
+The time of a record is measured around its preprocess_record and write_record
+calls. In batch mode every record of a batch is charged the whole batch.
+
+The target config takes the settings of --target-config, e.g. batch_mode or
+max_workers. The target limits itself to 10 requests/s by default, set
+`rate_limit` there to measure the target rather than its limiter.
+
+Usage:
+    python benchmarks/throughput.py [--records 200] [--lines 5] [--attachment-kb 0]
+        [--latency 0.0] [--streams Bills,JournalEntries] [--target-config extra.json]
+        [--output throughput.json]
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from target_intacct.emulator import GatewayEmulator
+from target_intacct.synthetic import STREAMS, SyntheticGenerator, bill_number
+
+def generator(args):
+    return SyntheticGenerator(
+        seed=args.seed,
+        lines=args.lines,
+        vendors=args.reference_rows,
+        accounts=args.reference_rows,
+        departments=args.reference_rows,
+        references=args.reference_rows,
+        attachment_kb=[args.attachment_kb] if args.attachment_kb else [],
+        unknown_share=args.unknown_share,
+    )
+
+
+def write_input(path, stream, args):
+    """Writes the SCHEMA and RECORD messages of stream, returns the record count."""
+    with open(path, "w") as f:
+        return generator(args).write(f, [stream], args.records)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of values."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(q / 100 * len(values)), 1) - 1]
+
+
+def run_stream(stream, args, workdir, extra_config):
+    emulator = GatewayEmulator(
+        latency=args.latency,
+        jitter=args.jitter,
+        reference_rows=args.reference_rows,
+        seed=args.seed,
+    )
+    if stream == "BillPayments":
+        for n in range(1, args.records + 1):
+            emulator.insert("APBILL", {
+                "RECORDID": bill_number(n), "VENDORID": "V00001", "CURRENCY": "USD", "TRX_TOTALDUE": "100.00",
+            })
+
+    with emulator:
+        config = {
+            "company_id": "company",
+            "sender_id": "sender",
+            "sender_password": "sender_password",
+            "user_id": "user",
+            "user_password": "user_password",
+            "api_url": emulator.url,
+            "input_path": workdir,
+            "warm_connections": 0,
+            **extra_config,
+        }
+        config_path = os.path.join(workdir, f"{stream}.config.json")
+        with open(config_path, "w") as f:
+            json.dump(config, f)
+        input_path = os.path.join(workdir, f"{stream}.singer")
+        records = write_input(input_path, stream, args)
+        timings_path = os.path.join(workdir, f"{stream}.timings.json")
+        log_path = os.path.join(workdir, f"{stream}.log")
+
+        start = time.perf_counter()
+        with open(input_path) as stdin, open(log_path, "w") as stderr:
+            process = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "run-target", timings_path, "--config", config_path],
+                stdin=stdin,
+                stdout=subprocess.DEVNULL,
+                stderr=stderr,
+            )
+        elapsed = time.perf_counter() - start
+        stats = emulator.stats()
+
+    if process.returncode != 0 or not os.path.exists(timings_path):
+        with open(log_path) as f:
+            tail = f.read()[-2000:]
+        return {"error": f"target exited with code {process.returncode}", "log_tail": tail}
+
+    with open(timings_path) as f:
+        timings = json.load(f)
+    latencies = [round(seconds * 1000, 3) for seconds in timings["latencies"]]
+    return {
+        "records": records,
+        "failed_records": timings["failures"],
+        "elapsed_s": round(elapsed, 3),
+        "records_per_s": round(records / elapsed, 2),
+        "latency_ms": {f"p{q}": percentile(latencies, q) for q in (50, 95, 99)},
+        "api_calls": stats.get("requests", 0),
+        "logins": stats.get("logins", 0),
+        "functions": {key.split(".", 1)[1]: value for key, value in stats.items() if key.startswith("function.")},
+        "bytes_sent": stats.get("bytes_received", 0),
+        "bytes_received": stats.get("bytes_sent", 0),
+        "peak_rss_mb": timings["peak_rss_mb"],
+    }
+
+
+def run_target(timings_path, cli_args):
+    """
+    Runs the target CLI in this process, timing the records, and writes the
+    timings to timings_path when the target exits.
+    """
+    from target_intacct.sinks import BillPaymentsSink, intacctSink
+    from target_intacct.target import Targetintacct
+
+    latencies = []
+    failures = []
+    preprocessed = {}
+    lock = threading.Lock()
+
+    def record_outcome(seconds, ok):
+        with lock:
+            latencies.append(seconds)
+            if not ok:
+                failures.append(1)
+
+    def timed_preprocess(preprocess_record):
+        def wrapper(self, record, context):
+            start = time.perf_counter()
+            record = preprocess_record(self, record, context)
+            preprocessed[id(record)] = time.perf_counter() - start
+            return record
+        return wrapper
+
+    def timed_write(write_record):
+        def wrapper(self, record, context):
+            start = time.perf_counter() - preprocessed.pop(id(record), 0.0)
+            ok = False
+            try:
+                result = write_record(self, record, context)
+                ok = bool(result and result[1])
+                return result
+            finally:
+                record_outcome(time.perf_counter() - start, ok)
+        return wrapper
+
+    upload_batch = intacctSink.upload_batch
+
+    def timed_upload_batch(self, records):
+        start = time.perf_counter()
+        results = upload_batch(self, records)
+        seconds = time.perf_counter() - start
+        for record, result in zip(records, results):
+            ok = not isinstance(result, Exception) and bool(result and result[1])
+            record_outcome(seconds + preprocessed.pop(id(record), 0.0), ok)
+        return results
+
+    for sink_class in (intacctSink, BillPaymentsSink):
+        if "preprocess_record" in vars(sink_class):
+            sink_class.preprocess_record = timed_preprocess(vars(sink_class)["preprocess_record"])
+        if "write_record" in vars(sink_class):
+            sink_class.write_record = timed_write(vars(sink_class)["write_record"])
+    intacctSink.upload_batch = timed_upload_batch
+
+    sys.argv = ["target-intacct-v2", *cli_args]
+    try:
+        Targetintacct.cli()
+    finally:
+        try:
+            import resource
+
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # kilobytes on Linux, bytes on macOS
+            peak_rss_mb = peak_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+        except ImportError:
+            peak_rss_mb = None
+        with open(timings_path, "w") as f:
+            json.dump({
+                "latencies": latencies,
+                "failures": len(failures),
+                "peak_rss_mb": round(peak_rss_mb, 1) if peak_rss_mb else None,
+            }, f)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--records", type=int, default=200, help="records per stream")
+    parser.add_argument("--lines", type=int, default=5, help="lines per document")
+    parser.add_argument("--attachment-kb", type=int, default=0, help="size of the attachment of bills and orders, 0 for none")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added by the emulator to each request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds")
+    parser.add_argument("--reference-rows", type=int, default=100, help="vendors, accounts, etc. in the emulator")
+    parser.add_argument("--unknown-share", type=float, default=0.0, help="share of the references to unknown objects")
+    parser.add_argument("--streams", default=",".join(STREAMS), help="comma separated streams to run")
+    parser.add_argument("--target-config", help="JSON file of settings added to the target config, e.g. batch_mode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="throughput.json")
+    args = parser.parse_args()
+
+    streams = [stream for stream in args.streams.split(",") if stream]
+    unknown = set(streams) - set(STREAMS)
+    if unknown:
+        parser.error(f"unknown streams: {sorted(unknown)}")
+    extra_config = {}
+    if args.target_config:
+        with open(args.target_config) as f:
+            extra_config = json.load(f)
+
+    results = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {**vars(args), "target_config": extra_config},
+        "streams": {},
+    }
+    print(f"{'stream':<18}{'records/s':>11}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'calls':>8}{'failed':>8}{'RSS MB':>8}")
+    with tempfile.TemporaryDirectory(prefix="intacct-throughput-") as workdir:
+        generator(args).write_attachments(workdir)
+
+        for stream in streams:
+            result = run_stream(stream, args, workdir, extra_config)
+            results["streams"][stream] = result
+            if "error" in result:
+                print(f"{stream:<18}{result['error']}\n{result['log_tail']}")
+                continue
+            latency = {key: value or 0 for key, value in result["latency_ms"].items()}
+            print(
+                f"{stream:<18}{result['records_per_s']:>11.1f}{latency['p50']:>9.1f}{latency['p95']:>9.1f}"
+                f"{latency['p99']:>9.1f}{result['api_calls']:>8}{result['failed_records']:>8}"
+                f"{result['peak_rss_mb'] or 0:>8.1f}"
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "run-target":
+        run_target(sys.argv[2], sys.argv[3:])
+    else:
+        main()
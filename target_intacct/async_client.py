@@ -0,0 +1,411 @@
+"""
+Asyncio API class for Sage Intacct
+"""
+import asyncio
+import functools
+import logging
+from typing import AsyncIterator, Dict, List, Tuple, Union
+
+import aiohttp
+import backoff
+import singer
+
+from target_intacct.client import SageIntacctSDK
+from target_intacct.exceptions import (
+    ExpiredTokenError,
+    InternalServerError,
+    InvalidTokenError,
+    SageIntacctSDKError,
+    TemporaryServerError,
+)
+
+from .const import BATCH_MAX_BYTES, BATCH_MAX_FUNCTIONS, INTACCT_OBJECTS
+from .request_logging import RequestLogger
+from .rate_limit import RateLimiter
+from .sessions import SessionCache
+
+RETRY_EXCEPTIONS = (
+    ConnectionError,
+    ConnectionResetError,
+    aiohttp.ClientError,
+    InternalServerError,
+    TemporaryServerError,
+)
+
+
+def async_rate_limited(func):
+    """
+    asyncio version of rate_limited, the tasks sleep instead of blocking the loop.
+    """
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        # the limiter state is behind a file lock, it is updated in a thread
+        loop = asyncio.get_running_loop()
+        wait = await loop.run_in_executor(None, self.rate_limiter.reserve)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            result = await func(self, *args, **kwargs)
+        except TemporaryServerError:
+            await loop.run_in_executor(None, self.rate_limiter.on_throttle)
+            raise
+        await loop.run_in_executor(None, self.rate_limiter.on_success)
+        return result
+
+    return wrapper
+
+
+class AsyncSageIntacctSDK(SageIntacctSDK):
+    """
+    asyncio version of SageIntacctSDK built on aiohttp.
+
+    The client doesn't log in on creation, `await login()` (or use it with
+    `async with`) before sending requests.
+    """
+
+    def _build_http_session(self, pool_size: int) -> None:
+        # the aiohttp session must be created inside the running event loop
+        self._pool_size = pool_size
+        self._http_session = None
+        self._requests_sent = 0
+        # created in the event loop by the first login
+        self._login_lock = None
+        return None
+
+    def _connect(self, warm_connections: int) -> None:
+        # logging in is a coroutine, it is done by login()
+        self._warm_count = warm_connections
+
+    def _get_http_session(self) -> aiohttp.ClientSession:
+        if self._http_session is None or self._http_session.closed:
+            self._http_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._pool_size),
+                # 60 seconds timeout to overcome hanging requests
+                timeout=aiohttp.ClientTimeout(total=60),
+            )
+        return self._http_session
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self) -> None:
+        """Closes the pooled connections of this client."""
+        if self._http_session is not None:
+            await self._http_session.close()
+
+    def get_connection_stats(self) -> Dict:
+        return {"requests": self._requests_sent, **self._transfer_stats()}
+
+    async def login(self) -> None:
+        """
+        Opens the API session, or reuses a cached one, and warms the connection pool.
+        """
+        await self._ensure_session()
+        await self.warm_connections(self._warm_count)
+
+    async def warm_connections(self, count: int) -> None:
+        """
+        Opens up to `count` keep-alive connections to the API endpoint so the
+        first requests don't pay for the TCP and TLS handshakes.
+
+        The HEAD requests are sent at once, so each one opens a connection that
+        goes back to the pool when its (empty) body is read.
+        """
+        count = min(count or 0, self._pool_size)
+        if count <= 0:
+            return
+        session = self._get_http_session()
+
+        async def head():
+            async with session.head(self._endpoint(), timeout=aiohttp.ClientTimeout(total=10)) as response:
+                await response.read()
+
+        results = await asyncio.gather(*[head() for _ in range(count)], return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            logging.warning(f"Could not warm connections to {self._endpoint()}: {errors[0]}")
+
+    async def _ensure_session(self) -> None:
+        """
+        Makes sure the client has a session that doesn't expire soon, logging in if needed.
+
+        Concurrent tasks share a single login, the tasks waiting for it reuse its session.
+        """
+        if self._load_cached_session():
+            return
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        async with self._login_lock:
+            if not self._load_cached_session():
+                await self._set_session_id(**self._login_kwargs())
+
+    async def _post_with_session(self, functions: List[Dict], raise_result_errors=True) -> Dict:
+        """
+        Posts functions with the API session, logging in again once if it expired or was revoked.
+        """
+        await self._ensure_session()
+        dict_body, api_url = self._prepare_request(functions)
+        try:
+            return await self._post_request(dict_body, api_url, raise_result_errors)
+        except (ExpiredTokenError, InvalidTokenError) as e:
+            logging.info(f"API session rejected, logging in again: {e}")
+            self._invalidate_session(dict_body["request"]["operation"]["authentication"]["sessionid"])
+            await self._ensure_session()
+            dict_body, api_url = self._prepare_request(functions)
+            return await self._post_request(dict_body, api_url, raise_result_errors)
+
+    @backoff.on_exception(backoff.expo, RETRY_EXCEPTIONS, max_tries=8, factor=3)
+    @async_rate_limited
+    async def _set_session_id(self, user_id: str, company_id: str, user_password: str, location_id = None):
+        """
+        Sets the session id for APIs
+        """
+        dict_body = self._build_login_request(user_id, company_id, user_password, location_id)
+        response = await self._post_request(dict_body, self._endpoint())
+        self._set_session_details(response)
+
+    async def _post_request(self, dict_body: dict, api_url: str, raise_result_errors=True) -> Dict:
+        """
+        Create a HTTP post request.
+
+        Parameters:
+            dict_body (dict): HTTP POST body data for the wanted API.
+            api_url (str): Url for the wanted API.
+            raise_result_errors (bool): raise when a function result failed.
+
+        Returns:
+            A response from the request (dict).
+        """
+        body = self._serialize_request(dict_body)
+        data, headers = self._encode_body(body)
+        try:
+            async with self._get_http_session().post(api_url, headers=headers, data=data) as response:
+                content = await response.read()
+                text = await response.text()
+        except asyncio.TimeoutError as e:
+            # Raise a TemporaryServerError if the request times out and we should retry
+            raise TemporaryServerError(f"Request timed out: {e}")
+        self._requests_sent += 1
+        # aiohttp doesn't count the bytes read before decoding, use the announced length
+        wire_received = int(response.headers.get("Content-Length") or len(content))
+        self._count_transfer(api_url, len(body), len(data), len(content), wire_received)
+
+        return self._handle_response(
+            dict_body, body, response.status, text, str(response.url), raise_result_errors
+        )
+
+    @backoff.on_exception(backoff.expo, RETRY_EXCEPTIONS, max_tries=8, factor=3)
+    @async_rate_limited
+    async def format_and_send_request(self, data: Dict, use_payload=False, controlid: str = None) -> Union[List, Dict]:
+        """
+        Format data accordingly to convert them to xml.
+
+        Parameters:
+            data (dict): HTTP POST body data for the wanted API.
+            controlid (str): controlid of the function, a random one is used when missing.
+
+        Returns:
+            A response from the _post_request (dict).
+        """
+        object_type, function = self._build_function(data, use_payload, controlid)
+        with singer.metrics.http_request_timer(endpoint=object_type):
+            response = await self._post_with_session([function])
+        return response["result"]
+
+    async def format_and_send_batch(
+        self,
+        functions: List[Dict],
+        use_payload=False,
+        controlids: List[str] = None,
+        max_functions: int = BATCH_MAX_FUNCTIONS,
+        max_bytes: int = BATCH_MAX_BYTES,
+    ) -> Dict[str, Union[Dict, SageIntacctSDKError]]:
+        """
+        Sends many functions packed in as few requests as the limits allow,
+        the requests of the batch are sent concurrently.
+
+        Returns:
+            Dict keyed by controlid, in the same order as functions, with the result
+            of each successful function or the SageIntacctSDKError of each failed one.
+        """
+        chunks = self._chunk_functions(functions, use_payload, controlids, max_functions, max_bytes)
+        chunk_results = await asyncio.gather(*[self._send_batch(chunk) for chunk in chunks])
+
+        results = {}
+        for chunk_result in chunk_results:
+            results.update(chunk_result)
+        return results
+
+    @backoff.on_exception(backoff.expo, RETRY_EXCEPTIONS, max_tries=8, factor=3)
+    @async_rate_limited
+    async def _send_batch(self, chunk) -> Dict[str, Union[Dict, SageIntacctSDKError]]:
+        """
+        Sends a single multi-function request and splits its results by controlid.
+        """
+        with singer.metrics.http_request_timer(endpoint=self._batch_endpoint(chunk)):
+            response = await self._post_with_session(
+                [function for _, function in chunk], raise_result_errors=False
+            )
+
+        return self._split_batch_results(chunk, response)
+
+    async def get_entity(self, *, object_type: str, fields: List[str], filter={}, docparid=None) -> List[Dict]:
+        """
+        Get multiple objects of a single type from Sage Intacct, the pages are fetched concurrently.
+
+        Returns:
+            List of Dict in object_type schema.
+        """
+        intacct_object_type = INTACCT_OBJECTS[object_type]
+        get_count = self._entity_count_request(intacct_object_type, filter, docparid)
+
+        response = await self.format_and_send_request(get_count)
+
+        if filter:
+            response = response["data"].get(INTACCT_OBJECTS[object_type])
+            return response
+
+        count = int(response["data"]["@totalcount"])
+        pagesize = 1000
+        pages = await asyncio.gather(*[
+            self.format_and_send_request(
+                self._entity_page_request(intacct_object_type, fields, pagesize, offset)
+            )
+            for offset in range(0, count, pagesize)
+        ])
+
+        total_intacct_objects = []
+        for page in pages:
+            total_intacct_objects.extend(self._entity_objects(page, intacct_object_type))
+        return total_intacct_objects
+
+    async def count_entity(self, *, object_type: str, filter={}) -> int:
+        """
+        Counts the objects of a single type, matching filter when given.
+        """
+        intacct_object_type = INTACCT_OBJECTS[object_type]
+        response = await self.format_and_send_request(self._entity_count_request(intacct_object_type, filter))
+        return int(response["data"]["@totalcount"])
+
+    async def iter_entity(
+        self, *, object_type: str, fields: List[str], filter={}, pagesize=1000, parallelism=None, after=None
+    ) -> AsyncIterator[Dict]:
+        """
+        Iterates over the objects of a single type, one page at a time, in RECORDNO order.
+
+        The pages are read one after the other, get_entity fetches them concurrently.
+
+        Returns:
+            Async iterator of Dict in object_type schema.
+        """
+        last_recordno = after
+        while True:
+            intacct_objects, remaining = await self.get_entity_page(
+                object_type=object_type, fields=fields, filter=filter, pagesize=pagesize, after=last_recordno
+            )
+            for intacct_object in intacct_objects:
+                yield intacct_object
+
+            if not intacct_objects or remaining <= 0:
+                return
+            last_recordno = intacct_objects[-1]["RECORDNO"]
+
+    async def get_entity_page(
+        self, *, object_type: str, fields: List[str], filter={}, pagesize=1000, after=None
+    ) -> Tuple[List[Dict], int]:
+        """
+        Reads the page of objects of a single type after the RECORDNO `after`, the first page by default.
+
+        Returns:
+            The objects of the page, in object_type schema, and the number of objects after them.
+        """
+        intacct_object_type = INTACCT_OBJECTS[object_type]
+        data = self._entity_keyset_request(intacct_object_type, fields, pagesize, after, filter)
+        response = await self.format_and_send_request(data)
+        return self._entity_objects(response, intacct_object_type), int(response["data"].get("@numremaining", 0))
+
+    async def get_sample(self, intacct_object: str):
+        data = {
+            "readByQuery": {
+                "object": intacct_object.upper(),
+                "fields": "*",
+                "query": None,
+                "pagesize": "10",
+            }
+        }
+
+        return (await self.format_and_send_request(data))["data"][intacct_object.lower()]
+
+    async def get_definition(self, intacct_object: str):
+        data = {"lookup": {"object": intacct_object.upper()}}
+        return await self.format_and_send_request(data)
+
+    async def get_data(self, intacct_object: str):
+        data = {"read": {"object": intacct_object.upper(), "keys": 5, "fields": "*"}}
+        return await self.format_and_send_request(data)
+
+    async def post_journal(self, journal):
+        """
+        Post journal to Intacct
+        """
+        return await self.format_and_send_request(self._journal_request(journal))
+
+    async def delete_journal(self, recordno):
+        data = {"delete": {"object": "GLBATCH", "keys": recordno}}
+        return await self.format_and_send_request(data)
+
+    async def query_entity(self, object_type: str, fields: set[str], filters={}):
+        intacct_object_type = INTACCT_OBJECTS[object_type]
+        data = self._query_entity_request(intacct_object_type, fields, filters)
+
+        entities = await self.format_and_send_request(data)
+        return self._query_entity_objects(entities, intacct_object_type)
+
+
+async def get_async_client(
+    *,
+    api_url: str,
+    company_id: str,
+    sender_id: str,
+    sender_password: str,
+    user_id: str,
+    user_password: str,
+    headers: Dict,
+    use_locations: bool,
+    location_id: str,
+    pool_size: int = 100,
+    warm_connections: int = 1,
+    request_logger: RequestLogger = None,
+    session_cache: SessionCache = None,
+    rate_limiter: RateLimiter = None,
+    idempotent: bool = False,
+    compress_requests: bool = False,
+) -> AsyncSageIntacctSDK:
+    """
+    Initializes, logs in and returns an AsyncSageIntacctSDK object.
+    """
+    connection = AsyncSageIntacctSDK(
+        api_url=api_url,
+        company_id=company_id,
+        sender_id=sender_id,
+        sender_password=sender_password,
+        user_id=user_id,
+        user_password=user_password,
+        headers=headers,
+        use_locations=use_locations,
+        location_id=location_id,
+        pool_size=pool_size,
+        warm_connections=warm_connections,
+        request_logger=request_logger,
+        session_cache=session_cache,
+        rate_limiter=rate_limiter,
+        idempotent=idempotent,
+        compress_requests=compress_requests,
+    )
+    await connection.login()
+
+    return connection
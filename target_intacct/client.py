@@ -1,22 +1,30 @@
 """
 API Base class with util functions
 """
+import collections
+import contextlib
 import datetime as dt
-import json
+import functools
+import gzip
+import hashlib
 import re
+import threading
+import time
 import uuid
-from typing import Dict, List, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple, Union
 from urllib.parse import unquote
 import xml
 
 import requests
+from requests.adapters import HTTPAdapter
 import singer
 import xmltodict
 import logging
 import backoff
-import copy
 
 from target_intacct.exceptions import (
+    DuplicateRequestError,
     ExpiredTokenError,
     InternalServerError,
     InvalidTokenError,
@@ -28,7 +36,22 @@ from target_intacct.exceptions import (
     InvalidXMLResponseError
 )
 
-from .const import GET_BY_DATE_FIELD, INTACCT_OBJECTS
+from .concurrency import ConcurrencyController
+from .const import (
+    BATCH_MAX_BYTES,
+    BATCH_MAX_FUNCTIONS,
+    COMPRESS_MIN_BYTES,
+    DUPLICATE_CONTROLID_ERRORS,
+    GET_BY_DATE_FIELD,
+    INTACCT_OBJECTS,
+    PAGE_MAX_TRIES,
+    SESSION_DEFAULT_TTL,
+    SESSION_REFRESH_MARGIN,
+)
+from .request_logging import RequestLogger, clean_creds
+from .rate_limit import RateLimiter, get_rate_limiter
+from .sessions import SessionCache, get_session_cache, session_key
+from .xml_serializer import EnvelopeTemplate, unparse, unparse_fragment
 
 
 def _format_date_for_intacct(datetime: dt.datetime) -> str:
@@ -43,6 +66,25 @@ def _format_date_for_intacct(datetime: dt.datetime) -> str:
     return datetime.strftime("%m/%d/%Y %H:%M:%S")
 
 
+def rate_limited(func):
+    """
+    Waits for the client rate limiter before each call, slows it down when the
+    API is overloaded and speeds it back up on success.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        self.rate_limiter.acquire()
+        try:
+            result = func(self, *args, **kwargs)
+        except TemporaryServerError:
+            self.rate_limiter.on_throttle()
+            raise
+        self.rate_limiter.on_success()
+        return result
+
+    return wrapper
+
+
 class SageIntacctSDK:
     """The base class for all API classes."""
 
@@ -56,7 +98,16 @@ class SageIntacctSDK:
         user_password: str,
         headers: Dict,
         use_locations: bool,
-        location_id: str
+        location_id: str,
+        pool_size: int = 10,
+        warm_connections: int = 1,
+        request_logger: RequestLogger = None,
+        page_parallelism: int = 1,
+        session_cache: SessionCache = None,
+        rate_limiter: RateLimiter = None,
+        concurrency: ConcurrencyController = None,
+        idempotent: bool = False,
+        compress_requests: bool = False,
     ):
         self.__api_url = api_url
         self.__company_id = company_id
@@ -67,6 +118,24 @@ class SageIntacctSDK:
         self.__headers = headers
         self.__use_locations = use_locations
         self.__location_id = location_id
+        self.__pool_size = pool_size
+        self.__page_parallelism = page_parallelism
+        self.__request_logger = request_logger or RequestLogger()
+        self.__session_cache = session_cache or get_session_cache()
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.__concurrency = concurrency
+        self.__idempotent = idempotent
+        self.__envelope = EnvelopeTemplate(sender_id, sender_password)
+        self.__compress_requests = compress_requests
+        self.__transfer_lock = threading.Lock()
+        self.__transfer = {"bytes_sent": 0, "wire_bytes_sent": 0, "bytes_received": 0, "wire_bytes_received": 0}
+        self.__session_key = session_key(
+            api_url, sender_id, company_id, user_id, location_id if use_locations else None
+        )
+        self.__session_id = None
+        self.__session_expires_at = 0
+        self.__session_lock = threading.RLock()
+        self.__http_session = self._build_http_session(pool_size)
 
         """
         Initialize connection to Sage Intacct
@@ -75,14 +144,171 @@ class SageIntacctSDK:
         :param user_id: Sage Intacct user id
         :param company_id: Sage Intacct company id
         :param user_password: Sage Intacct user password
+        :param pool_size: max number of keep-alive connections kept per host
+        :param warm_connections: connections to open to the API endpoint after login
+        :param request_logger: logs the requests and responses, everything is logged by default
+        :param page_parallelism: entity pages fetched concurrently, 1 reads them one after the other
+        :param session_cache: where the API sessions are shared, in memory by default
+        :param rate_limiter: limits the requests sent, shared by the clients of the process by default
+        :param concurrency: adapts the requests in flight per object type, unlimited by default
+        :param idempotent: derive the request controlid from the function controlids and set
+            uniqueid on single-function requests, so Intacct rejects their replay with a
+            DuplicateRequestError
+        :param compress_requests: gzip the request bodies, for gateways accepting them
         """
         # Initializing variables
-        self._set_session_id(
-            user_id=self.__user_id,
-            company_id=self.__company_id,
-            user_password=self.__user_password,
-            location_id=self.__location_id
+        self._connect(warm_connections)
+
+    def _connect(self, warm_connections: int) -> None:
+        """
+        Logs in, or reuses a cached session, and warms the connection pool.
+        """
+        self._ensure_session()
+        self.warm_connections(warm_connections)
+
+    def _ensure_session(self) -> None:
+        """
+        Makes sure the client has a session that doesn't expire soon, logging in if needed.
+        """
+        with self.__session_lock:
+            if not self._load_cached_session():
+                self._set_session_id(**self._login_kwargs())
+
+    def _load_cached_session(self) -> bool:
+        """
+        Returns whether the current session, or else the cached one, is still valid for a while.
+        """
+        with self.__session_lock:
+            if self.__session_id and self.__session_expires_at - time.time() > SESSION_REFRESH_MARGIN:
+                return True
+            session = self.__session_cache.get(self.__session_key)
+            if session and session["expires_at"] - time.time() > SESSION_REFRESH_MARGIN:
+                self.__api_url = session["endpoint"]
+                self.__session_id = session["sessionid"]
+                self.__session_expires_at = session["expires_at"]
+                return True
+            return False
+
+    def _invalidate_session(self, sessionid: str) -> None:
+        """
+        Drops a session the API rejected, unless another thread already replaced it.
+        """
+        with self.__session_lock:
+            if self.__session_id == sessionid:
+                self.__session_cache.invalidate(self.__session_key, sessionid)
+                self.__session_id = None
+                self.__session_expires_at = 0
+
+    def _post_with_session(self, functions: List[Dict], raise_result_errors=True) -> Dict:
+        """
+        Posts functions with the API session, logging in again once if it expired or was revoked.
+        """
+        self._ensure_session()
+        dict_body, api_url = self._prepare_request(functions)
+        try:
+            return self._post_request(dict_body, api_url, raise_result_errors)
+        except (ExpiredTokenError, InvalidTokenError) as e:
+            logging.info(f"API session rejected, logging in again: {e}")
+            self._invalidate_session(dict_body["request"]["operation"]["authentication"]["sessionid"])
+            self._ensure_session()
+            dict_body, api_url = self._prepare_request(functions)
+            return self._post_request(dict_body, api_url, raise_result_errors)
+
+    def _login_kwargs(self) -> Dict:
+        """
+        Returns the credentials used to open an API session.
+        """
+        return {
+            "user_id": self.__user_id,
+            "company_id": self.__company_id,
+            "user_password": self.__user_password,
+            "location_id": self.__location_id,
+        }
+
+    @property
+    def data_scope(self) -> str:
+        """
+        Key of the company, user and location the client sees the objects of,
+        the reference tables it reads are the same for the clients of a scope.
+        """
+        return self.__session_key
+
+    def _build_http_session(self, pool_size: int) -> requests.Session:
+        """
+        Creates the pooled keep-alive HTTP session shared by every request of this client.
+
+        The pool blocks when all connections are busy, so concurrent callers
+        wait for a free connection instead of opening throwaway ones.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True
         )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def warm_connections(self, count: int) -> None:
+        """
+        Opens up to `count` keep-alive connections to the API endpoint so the
+        first requests don't pay for the TCP and TLS handshakes.
+
+        Each HEAD request is streamed, so it holds its connection until its
+        (empty) body is read and the next one has to open a new connection.
+        Reading the bodies then puts every connection back in the pool.
+        """
+        count = min(count or 0, self.__pool_size)
+        if count <= 0:
+            return
+        responses = []
+        try:
+            for _ in range(count):
+                responses.append(self.__http_session.head(self._endpoint(), headers=self.__headers, stream=True, timeout=10))
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"Could not warm connections to {self._endpoint()}: {e}")
+        finally:
+            for response in responses:
+                response.content
+
+    def get_connection_stats(self) -> Dict:
+        """
+        Reports how many requests were sent and how many connections were opened
+        to serve them, so connection reuse can be checked.
+
+        Returns:
+            Dict with the requests, connections and reused counts.
+        """
+        stats = {"requests": 0, "connections": 0}
+        for adapter in set(self.__http_session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                stats["requests"] += pool.num_requests
+                stats["connections"] += pool.num_connections
+        stats["reused"] = max(stats["requests"] - stats["connections"], 0)
+        stats.update(self._transfer_stats())
+        return stats
+
+    def _count_transfer(self, url: str, sent: int, wire_sent: int, received: int, wire_received: int) -> None:
+        """
+        Adds the bytes of a request and its response, before and after compression, to the stats.
+        """
+        with self.__transfer_lock:
+            self.__transfer["bytes_sent"] += sent
+            self.__transfer["wire_bytes_sent"] += wire_sent
+            self.__transfer["bytes_received"] += received
+            self.__transfer["wire_bytes_received"] += wire_received
+        self.__request_logger.log_transfer(url, sent, wire_sent, received, wire_received)
+
+    def _transfer_stats(self) -> Dict:
+        with self.__transfer_lock:
+            return dict(self.__transfer)
+
+    def close(self) -> None:
+        """Closes the pooled connections of this client."""
+        self.__http_session.close()
 
     @backoff.on_exception(
         backoff.expo,
@@ -97,11 +323,19 @@ class SageIntacctSDK:
         max_tries=8,
         factor=3,
     )
-    @singer.utils.ratelimit(10, 1)
+    @rate_limited
     def _set_session_id(self, user_id: str, company_id: str, user_password: str, location_id = None):
         """
         Sets the session id for APIs
         """
+        dict_body = self._build_login_request(user_id, company_id, user_password, location_id)
+        response = self._post_request(dict_body, self._endpoint())
+        self._set_session_details(response)
+
+    def _build_login_request(self, user_id: str, company_id: str, user_password: str, location_id = None) -> Dict:
+        """
+        Builds the getAPISession request authenticated with the user credentials.
+        """
         login = {
                     "userid": user_id,
                     "companyid": company_id,
@@ -112,7 +346,7 @@ class SageIntacctSDK:
             login["locationid"] = location_id
         
         timestamp = dt.datetime.now()
-        dict_body = {
+        return {
             "request": {
                 "control": {
                     "senderid": self.__sender_id,
@@ -136,97 +370,154 @@ class SageIntacctSDK:
             }
         }
 
-        response = self._post_request(dict_body, self.__api_url)
-
+    def _set_session_details(self, response: Dict) -> None:
+        """
+        Stores the session id and endpoint returned by getAPISession, and caches them.
+        """
         if response["authentication"]["status"] == "success":
             session_details = response["result"]["data"]["api"]
-            self.__api_url = session_details["endpoint"]
-            self.__session_id = session_details["sessionid"]
+            try:
+                expires_at = dt.datetime.fromisoformat(response["authentication"]["sessiontimeout"]).timestamp()
+            except (KeyError, TypeError, ValueError):
+                expires_at = time.time() + SESSION_DEFAULT_TTL
+            with self.__session_lock:
+                self.__api_url = session_details["endpoint"]
+                self.__session_id = session_details["sessionid"]
+                self.__session_expires_at = expires_at
+                self.__session_cache.set(self.__session_key, {
+                    "sessionid": self.__session_id,
+                    "endpoint": self.__api_url,
+                    "expires_at": expires_at,
+                })
 
         else:
             raise SageIntacctSDKError("Error: {0}".format(response["errormessage"]))
-        
+
     def clean_creds(self, key_field: str, request_body: dict):
-        request_body = request_body.copy()
-        if request_body.get(key_field, {}).get("control", {}):
-            for key, _ in request_body[key_field]["control"].items():
-                request_body[key_field]["control"][key] = "***"
-        
-        if request_body.get(key_field, {}).get("operation", {}).get("authentication", {}):
-            for key, _ in request_body[key_field]["operation"]["authentication"].items():
-                request_body[key_field]["operation"]["authentication"][key] = "***"
-        
-        return request_body
+        """
+        Masks the control and authentication blocks of a request or response.
+        """
+        return clean_creds(key_field, request_body)
 
-    def _post_request(self, dict_body: dict, api_url: str) -> Dict:
+    def _post_request(self, dict_body: dict, api_url: str, raise_result_errors=True) -> Dict:
         """
         Create a HTTP post request.
 
         Parameters:
             dict_body (dict): HTTP POST body data for the wanted API.
             api_url (str): Url for the wanted API.
+            raise_result_errors (bool): raise when a function result failed, otherwise
+                return the operation so the caller can inspect each result.
 
         Returns:
             A response from the request (dict).
         """
 
-        api_headers = {"content-type": "application/xml"}
-        api_headers.update(self.__headers)
-        body = xmltodict.unparse(dict_body).encode('utf-8')
+        body = self._serialize_request(dict_body)
+        data, headers = self._encode_body(body)
         try:
             # 60 seconds timeout to overcome hanging requests
-            response = requests.post(api_url, headers=api_headers, data=body, timeout=60)
+            response = self.__http_session.post(api_url, headers=headers, data=data, timeout=60)
         except requests.exceptions.Timeout as e:
             # Raise a TemporaryServerError if the request times out and we should retry
             raise TemporaryServerError(f"Request timed out: {e}")
 
-        clean_body = self.clean_creds("request", dict_body)
+        content = response.content
+        # bytes read from the socket, before the gzip/deflate decoding
+        wire_received = response.raw.tell() if hasattr(response.raw, "tell") else len(content)
+        self._count_transfer(api_url, len(body), len(data), len(content), wire_received or len(content))
+
+        return self._handle_response(
+            dict_body, body, response.status_code, response.text, response.url, raise_result_errors
+        )
+
+    def _request_headers(self) -> Dict:
+        # requests already asks for gzip and deflate encoded responses
+        api_headers = {"content-type": "application/xml"}
+        api_headers.update(self.__headers)
+        return api_headers
+
+    def _encode_body(self, body: bytes) -> Tuple[bytes, Dict]:
+        """
+        Returns the body to send and the request headers, gzipping large bodies when enabled.
+        """
+        headers = self._request_headers()
+        if self.__compress_requests and len(body) >= COMPRESS_MIN_BYTES:
+            headers["content-encoding"] = "gzip"
+            return gzip.compress(body, compresslevel=5), headers
+        return body, headers
+
+    def _serialize_request(self, dict_body: dict) -> bytes:
+        """
+        Serializes a request, same bytes as xmltodict.unparse(dict_body) in utf-8.
+        """
+        if self.__envelope.matches(dict_body):
+            return self.__envelope.render(dict_body)
+        return unparse(dict_body)
+
+    def _handle_response(
+        self, dict_body: dict, body: bytes, status_code: int, text: str, url: str, raise_result_errors=True
+    ) -> Dict:
+        """
+        Parses the response of a request and raises the matching error.
+
+        Parameters:
+            dict_body (dict): HTTP POST body data sent.
+            body (bytes): serialized HTTP POST body sent.
+            status_code (int): HTTP status code of the response.
+            text (str): raw response text.
+            url (str): url the request was sent to.
+            raise_result_errors (bool): raise when a function result failed.
+
+        Returns:
+            The operation of the response (dict).
+        """
+        # attachments are base64 blobs, too large to be logged
+        has_attachments = b"attachmentdata" in body
+        sampled = not has_attachments and self.__request_logger.sample()
+        self.__request_logger.log_request(dict_body, len(body), status_code, sampled)
+
 
-        if not "attachmentdata" in str(body):
-            logging.info(f"Raw response {clean_body} with status code {response.status_code}")
-        
         # Check for Cloudflare or other HTML error pages
-        if response.status_code >= 500 and "<!DOCTYPE html>" in response.text:
-            if "Error code 500" in response.text:
+        if status_code >= 500 and "<!DOCTYPE html>" in text:
+            if "Error code 500" in text:
                 logging.error("Received Cloudflare 500 error page instead of XML response")
                 raise TemporaryServerError(
                     "Cloudflare returned a 500 error - the Sage Intacct API server may be experiencing issues",
                     "Trying again!"
                 )
             else:
-                logging.error(f"Received HTML error page instead of XML response (status code: {response.status_code})")
+                logging.error(f"Received HTML error page instead of XML response (status code: {status_code})")
                 raise TemporaryServerError(
-                    f"Received HTML error page instead of XML response (HTTP {response.status_code})",
-                    response.text
+                    f"Received HTML error page instead of XML response (HTTP {status_code})",
+                    text
                 )
 
-        if response.status_code in [503, 504]:
-            raise TemporaryServerError(f"Server temporarily unavailable (HTTP {response.status_code})", response.text)
+        if status_code in [503, 504]:
+            raise TemporaryServerError(f"Server temporarily unavailable (HTTP {status_code})", text)
 
         try:
-            parsed_xml = xmltodict.parse(response.text)
-            parsed_response = json.loads(json.dumps(parsed_xml))
+            # plain dicts straight from the parser, no need for a json round-trip
+            parsed_response = xmltodict.parse(text, dict_constructor=dict)
         except xml.parsers.expat.ExpatError:
-            raise InvalidXMLResponseError(f"Error: {response.text}, Status code: {response.status_code}")
+            raise InvalidXMLResponseError(f"Error: {text}, Status code: {status_code}")
         except:
-            raise Exception(f"Error: {response.text}, Status code: {response.status_code}")
+            raise Exception(f"Error: {text}, Status code: {status_code}")
         
-        clean_parsed_response = copy.deepcopy(parsed_response)
-        clean_parsed_response = self.clean_creds("response", clean_parsed_response)
-
-        if "attachmentdata" in str(body):
-            logging.info(f"response with status code {response.status_code} for request to {response.url}")
-        else:
-            logging.info(f"parsed response {clean_parsed_response} with status code {response.status_code} for request to {response.url}")
+        self.__request_logger.log_response(parsed_response, len(text), status_code, url, sampled)
 
         #getting the errors
         res = parsed_response["response"]
+        error = {}
         if res.get("errormessage"):
             error = res.get("errormessage")
         elif res.get("operation"):
-            error = res.get("operation").get("result", {}).get("errormessage", {})
+            result = res.get("operation").get("result", {})
+            # multi-function requests return a list of results
+            if isinstance(result, dict):
+                error = result.get("errormessage", {})
 
-        if response.status_code == 200:
+        if status_code == 200:
             if parsed_response["response"]["control"]["status"] == "success":
                 api_response = parsed_response["response"]["operation"]
 
@@ -234,8 +525,12 @@ class SageIntacctSDK:
                 exception_msg = self.decode_support_id(
                     parsed_response["response"]["errormessage"]
                 )
+                if self.__idempotent and self._is_duplicate_request(parsed_response["response"]):
+                    raise DuplicateRequestError(
+                        f"Request {dict_body['request']['control']['controlid']} was already sent", exception_msg
+                    )
                 raise WrongParamsError(
-                    "Some of the parameters are wrong. Raw response text:" + response.text, exception_msg
+                    "Some of the parameters are wrong. Raw response text:" + text, exception_msg
                 )
 
             if api_response["authentication"]["status"] == "failure":
@@ -244,36 +539,47 @@ class SageIntacctSDK:
                     api_response["errormessage"],
                 )
 
+            if not raise_result_errors:
+                return api_response
+
             if api_response["result"]["status"] == "success":
                 return api_response
 
-        if response.status_code == 400:
+        if status_code == 400:
             raise WrongParamsError(
-                "Some of the parameters are wrong. Raw response text:" + response.text, error
+                "Some of the parameters are wrong. Raw response text:" + text, error
             )
 
-        if response.status_code == 401:
+        if status_code == 401:
             raise InvalidTokenError(
                 "Invalid token / Incorrect credentials", error
             )
 
-        if response.status_code == 403:
+        if status_code == 403:
             raise NoPrivilegeError(
                 "Forbidden, the user has insufficient privilege", error
             )
 
-        if response.status_code == 404:
+        if status_code == 404:
             raise NotFoundItemError("Not found item with ID", error)
 
-        if response.status_code == 498:
+        if status_code == 498:
             raise ExpiredTokenError("Expired token, try to refresh it", error)
 
-        if response.status_code == 500:
+        if status_code == 500:
             raise InternalServerError("Internal server error", error)
 
-        logging.info("Error while sending request data: {0}".format(clean_body))
+        self.__request_logger.log_failed_request(dict_body)
         raise SageIntacctSDKError("Error: {0}".format(error))
 
+    def _is_duplicate_request(self, response: Dict) -> bool:
+        """
+        Returns whether the request was rejected because its controlid was already used.
+        """
+        errors = response.get("errormessage", {}).get("error", [])
+        errors = errors if isinstance(errors, list) else [errors]
+        return any(error.get("errorno") in DUPLICATE_CONTROLID_ERRORS for error in errors)
+
     def support_id_msg(self, errormessages) -> Union[List, Dict]:
         """
         Finds whether the error messages is list / dict and assign type and error assignment.
@@ -306,8 +612,9 @@ class SageIntacctSDK:
         """
         support_id_msg = self.support_id_msg(errormessages)
         data_type = support_id_msg["type"]
-        error = support_id_msg["error"]
-        if error and error["description2"]:
+        error = support_id_msg.get("error")
+        message = None
+        if error and error.get("description2"):
             message = error["description2"]
             support_id = re.search("Support ID: (.*)]", message)
             if support_id and support_id.group(1):
@@ -321,70 +628,242 @@ class SageIntacctSDK:
 
         return errormessages
 
-    @backoff.on_exception(
-        backoff.expo,
-        (
-            ConnectionError,
-            ConnectionResetError,
-            requests.exceptions.ConnectionError,
-            requests.exceptions.RequestException,
-            InternalServerError,
-            TemporaryServerError
-        ),
-        max_tries=8,
-        factor=3,
-    )
-    @singer.utils.ratelimit(10, 1)
-    def format_and_send_request(self, data: Dict, use_payload=False) -> Union[List, Dict]:
+    def _build_function(self, data: Dict, use_payload=False, controlid: str = None) -> Tuple[str, Dict]:
         """
-        Format data accordingly to convert them to xml.
+        Builds the <function> block for a single create, update, query, etc.
 
         Parameters:
             data (dict): HTTP POST body data for the wanted API.
+            use_payload (bool): send the object payload instead of the full action body.
+            controlid (str): controlid of the function, a random one is used when missing.
 
         Returns:
-            A response from the _post_request (dict).
+            The object type and the function dict.
         """
-        _data = data.copy()
-        key = next(iter(_data))
+        key = next(iter(data))
+        # copy the action body so retries can rebuild the function from the original data
+        _data = {key: dict(data[key])}
         try:
             object_type = _data[key]["object"]
         except:
             object_type = _data[key]["@object"]
-        logging.info(f"Creating request with object_type: {object_type} and action {_data[key]}")
+        self.__request_logger.log_function(object_type, _data[key])
 
         # Remove object entry if unnecessary
         if "create" in key or "update" in key or "delete" in key or key in ["create", "update", "delete"]:
             _data[key].pop("object", None)
 
-        timestamp = dt.datetime.now()
-
         payload_data = _data[key]
         if use_payload:
             payload_data = _data[key][object_type.upper()]
 
-        dict_body = {
+        function = {"@controlid": controlid or str(uuid.uuid4()), key: payload_data}
+        return object_type, function
+
+    def _build_request(self, functions: List[Dict]) -> Dict:
+        """
+        Wraps one or more functions in a request envelope authenticated with the session id.
+        """
+        if self.__idempotent:
+            # the same functions always make the same request
+            controlids = "|".join(function["@controlid"] for function in functions)
+            controlid = hashlib.sha256(controlids.encode("utf-8")).hexdigest()
+        else:
+            controlid = dt.datetime.now()
+        # the controlid is checked for the whole request, a replayed batch
+        # would be rejected even for the functions that failed the first time
+        unique = self.__idempotent and len(functions) == 1
+
+        return {
             "request": {
                 "control": {
                     "senderid": self.__sender_id,
                     "password": self.__sender_password,
-                    "controlid": timestamp,
-                    "uniqueid": False,
+                    "controlid": controlid,
+                    "uniqueid": unique,
                     "dtdversion": 3.0,
                     "includewhitespace": False,
                 },
                 "operation": {
                     "authentication": {"sessionid": self.__session_id},
                     "content": {
-                        "function": {"@controlid": str(uuid.uuid4()), key: payload_data}
+                        "function": functions[0] if len(functions) == 1 else functions
                     },
                 },
             }
         }
-        with singer.metrics.http_request_timer(endpoint=object_type):
-            response = self._post_request(dict_body, self.__api_url)
+
+    def _endpoint(self) -> str:
+        """
+        Returns the API url, which is the session endpoint once logged in.
+        """
+        with self.__session_lock:
+            return self.__api_url
+
+    def _prepare_request(self, functions: List[Dict]) -> Tuple[Dict, str]:
+        """
+        Builds the request for the current session and returns it with the session endpoint.
+        """
+        with self.__session_lock:
+            return self._build_request(functions), self.__api_url
+
+    @backoff.on_exception(
+        backoff.expo,
+        (
+            ConnectionError,
+            ConnectionResetError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.RequestException,
+            InternalServerError,
+            TemporaryServerError
+        ),
+        max_tries=8,
+        factor=3,
+    )
+    @rate_limited
+    def format_and_send_request(self, data: Dict, use_payload=False, controlid: str = None) -> Union[List, Dict]:
+        """
+        Format data accordingly to convert them to xml.
+
+        Parameters:
+            data (dict): HTTP POST body data for the wanted API.
+            controlid (str): controlid of the function, a random one is used when missing.
+
+        Returns:
+            A response from the _post_request (dict).
+        """
+        object_type, function = self._build_function(data, use_payload, controlid)
+
+        with self._request_slot(object_type), singer.metrics.http_request_timer(endpoint=object_type):
+            response = self._post_with_session([function])
         return response["result"]
 
+    def format_and_send_batch(
+        self,
+        functions: List[Dict],
+        use_payload=False,
+        controlids: List[str] = None,
+        max_functions: int = BATCH_MAX_FUNCTIONS,
+        max_bytes: int = BATCH_MAX_BYTES,
+    ) -> Dict[str, Union[Dict, SageIntacctSDKError]]:
+        """
+        Sends many functions packed in as few requests as the limits allow.
+
+        Functions are not wrapped in a transaction, so a failing function
+        doesn't roll back the rest of the batch.
+
+        Parameters:
+            functions (list): HTTP POST body data for each wanted API, same shape as in format_and_send_request.
+            use_payload (bool): send the object payload instead of the full action body.
+            controlids (list): controlid for each function, random ones are used when missing.
+            max_functions (int): max number of functions sent in a single request.
+            max_bytes (int): max size of the functions sent in a single request.
+
+        Returns:
+            Dict keyed by controlid, in the same order as functions, with the result
+            of each successful function or the SageIntacctSDKError of each failed one.
+        """
+        results = {}
+        for chunk in self._chunk_functions(functions, use_payload, controlids, max_functions, max_bytes):
+            results.update(self._send_batch(chunk))
+        return results
+
+    def _chunk_functions(
+        self,
+        functions: List[Dict],
+        use_payload: bool,
+        controlids: List[str],
+        max_functions: int,
+        max_bytes: int,
+    ) -> List[List[Tuple[str, Dict]]]:
+        """
+        Builds the functions of a batch and groups them in chunks within the request limits.
+        """
+        if controlids and len(controlids) != len(functions):
+            raise ValueError("controlids must have the same length as functions")
+
+        chunks = []
+        chunk, chunk_bytes = [], 0
+        for index, data in enumerate(functions):
+            object_type, function = self._build_function(
+                data, use_payload, controlids[index] if controlids else None
+            )
+            size = len(unparse_fragment("function", function))
+            if chunk and (len(chunk) >= max_functions or chunk_bytes + size > max_bytes):
+                chunks.append(chunk)
+                chunk, chunk_bytes = [], 0
+            chunk.append((object_type, function))
+            chunk_bytes += size
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    @backoff.on_exception(
+        backoff.expo,
+        (
+            ConnectionError,
+            ConnectionResetError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.RequestException,
+            InternalServerError,
+            TemporaryServerError
+        ),
+        max_tries=8,
+        factor=3,
+    )
+    @rate_limited
+    def _send_batch(self, chunk: List[Tuple[str, Dict]]) -> Dict[str, Union[Dict, SageIntacctSDKError]]:
+        """
+        Sends a single multi-function request and splits its results by controlid.
+        """
+        endpoint = self._batch_endpoint(chunk)
+        with self._request_slot(endpoint), singer.metrics.http_request_timer(endpoint=endpoint):
+            response = self._post_with_session([function for _, function in chunk], raise_result_errors=False)
+
+        return self._split_batch_results(chunk, response)
+
+    def _request_slot(self, object_type: str):
+        """
+        Waits for the concurrency controller to let a request of object_type in.
+        """
+        if self.__concurrency is None:
+            return contextlib.nullcontext()
+        return self.__concurrency.slot(object_type)
+
+    def _batch_endpoint(self, chunk: List[Tuple[str, Dict]]) -> str:
+        object_types = {object_type for object_type, _ in chunk}
+        return next(iter(object_types)) if len(object_types) == 1 else "batch"
+
+    def _split_batch_results(
+        self, chunk: List[Tuple[str, Dict]], response: Dict
+    ) -> Dict[str, Union[Dict, SageIntacctSDKError]]:
+        """
+        Splits the results of a multi-function request by controlid.
+        """
+        results = response["result"]
+        if isinstance(results, dict):
+            results = [results]
+        results = {result.get("controlid"): result for result in results}
+
+        batch_results = {}
+        for _, function in chunk:
+            controlid = function["@controlid"]
+            result = results.get(controlid)
+            if result is None:
+                batch_results[controlid] = SageIntacctSDKError(
+                    f"No result returned for function with controlid {controlid}"
+                )
+            elif result.get("status") == "success":
+                batch_results[controlid] = result
+            else:
+                # the same message as the error raised for a single function
+                errormessage = result.get("errormessage")
+                message = "Error: {0}".format(errormessage)
+                if errormessage:
+                    errormessage = self.decode_support_id(errormessage)
+                batch_results[controlid] = WrongParamsError(message, errormessage)
+        return batch_results
+
     def get_entity(self, *, object_type: str, fields: List[str], filter={}, docparid=None) -> List[Dict]:
         """
         Get multiple objects of a single type from Sage Intacct.
@@ -392,8 +871,107 @@ class SageIntacctSDK:
         Returns:
             List of Dict in object_type schema.
         """
+        if filter:
+            intacct_object_type = INTACCT_OBJECTS[object_type]
+            get_count = self._entity_count_request(intacct_object_type, filter, docparid)
+            response = self.format_and_send_request(get_count)
+            return response["data"].get(intacct_object_type)
+
+        return list(self.iter_entity(object_type=object_type, fields=fields))
+
+    def count_entity(self, *, object_type: str, filter={}) -> int:
+        """
+        Counts the objects of a single type, matching filter when given.
+        """
         intacct_object_type = INTACCT_OBJECTS[object_type]
-        total_intacct_objects = []
+        response = self.format_and_send_request(self._entity_count_request(intacct_object_type, filter))
+        return int(response["data"]["@totalcount"])
+
+    def iter_entity(
+        self, *, object_type: str, fields: List[str], filter={}, pagesize=1000, parallelism=None, after=None
+    ) -> Iterator[Dict]:
+        """
+        Iterates over the objects of a single type, one page at a time.
+
+        The pages are read in RECORDNO order, each one starting after the last
+        RECORDNO of the previous page, so no count request is needed and only
+        the current page is kept in memory. With `after`, the objects start
+        after that RECORDNO, e.g. the last one of a page read with get_entity_page.
+
+        With parallelism > 1 the objects are counted first and up to
+        `parallelism` offset pages are fetched at once, see _iter_entity_pages.
+
+        Returns:
+            Iterator of Dict in object_type schema.
+        """
+        intacct_object_type = INTACCT_OBJECTS[object_type]
+        parallelism = parallelism or self.__page_parallelism
+        if parallelism > 1:
+            filter = self._filter_after(filter, after)
+            yield from self._iter_entity_pages(intacct_object_type, fields, filter, pagesize, parallelism)
+            return
+
+        last_recordno = after
+        while True:
+            intacct_objects, remaining = self.get_entity_page(
+                object_type=object_type, fields=fields, filter=filter, pagesize=pagesize, after=last_recordno
+            )
+            yield from intacct_objects
+
+            if not intacct_objects or remaining <= 0:
+                return
+            last_recordno = intacct_objects[-1]["RECORDNO"]
+
+    def get_entity_page(
+        self, *, object_type: str, fields: List[str], filter={}, pagesize=1000, after=None
+    ) -> Tuple[List[Dict], int]:
+        """
+        Reads the page of objects of a single type after the RECORDNO `after`,
+        the first page by default, see iter_entity.
+
+        Returns:
+            The objects of the page, in object_type schema, and the number of objects after them.
+        """
+        intacct_object_type = INTACCT_OBJECTS[object_type]
+        data = self._entity_keyset_request(intacct_object_type, fields, pagesize, after, filter)
+        response = self.format_and_send_request(data)
+        return self._entity_objects(response, intacct_object_type), int(response["data"].get("@numremaining", 0))
+
+    def _filter_after(self, filter: Dict, last_recordno: str = None) -> Dict:
+        """filter narrowed to the objects after last_recordno."""
+        conditions = dict(filter.get("filter", {}))
+        if last_recordno is not None:
+            after = {"field": "RECORDNO", "value": last_recordno}
+            if "greaterthan" in conditions:
+                previous = conditions["greaterthan"]
+                after = [*previous, after] if isinstance(previous, list) else [previous, after]
+            conditions["greaterthan"] = after
+        # more than one condition, or the same condition repeated, have to be combined
+        if len(conditions) > 1 or any(isinstance(value, list) for value in conditions.values()):
+            conditions = {"and": conditions}
+        return {"filter": conditions} if conditions else {}
+
+    def _entity_keyset_request(
+        self,
+        intacct_object_type: str,
+        fields: List[str],
+        pagesize: int,
+        last_recordno: str = None,
+        filter={},
+    ) -> Dict:
+        # RECORDNO is the pagination key, it has to be selected
+        fields = list(fields) if "RECORDNO" in fields else ["RECORDNO", *fields]
+        filter = self._filter_after(filter, last_recordno)
+
+        query = {"object": intacct_object_type, "select": {"field": fields}}
+        if filter:
+            query["filter"] = filter["filter"]
+        query["orderby"] = {"order": {"field": "RECORDNO", "ascending": None}}
+        query["options"] = {"showprivate": "true"}
+        query["pagesize"] = pagesize
+        return {"query": query}
+
+    def _entity_count_request(self, intacct_object_type: str, filter={}, docparid=None) -> Dict:
         get_count = {
             "query": {
                 "object": intacct_object_type,
@@ -409,36 +987,79 @@ class SageIntacctSDK:
         if docparid:
             get_count["docparid"] = docparid
 
-        response = self.format_and_send_request(get_count)
-
-        if filter:
-            response = response["data"].get(INTACCT_OBJECTS[object_type])
-            return response
-
-        count = int(response["data"]["@totalcount"])
-        pagesize = 1000
-        offset = 0
-        for _i in range(0, count, pagesize):
-            data = {
-                "query": {
-                    "object": intacct_object_type,
-                    "select": {"field": fields},
-                    "options": {"showprivate": "true"},
-                    "pagesize": pagesize,
-                    "offset": offset,
-                }
-            }
-            intacct_objects = self.format_and_send_request(data)["data"][
-                intacct_object_type
-            ]
-            # When only 1 object is found, Intacct returns a dict, otherwise it returns a list of dicts.
-            if isinstance(intacct_objects, dict):
-                intacct_objects = [intacct_objects]
+        return get_count
 
-            total_intacct_objects = total_intacct_objects + intacct_objects
+    def _iter_entity_pages(
+        self, intacct_object_type: str, fields: List[str], filter: Dict, pagesize: int, parallelism: int
+    ) -> Iterator[Dict]:
+        """
+        Fetches the offset pages of an entity concurrently and yields their objects in order.
 
-            offset = offset + pagesize
-        return total_intacct_objects
+        At most `parallelism` pages are in flight or waiting to be consumed, the
+        next page is requested when the oldest one is yielded. Each page is
+        retried on its own, a failed page doesn't restart the scan.
+        """
+        count_filter = {"filter": filter["filter"]} if filter.get("filter") else {}
+        get_count = self._entity_count_request(intacct_object_type, count_filter)
+        count = int(self.format_and_send_request(get_count)["data"]["@totalcount"])
+        offsets = iter(range(0, count, pagesize))
+
+        with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="intacct-page") as executor:
+            window = collections.deque()
+
+            def submit_next():
+                offset = next(offsets, None)
+                if offset is not None:
+                    data = self._entity_page_request(intacct_object_type, fields, pagesize, offset, filter)
+                    window.append(executor.submit(self._fetch_entity_page, data, intacct_object_type))
+
+            for _i in range(parallelism):
+                submit_next()
+            try:
+                while window:
+                    intacct_objects = window.popleft().result()
+                    submit_next()
+                    yield from intacct_objects
+            finally:
+                for future in window:
+                    future.cancel()
+
+    def _fetch_entity_page(self, data: Dict, intacct_object_type: str) -> List[Dict]:
+        """
+        Sends a page request, retrying it on top of the request backoff, e.g. on truncated responses.
+        """
+        for attempt in range(1, PAGE_MAX_TRIES + 1):
+            try:
+                return self._entity_objects(self.format_and_send_request(data), intacct_object_type)
+            except (InvalidXMLResponseError, InternalServerError, TemporaryServerError,
+                    requests.exceptions.RequestException) as e:
+                if attempt == PAGE_MAX_TRIES:
+                    raise
+                logging.warning(
+                    f"Retrying {intacct_object_type} page at offset {data['query']['offset']} "
+                    f"({attempt}/{PAGE_MAX_TRIES}): {e}"
+                )
+                time.sleep(2 ** attempt)
+
+    def _entity_page_request(
+        self, intacct_object_type: str, fields: List[str], pagesize: int, offset: int, filter={}
+    ) -> Dict:
+        query = {"object": intacct_object_type, "select": {"field": fields}}
+        if filter.get("filter"):
+            query["filter"] = filter["filter"]
+        # offset pages need a stable order
+        query["orderby"] = {"order": {"field": "RECORDNO", "ascending": None}}
+        query["options"] = {"showprivate": "true"}
+        query["pagesize"] = pagesize
+        query["offset"] = offset
+        return {"query": query}
+
+    def _entity_objects(self, response: Dict, intacct_object_type: str) -> List[Dict]:
+        intacct_objects = response["data"].get(intacct_object_type) or []
+        # When only 1 object is found, Intacct returns a dict, otherwise it returns a list of dicts.
+        if isinstance(intacct_objects, dict):
+            intacct_objects = [intacct_objects]
+        return intacct_objects
 
     def get_sample(self, intacct_object: str):
         """
@@ -483,11 +1104,12 @@ class SageIntacctSDK:
         """
         Post journal to Intacct
         """
-        data = {"create": {"object": "GLBATCH", "GLBATCH": journal}}
-
-        response = self.format_and_send_request(data)
+        response = self.format_and_send_request(self._journal_request(journal))
         return response
 
+    def _journal_request(self, journal) -> Dict:
+        return {"create": {"object": "GLBATCH", "GLBATCH": journal}}
+
     def delete_journal(self, recordno):
         data = {"delete": {"object": "GLBATCH", "keys": recordno}}
 
@@ -503,18 +1125,21 @@ class SageIntacctSDK:
             List of Dict in objects schema.
         """
         intacct_object_type = INTACCT_OBJECTS[object_type]
-        data = {
-            "query": {
-                "object": intacct_object_type,
-                "select": {"field": fields},
-                "pagesize": "1000",
-            }
-        }
-        if len(filters) > 0:
-            data["query"].update({"filter": filters})
+        data = self._query_entity_request(intacct_object_type, fields, filters)
 
         entities = self.format_and_send_request(data)
-        
+        return self._query_entity_objects(entities, intacct_object_type)
+
+    def _query_entity_request(self, intacct_object_type: str, fields: set[str], filters={}) -> Dict:
+        query = {"object": intacct_object_type, "select": {"field": fields}}
+        if len(filters) > 0:
+            query["filter"] = filters
+        # the objects of private entities are looked up too, like in the other reads
+        query["options"] = {"showprivate": "true"}
+        query["pagesize"] = "1000"
+        return {"query": query}
+
+    def _query_entity_objects(self, entities: Dict, intacct_object_type: str) -> Union[List[Dict], None]:
         if int(entities["data"]["@totalcount"]) > 0:
             objects = entities["data"][intacct_object_type]
             return objects if isinstance(objects, list) else [objects]
@@ -532,7 +1157,16 @@ def get_client(
     user_password: str,
     headers: Dict,
     use_locations: bool,
-    location_id: str
+    location_id: str,
+    pool_size: int = 10,
+    warm_connections: int = 1,
+    request_logger: RequestLogger = None,
+    page_parallelism: int = 1,
+    session_cache: SessionCache = None,
+    rate_limiter: RateLimiter = None,
+    concurrency: ConcurrencyController = None,
+    idempotent: bool = False,
+    compress_requests: bool = False,
 ) -> SageIntacctSDK:
     """
     Initializes and returns a SageIntacctSDK object.
@@ -546,7 +1180,16 @@ def get_client(
         user_password=user_password,
         headers=headers,
         use_locations=use_locations,
-        location_id=location_id
+        location_id=location_id,
+        pool_size=pool_size,
+        warm_connections=warm_connections,
+        request_logger=request_logger,
+        page_parallelism=page_parallelism,
+        session_cache=session_cache,
+        rate_limiter=rate_limiter,
+        concurrency=concurrency,
+        idempotent=idempotent,
+        compress_requests=compress_requests,
     )
 
     return connection
@@ -0,0 +1,127 @@
+"""
+AIMD control of the requests in flight for each Intacct object type
+"""
+import contextlib
+import threading
+import time
+from typing import Dict
+
+import requests
+import singer
+from singer.metrics import Point
+
+from target_intacct.exceptions import TemporaryServerError
+
+LOGGER = singer.get_logger()
+
+# errors meaning the API is overloaded
+OVERLOAD_EXCEPTIONS = (TemporaryServerError, requests.exceptions.Timeout)
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+class _Window:
+    def __init__(self, size: float):
+        self.size = size
+        self.in_flight = 0
+        self.min_latency = None
+        self.last_cut = 0.0
+        self.condition = threading.Condition()
+
+
+class ConcurrencyController:
+    """
+    Limits the requests in flight per object type with an AIMD window.
+
+    Each request fast enough (at most `latency_tolerance` times the fastest one
+    seen for its object type, or under `latency_floor` seconds) grows the
+    window by 1/window, so by about one slot per window of requests. An
+    overload error halves it, at most once per request duration so concurrent
+    failures count once. The window size is logged as a `concurrency_window`
+    gauge metric when it changes.
+    """
+
+    def __init__(
+        self,
+        initial_window: int = 2,
+        min_window: int = 1,
+        max_window: int = 32,
+        latency_tolerance: float = 2.0,
+        latency_floor: float = 0.1,
+        decrease: float = 0.5,
+    ):
+        self.initial_window = initial_window
+        self.min_window = min_window
+        self.max_window = max_window
+        self.latency_tolerance = latency_tolerance
+        self.latency_floor = latency_floor
+        self.decrease = decrease
+        self._windows: Dict[str, _Window] = {}
+        self._lock = threading.Lock()
+
+    def _window(self, object_type: str) -> _Window:
+        with self._lock:
+            if object_type not in self._windows:
+                self._windows[object_type] = _Window(min(self.initial_window, self.max_window))
+            return self._windows[object_type]
+
+    def window(self, object_type: str) -> int:
+        """Current number of requests allowed in flight for object_type."""
+        return int(self._window(object_type).size)
+
+    @contextlib.contextmanager
+    def slot(self, object_type: str):
+        """
+        Waits for a free slot of object_type and adapts the window to the outcome of the request.
+        """
+        window = self._window(object_type)
+        with window.condition:
+            window.condition.wait_for(lambda: window.in_flight < int(window.size))
+            window.in_flight += 1
+
+        start = time.monotonic()
+        try:
+            yield
+        except OVERLOAD_EXCEPTIONS:
+            self._release(object_type, window, start, overloaded=True)
+            raise
+        except Exception:
+            self._release(object_type, window, start, overloaded=None)
+            raise
+        self._release(object_type, window, start, overloaded=False)
+
+    def _release(self, object_type: str, window: _Window, start: float, overloaded) -> None:
+        now = time.monotonic()
+        latency = now - start
+        with window.condition:
+            window.in_flight -= 1
+            previous = int(window.size)
+
+            if overloaded:
+                # failures of requests sent before the last cut were already counted
+                if start >= window.last_cut:
+                    window.size = max(window.size * self.decrease, self.min_window)
+                    window.last_cut = now
+            elif overloaded is False:
+                if window.min_latency is None or latency < window.min_latency:
+                    window.min_latency = latency
+                if latency <= max(window.min_latency * self.latency_tolerance, self.latency_floor):
+                    window.size = min(window.size + 1 / window.size, self.max_window)
+
+            window.condition.notify_all()
+            size = int(window.size)
+
+        if size != previous:
+            singer.metrics.log(LOGGER, Point("gauge", "concurrency_window", size, {"endpoint": object_type}))
+
+
+def get_concurrency_controller(max_window: int, initial_window: int = 2) -> ConcurrencyController:
+    """
+    Returns the controller of the process for these settings, so all the sinks share it.
+    """
+    key = (max_window, initial_window)
+    with _controllers_lock:
+        if key not in _controllers:
+            _controllers[key] = ConcurrencyController(initial_window=initial_window, max_window=max_window)
+        return _controllers[key]
@@ -41,4 +41,32 @@ INTACCT_OBJECTS = {
 
 GET_BY_DATE_FIELD = "WHENMODIFIED"
 
+# The lookup store fetches the objects modified since its newest row minus this many seconds,
+# in case objects were saved with a slightly older modification time
+LOOKUP_REFRESH_OVERLAP = 5 * 60
+# Seconds between the checks of the lookup store for objects deleted in Intacct
+LOOKUP_RECONCILE_INTERVAL = 24 * 60 * 60
+# Reference tables with more objects than this are looked up by value rather than downloaded
+LOOKUP_POINT_THRESHOLD = 50000
+# Values looked up per query in those tables
+LOOKUP_POINT_BATCH = 100
+
 DEFAULT_API_URL = "https://api.intacct.com/ia/xml/xmlgw.phtml"
+
+# Limits for multi-function requests
+BATCH_MAX_FUNCTIONS = 100
+BATCH_MAX_BYTES = 4 * 1024 * 1024
+
+# Attempts made for a single entity page before a parallel scan fails
+PAGE_MAX_TRIES = 3
+
+# API sessions are opened again when they expire in less than this many seconds
+SESSION_REFRESH_MARGIN = 5 * 60
+# Lifetime assumed for a session when getAPISession doesn't return its timeout
+SESSION_DEFAULT_TTL = 30 * 60
+
+# Error returned for a request whose controlid was already used with uniqueid set
+DUPLICATE_CONTROLID_ERRORS = ["XL03000009"]
+
+# Request bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
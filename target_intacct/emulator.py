@@ -0,0 +1,729 @@
+"""
+Local emulator of the Sage Intacct XML gateway, for offline load tests.
+
+It answers the functions the target sends (getAPISession, query, readByQuery,
+create/update/delete, create_potransaction/update_potransaction,
+create_apadjustment and the supdoc functions) from an in-memory store seeded
+with reference data, and can add latency, inject errors and throttle requests
+like the real gateway.
+
+Usage:
+    python -m target_intacct.emulator --port 8089 --latency 0.05 --error-rate 0.01
+
+then point the target at it with `"api_url": "http://127.0.0.1:8089/ia/xml/xmlgw.phtml"`.
+"""
+import argparse
+import collections
+import datetime as dt
+import fnmatch
+import gzip
+import itertools
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import xmltodict
+
+from target_intacct.const import DUPLICATE_CONTROLID_ERRORS
+from target_intacct.xml_serializer import unparse
+
+ERROR_KINDS = ("503", "html", "timeout", "reset")
+
+# fields of the reference objects seeded in the store, formatted with the row number
+SEED_FIELDS = {
+    "VENDOR": {"VENDORID": "V{:05d}", "NAME": "Vendor {}"},
+    "CLASS": {"CLASSID": "C{:05d}", "NAME": "Class {}"},
+    "PROJECT": {"PROJECTID": "P{:05d}", "NAME": "Project {}"},
+    "LOCATION": {"LOCATIONID": "L{:05d}", "NAME": "Location {}"},
+    "GLACCOUNT": {"ACCOUNTNO": "{:05d}", "TITLE": "Account {}"},
+    "DEPARTMENT": {"DEPARTMENTID": "D{:05d}", "TITLE": "Department {}"},
+    "ITEM": {"ITEMID": "I{:05d}", "NAME": "Item {}"},
+    "CUSTOMER": {"CUSTOMERID": "CU{:05d}", "NAME": "Customer {}"},
+    "EMPLOYEE": {"EMPLOYEEID": "E{:05d}", "NAME": "Employee {}"},
+}
+
+# object stored by the potransaction and supdoc functions
+DOCUMENT_OBJECTS = {
+    "create_potransaction": "PODOCUMENT",
+    "update_potransaction": "PODOCUMENT",
+    "create_supdocfolder": "SUPDOCFOLDER",
+    "create_supdoc": "SUPDOC",
+    "update_supdoc": "SUPDOC",
+    "delete_supdoc": "SUPDOC",
+}
+
+HTML_ERROR_PAGE = (
+    "<!DOCTYPE html><html><head><title>Internal Server Error</title></head>"
+    "<body><h1>Error code 500</h1><p>The web server reported an internal error.</p></body></html>"
+)
+
+
+class EmulatorError(Exception):
+    """Failure of a function, returned as its result."""
+
+    def __init__(self, errorno: str, description: str):
+        super().__init__(description)
+        self.errorno = errorno
+        self.description = description
+
+    def errormessage(self) -> Dict:
+        return {"error": {"errorno": self.errorno, "description": None, "description2": self.description}}
+
+
+def _listify(value) -> List:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _intacct_date(value: dt.datetime) -> str:
+    return value.strftime("%m/%d/%Y %H:%M:%S")
+
+
+def _parse_date(value) -> Optional[dt.datetime]:
+    """Datetime of an Intacct 'MM/DD/YYYY[ HH:MM:SS]' value, None for other values."""
+    if not isinstance(value, str) or len(value) < 10 or value[2:3] != "/":
+        return None
+    for date_format in ("%m/%d/%Y %H:%M:%S", "%m/%d/%Y"):
+        try:
+            return dt.datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    return None
+
+
+def _compare(left, right) -> int:
+    """Compares two field values, numerically when both are numbers, chronologically when both are dates."""
+    try:
+        left, right = float(left), float(right)
+    except (TypeError, ValueError):
+        left_date, right_date = _parse_date(left), _parse_date(right)
+        if left_date and right_date:
+            left, right = left_date, right_date
+        else:
+            left, right = str(left or ""), str(right or "")
+    return (left > right) - (left < right)
+
+
+def _sort_key(value) -> Tuple:
+    """Numbers first in numeric order, then the other values as strings."""
+    try:
+        return (0, float(value), "")
+    except (TypeError, ValueError):
+        return (1, 0.0, str(value or ""))
+
+
+def _matches(row: Dict, conditions: Dict) -> bool:
+    """Evaluates a <filter> of a query on a row."""
+    for operator, operands in conditions.items():
+        if operator == "and":
+            if not all(_matches(row, group) for group in _listify(operands)):
+                return False
+            continue
+        if operator == "or":
+            # any of the conditions of the group, repeated conditions included
+            alternatives = [
+                {op: value} for group in _listify(operands)
+                for op, values in group.items() for value in _listify(values)
+            ]
+            if not any(_matches(row, alternative) for alternative in alternatives):
+                return False
+            continue
+
+        for operand in _listify(operands):
+            field = row.get(operand.get("field"))
+            value = operand.get("value")
+            if operator == "equalto" and _compare(field, value) != 0:
+                return False
+            if operator == "notequalto" and _compare(field, value) == 0:
+                return False
+            if operator == "greaterthan" and _compare(field, value) <= 0:
+                return False
+            if operator == "greaterthanorequalto" and _compare(field, value) < 0:
+                return False
+            if operator == "lessthan" and _compare(field, value) >= 0:
+                return False
+            if operator == "lessthanorequalto" and _compare(field, value) > 0:
+                return False
+            if operator == "in" and not any(_compare(field, v) == 0 for v in _listify(value)):
+                return False
+            if operator == "notin" and any(_compare(field, v) == 0 for v in _listify(value)):
+                return False
+            if operator == "like" and not fnmatch.fnmatchcase(str(field or ""), str(value).replace("%", "*")):
+                return False
+            if operator == "isnull" and field not in (None, ""):
+                return False
+            if operator == "isnotnull" and field in (None, ""):
+                return False
+    return True
+
+
+def _matches_sql(row: Dict, query: Optional[str]) -> bool:
+    """Evaluates the `FIELD = value` conditions, joined with AND, of a readByQuery query."""
+    if not query:
+        return True
+    for condition in re.split(r"\s+and\s+", query.strip(), flags=re.IGNORECASE):
+        match = re.fullmatch(r"\s*(\w+)\s*(=|!=|<>|>=|<=|>|<)\s*'?([^']*)'?\s*", condition)
+        if not match:
+            raise EmulatorError("DL02000001", f"Unsupported query: {query}")
+        field, operator, value = match.groups()
+        result = _compare(row.get(field), value)
+        ok = {
+            "=": result == 0, "!=": result != 0, "<>": result != 0,
+            ">": result > 0, ">=": result >= 0, "<": result < 0, "<=": result <= 0,
+        }[operator]
+        if not ok:
+            return False
+    return True
+
+
+class GatewayEmulator:
+    """
+    In-memory Sage Intacct XML gateway served over HTTP.
+
+    Parameters:
+        host, port: address to listen on, port 0 picks a free one.
+        latency (float): seconds added to every request.
+        jitter (float): up to this many more seconds, drawn at random.
+        error_rate (float): share of the requests failing with one of `error_kinds`.
+        error_kinds (tuple): "503" status, "html" error page, "timeout" (the
+            response hangs for `timeout` seconds, then the connection is
+            dropped) or "reset" (the connection is dropped).
+        rate_limit (float): requests per second accepted, the others are throttled.
+        max_concurrency (int): requests processed at once, the others are throttled.
+        throttle_status (int): HTTP status of the throttled requests.
+        reference_rows (int): rows seeded for each reference object.
+        session_ttl (int): lifetime of the API sessions in seconds.
+        seed (int): seed of the latency and error draws.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_kinds: Tuple[str] = ERROR_KINDS,
+        timeout: float = 65.0,
+        rate_limit: float = None,
+        max_concurrency: int = None,
+        throttle_status: int = 503,
+        reference_rows: int = 100,
+        session_ttl: int = 1800,
+        seed: int = 0,
+    ):
+        unknown = set(error_kinds) - set(ERROR_KINDS)
+        if unknown:
+            raise ValueError(f"Unknown error kinds: {sorted(unknown)}")
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_kinds = tuple(error_kinds)
+        self.timeout = timeout
+        self.rate_limit = rate_limit
+        self.max_concurrency = max_concurrency
+        self.throttle_status = throttle_status
+        self.session_ttl = session_ttl
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._objects: Dict[str, Dict[str, Dict]] = collections.defaultdict(dict)
+        self._recordnos = collections.defaultdict(lambda: itertools.count(1))
+        self._sessions: Dict[str, float] = {}
+        self._controlids = set()
+        self._in_flight = 0
+        self._tokens = rate_limit
+        self._refilled = time.monotonic()
+        self._stats = collections.Counter()
+        self.seed_reference_data(reference_rows)
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.emulator = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/ia/xml/xmlgw.phtml"
+
+    def start(self) -> "GatewayEmulator":
+        """Serves the requests in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="intacct-emulator", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> "GatewayEmulator":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def stats(self) -> Dict[str, int]:
+        """Counts of the connections, requests, functions, injected errors and throttled requests."""
+        with self._lock:
+            return dict(self._stats)
+
+    # --- store ---
+
+    def seed_reference_data(self, rows: int) -> None:
+        """Adds `rows` objects of each reference type, and the purchase order transaction type."""
+        modified = _intacct_date(dt.datetime(2024, 1, 1))
+        for object_type, fields in SEED_FIELDS.items():
+            for n in range(1, rows + 1):
+                self.insert(object_type, {key: pattern.format(n) for key, pattern in fields.items()}, modified)
+        self.insert("PODOCUMENTPARAMS", {"DOCID": "Purchase Order", "DOCCLASS": "Order"}, modified)
+        self.insert("PROVIDERBANKACCOUNT", {"BANKACCOUNTID": "BANK1", "PROVIDERID": "PROVIDER1"}, modified)
+
+    def insert(self, object_type: str, fields: Dict, modified: str = None) -> Dict:
+        """Stores a new object and returns it with its RECORDNO."""
+        with self._lock:
+            recordno = str(next(self._recordnos[object_type]))
+            row = {"RECORDNO": recordno, **fields}
+            row["WHENMODIFIED"] = modified or _intacct_date(dt.datetime.now())
+            row.setdefault("RECORD_URL", f"https://emulator.intacct.test/{object_type.lower()}/{recordno}")
+            self._objects[object_type][recordno] = row
+            return row
+
+    def objects(self, object_type: str) -> List[Dict]:
+        with self._lock:
+            return list(self._objects[object_type].values())
+
+    def _find(self, object_type: str, fields: Dict) -> Optional[Dict]:
+        """Finds the object updated by fields, by RECORDNO or by its id field."""
+        rows = self._objects[object_type]
+        if fields.get("RECORDNO") in rows:
+            return rows[fields["RECORDNO"]]
+        for key in (f"{object_type}ID", "@key", "key"):
+            if fields.get(key):
+                return next((row for row in rows.values() if row.get(f"{object_type}ID") == fields[key]), None)
+        return None
+
+    # --- protocol ---
+
+    def handle(self, body: bytes) -> bytes:
+        """Answers a request body with the response body."""
+        request = xmltodict.parse(body, dict_constructor=dict)["request"]
+        control = request["control"]
+        operation = request["operation"]
+        response_control = {
+            "status": "success",
+            "senderid": control.get("senderid"),
+            "controlid": control.get("controlid"),
+            "uniqueid": control.get("uniqueid", "false"),
+            "dtdversion": control.get("dtdversion", "3.0"),
+        }
+
+        unique = str(control.get("uniqueid")).lower() == "true"
+        controlid = control.get("controlid")
+        if unique:
+            with self._lock:
+                duplicate = controlid in self._controlids
+            if duplicate:
+                self._count("duplicates")
+                response_control["status"] = "failure"
+                return self._response({
+                    "control": response_control,
+                    "errormessage": {"error": {
+                        "errorno": DUPLICATE_CONTROLID_ERRORS[0],
+                        "description": None,
+                        "description2": f"A transaction has already been recorded with the control id {controlid}.",
+                    }},
+                })
+
+        functions = _listify(operation["content"]["function"])
+        authentication = operation["authentication"]
+        if "login" in authentication:
+            sessionid = self._login()
+        else:
+            sessionid = authentication.get("sessionid")
+            with self._lock:
+                expires_at = self._sessions.get(sessionid, 0)
+            if expires_at < time.time():
+                self._count("invalid_sessions")
+                return self._response({
+                    "control": response_control,
+                    "operation": {
+                        "authentication": {"status": "failure"},
+                        "errormessage": {"error": {
+                            "errorno": "XL03000006",
+                            "description": "Sign-in information is incorrect",
+                            "description2": None,
+                        }},
+                    },
+                })
+
+        results = [self._run_function(function, sessionid) for function in functions]
+        if unique:
+            # recorded even when functions failed, a replay isn't run again
+            with self._lock:
+                self._controlids.add(controlid)
+
+        with self._lock:
+            expires_at = self._sessions[sessionid]
+        return self._response({
+            "control": response_control,
+            "operation": {
+                "authentication": {
+                    "status": "success",
+                    "sessiontimeout": dt.datetime.fromtimestamp(expires_at).astimezone().isoformat(),
+                },
+                "result": results[0] if len(results) == 1 else results,
+            },
+        })
+
+    def _response(self, response: Dict) -> bytes:
+        return unparse({"response": response})
+
+    def _login(self) -> str:
+        sessionid = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[sessionid] = time.time() + self.session_ttl
+        self._count("logins")
+        return sessionid
+
+    def _count(self, key: str, value: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += value
+
+    def _run_function(self, function: Dict, sessionid: str) -> Dict:
+        controlid = function.get("@controlid")
+        name = next(key for key in function if key != "@controlid")
+        self._count(f"function.{name}")
+        result = {"status": "success", "function": name, "controlid": controlid}
+        try:
+            handler = getattr(self, f"_function_{name}", None)
+            if handler is None:
+                raise EmulatorError("BL34000061", f"Function {name} is not supported by the emulator")
+            result.update(handler(function[name] or {}, sessionid))
+        except EmulatorError as e:
+            self._count("function_errors")
+            result["status"] = "failure"
+            result["errormessage"] = e.errormessage()
+        return result
+
+    def _function_getAPISession(self, body: Dict, sessionid: str) -> Dict:
+        return {"data": {"api": {"sessionid": sessionid, "endpoint": self.url, "locationid": None}}}
+
+    def _function_query(self, body: Dict, sessionid: str) -> Dict:
+        object_type = body["object"]
+        rows = [row for row in self.objects(object_type) if _matches(row, body.get("filter") or {})]
+        order = (body.get("orderby") or {}).get("order")
+        for order in reversed(_listify(order)):
+            rows.sort(key=lambda row: _sort_key(row.get(order["field"])), reverse="descending" in order)
+
+        offset = int(body.get("offset") or 0)
+        pagesize = int(body.get("pagesize") or 100)
+        page = rows[offset:offset + pagesize]
+        fields = _listify((body.get("select") or {}).get("field"))
+        if fields and "*" not in fields:
+            page = [{field: row.get(field) for field in fields} for row in page]
+        data = {
+            "@listtype": object_type,
+            "@count": str(len(page)),
+            "@totalcount": str(len(rows)),
+            "@offset": str(offset),
+            "@numremaining": str(max(len(rows) - offset - len(page), 0)),
+        }
+        if page:
+            data[object_type] = page
+        return {"data": data}
+
+    def _function_readByQuery(self, body: Dict, sessionid: str) -> Dict:
+        object_type = body["object"].upper()
+        rows = [row for row in self.objects(object_type) if _matches_sql(row, body.get("query"))]
+        page = rows[:int(body.get("pagesize") or 100)]
+        fields = [field.strip() for field in str(body.get("fields") or "*").split(",")]
+        if "*" not in fields:
+            page = [{field: row.get(field) for field in fields} for row in page]
+        data = {
+            "@listtype": object_type.lower(),
+            "@count": str(len(page)),
+            "@totalcount": str(len(rows)),
+            "@numremaining": str(len(rows) - len(page)),
+        }
+        if page:
+            data[object_type.lower()] = page[0] if len(page) == 1 else page
+        return {"data": data}
+
+    def _function_create(self, body: Dict, sessionid: str) -> Dict:
+        objects = []
+        for object_type, fields in body.items():
+            for fields in _listify(fields):
+                self._check_vendor(object_type, fields)
+                row = self.insert(object_type, fields)
+                objects.append((object_type, row))
+        return self._objects_data(objects)
+
+    def _check_vendor(self, object_type: str, fields: Dict) -> None:
+        """Rejects the objects created for a vendor that doesn't exist."""
+        vendorid = fields.get("VENDORID")
+        if object_type == "VENDOR" or not vendorid:
+            return
+        with self._lock:
+            vendor = self._find("VENDOR", {"VENDORID": vendorid})
+        if vendor is None:
+            raise EmulatorError("BL03000018", f"Invalid Vendor '{vendorid}' specified.")
+
+    def _function_update(self, body: Dict, sessionid: str) -> Dict:
+        objects = []
+        for object_type, fields in body.items():
+            for fields in _listify(fields):
+                with self._lock:
+                    row = self._find(object_type, fields)
+                    if row is None:
+                        raise EmulatorError("BL01001973", f"{object_type} {fields.get('RECORDNO')} not found")
+                    row.update(fields)
+                    row["WHENMODIFIED"] = _intacct_date(dt.datetime.now())
+                objects.append((object_type, row))
+        return self._objects_data(objects)
+
+    def _function_delete(self, body: Dict, sessionid: str) -> Dict:
+        object_type = body["object"]
+        with self._lock:
+            for key in str(body.get("keys", "")).split(","):
+                if self._objects[object_type].pop(key.strip(), None) is None:
+                    raise EmulatorError("BL01001973", f"{object_type} {key} not found")
+        return {"data": {"@listtype": "objects", "@count": "0"}}
+
+    def _objects_data(self, objects: List[Tuple[str, Dict]]) -> Dict:
+        data = {"@listtype": "objects", "@count": str(len(objects))}
+        for object_type, row in objects:
+            key_fields = {"RECORDNO": row["RECORDNO"]}
+            if f"{object_type}ID" in row:
+                key_fields[f"{object_type}ID"] = row[f"{object_type}ID"]
+            data.setdefault(object_type.lower(), []).append(key_fields)
+        return {"data": {key: value[0] if isinstance(value, list) and len(value) == 1 else value
+                         for key, value in data.items()}}
+
+    def _function_get(self, body: Dict, sessionid: str) -> Dict:
+        object_type = body["@object"].upper()
+        row = self._find(object_type, {f"{object_type}ID": body.get("@key")})
+        data = {"@listtype": object_type.lower(), "@count": "1" if row else "0"}
+        if row:
+            data[object_type.lower()] = {
+                key.lower(): value for key, value in row.items() if not key.startswith("_")
+            }
+            data[object_type.lower()].update(row.get("_document", {}))
+        return {"data": data}
+
+    def _document(self, name: str, body: Dict, key: str) -> Dict:
+        """Stores the documents created or updated by name, they are returned by `get`."""
+        object_type = DOCUMENT_OBJECTS[name]
+        with self._lock:
+            row = self._find(object_type, {f"{object_type}ID": key}) if key else None
+        if name.startswith("create") and row is None:
+            row = self.insert(object_type, {f"{object_type}ID": key or ""})
+        if row is None:
+            raise EmulatorError("BL01001973", f"{object_type} {key} not found")
+        with self._lock:
+            if name.startswith("delete"):
+                self._objects[object_type].pop(row["RECORDNO"], None)
+            else:
+                row.setdefault("_document", {}).update(body)
+                row["WHENMODIFIED"] = _intacct_date(dt.datetime.now())
+        return {"key": row[f"{object_type}ID"]}
+
+    def _function_create_supdocfolder(self, body: Dict, sessionid: str) -> Dict:
+        return self._document("create_supdocfolder", body, body.get("supdocfoldername"))
+
+    def _function_create_supdoc(self, body: Dict, sessionid: str) -> Dict:
+        return self._document("create_supdoc", body, body.get("supdocid"))
+
+    def _function_update_supdoc(self, body: Dict, sessionid: str) -> Dict:
+        return self._document("update_supdoc", body, body.get("supdocid"))
+
+    def _function_delete_supdoc(self, body: Dict, sessionid: str) -> Dict:
+        return self._document("delete_supdoc", body, body.get("@key"))
+
+    def _function_create_potransaction(self, body: Dict, sessionid: str) -> Dict:
+        transaction_type = body.get("transactiontype", "Purchase Order")
+        with self._lock:
+            docno = f"PO{len(self._objects['PODOCUMENT']) + 1:05d}"
+        row = self.insert("PODOCUMENT", {
+            "PODOCUMENTID": f"{transaction_type}-{docno}",
+            "DOCID": transaction_type,
+            "DOCNO": docno,
+            "VENDORID": body.get("vendorid"),
+        })
+        for item in _listify((body.get("potransitems") or {}).get("potransitem")):
+            self.insert("PODOCUMENTENTRY", {"DOCHDRNO": row["RECORDNO"], "ITEMID": item.get("itemid")})
+        return {"key": row["PODOCUMENTID"]}
+
+    def _function_create_apadjustment(self, body: Dict, sessionid: str) -> Dict:
+        row = self.insert("APADJUSTMENT", {"VENDORID": body.get("vendorid"), "ADJUSTMENTNO": body.get("adjustmentno")})
+        return {"key": row["RECORDNO"]}
+
+    def _function_update_potransaction(self, body: Dict, sessionid: str) -> Dict:
+        with self._lock:
+            row = self._find("PODOCUMENT", {"PODOCUMENTID": body.get("@key")})
+            if row is None:
+                raise EmulatorError("BL01001973", f"PODOCUMENT {body.get('@key')} not found")
+            row["WHENMODIFIED"] = _intacct_date(dt.datetime.now())
+        return {"key": row["PODOCUMENTID"]}
+
+    # --- load behavior ---
+
+    def _throttled(self) -> bool:
+        """Takes a rate limit token, returns whether the request is over the limit."""
+        if not self.rate_limit:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled) * self.rate_limit)
+            self._refilled = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+            return False
+
+    def _enter(self) -> bool:
+        """Takes a processing slot, returns whether the request is over the concurrency limit."""
+        with self._lock:
+            if self.max_concurrency and self._in_flight >= self.max_concurrency:
+                return False
+            self._in_flight += 1
+            return True
+
+    def _leave(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def _delay(self) -> float:
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def _injected_error(self) -> Optional[str]:
+        if not self.error_rate:
+            return None
+        with self._lock:
+            if self._random.random() >= self.error_rate:
+                return None
+            return self._random.choice(self.error_kinds)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, don't wait for the ACK of the headers
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.emulator._count("connections")
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        emulator: GatewayEmulator = self.server.emulator
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        emulator._count("requests")
+        emulator._count("bytes_received", len(body))
+        encoding = self.headers.get("Content-Encoding", "")
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        elif encoding == "deflate":
+            body = zlib.decompress(body)
+
+        if emulator._throttled() or not emulator._enter():
+            emulator._count("throttled")
+            self._send(emulator.throttle_status, b"Too many requests, try again later.", "text/plain")
+            return
+        try:
+            time.sleep(emulator._delay())
+            error = emulator._injected_error()
+            if error:
+                emulator._count(f"injected.{error}")
+            if error == "503":
+                self._send(503, b"Service Unavailable", "text/plain")
+            elif error == "html":
+                self._send(502, HTML_ERROR_PAGE.encode("utf-8"), "text/html")
+            elif error in ("timeout", "reset"):
+                if error == "timeout":
+                    time.sleep(emulator.timeout)
+                self.close_connection = True
+            else:
+                try:
+                    response = emulator.handle(body)
+                except Exception as e:
+                    self._send(400, f"Malformed request: {e}".encode("utf-8"), "text/plain")
+                    return
+                self._send(200, response, "application/xml")
+        finally:
+            emulator._leave()
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        headers = {"Content-Type": content_type}
+        if "gzip" in self.headers.get("Accept-Encoding", "") and len(body) >= 1024:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        self.server.emulator._count("bytes_sent", len(body))
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Local Sage Intacct XML gateway emulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of the requests failing")
+    parser.add_argument("--error-kinds", default=",".join(ERROR_KINDS), help="comma separated, among " + ", ".join(ERROR_KINDS))
+    parser.add_argument("--timeout", type=float, default=65.0, help="seconds a 'timeout' error hangs")
+    parser.add_argument("--rate-limit", type=float, help="requests per second accepted")
+    parser.add_argument("--max-concurrency", type=int, help="requests processed at once")
+    parser.add_argument("--throttle-status", type=int, default=503)
+    parser.add_argument("--reference-rows", type=int, default=100, help="rows of each reference object")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    emulator = GatewayEmulator(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_kinds=tuple(kind for kind in args.error_kinds.split(",") if kind),
+        timeout=args.timeout,
+        rate_limit=args.rate_limit,
+        max_concurrency=args.max_concurrency,
+        throttle_status=args.throttle_status,
+        reference_rows=args.reference_rows,
+        seed=args.seed,
+    )
+    print(f"Intacct emulator listening on {emulator.url}", flush=True)
+    try:
+        emulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -47,4 +47,7 @@ class TemporaryServerError(SageIntacctSDKError):
     """Temporary server errors that should be retried, like 503 Service Unavailable."""
 
 class InvalidXMLResponseError(SageIntacctSDKError):
-    """Invalid XML response from the API."""
\ No newline at end of file
+    """Invalid XML response from the API."""
+
+class DuplicateRequestError(SageIntacctSDKError):
+    """The controlid of an idempotent request was already used, the outcome of the first request is unknown."""
@@ -0,0 +1,521 @@
+"""
+Cache of the reference tables (vendors, accounts, departments, ...) shared by the sinks of a target,
+and their store on disk refreshed incrementally between runs
+"""
+import collections
+import datetime as dt
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional
+
+from .client import SageIntacctSDK, _format_date_for_intacct
+from .const import GET_BY_DATE_FIELD, LOOKUP_POINT_BATCH, LOOKUP_RECONCILE_INTERVAL, LOOKUP_REFRESH_OVERLAP
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def normalize_key(name: str) -> str:
+    """Name compared ignoring case and repeated or surrounding whitespace."""
+    return " ".join(str(name).split()).casefold()
+
+
+class LookupTable(Mapping):
+    """
+    Reference objects indexed by name, business id and RECORDNO.
+
+    It reads like the {name: id} dict the sinks used to build, so table[name],
+    table.get(name), `name in table` and table.keys() work as before, and it
+    answers the other lookups in constant time:
+    - has_id(id): whether id is the business id of an object, values()
+      returns the ids as a set-like view for the same test
+    - id_for_recordno(recordno): business id of the object with that RECORDNO
+    - name_for_id(id): name of the object with that business id
+
+    With normalize, names that don't match exactly are matched ignoring case
+    and whitespace, e.g. " acme  Corp" finds "Acme Corp". As with a dict, the
+    last object of a repeated name wins.
+    """
+
+    __slots__ = ("_by_name", "_by_key", "_by_id", "_by_recordno")
+
+    def __init__(
+        self,
+        rows: Iterable[Dict],
+        name_field: str,
+        id_field: str,
+        recordno_field: str = "RECORDNO",
+        normalize: bool = False,
+    ):
+        self._by_name: Dict[str, Any] = {}
+        self._by_key: Optional[Dict[str, Any]] = {} if normalize else None
+        self._by_id: Dict[Any, str] = {}
+        self._by_recordno: Dict[str, Any] = {}
+        self._add(rows, name_field, id_field, recordno_field)
+
+    def _add(self, rows: Iterable[Dict], name_field: str, id_field: str, recordno_field: str) -> None:
+        for row in rows:
+            name = row.get(name_field)
+            object_id = row.get(id_field)
+            self._by_name[name] = object_id
+            self._by_id[object_id] = name
+            recordno = row.get(recordno_field)
+            if recordno is not None:
+                self._by_recordno[str(recordno)] = object_id
+            if self._by_key is not None and name:
+                self._by_key[normalize_key(name)] = object_id
+
+    def add(self, name: str, object_id, recordno=None) -> None:
+        """Adds an object created after the table was loaded."""
+        self._add([{"name": name, "id": object_id, "recordno": recordno}], "name", "id", "recordno")
+
+    def __getitem__(self, name: str) -> Any:
+        try:
+            return self._by_name[name]
+        except KeyError:
+            if self._by_key is None or not isinstance(name, str):
+                raise
+            return self._by_key[normalize_key(name)]
+
+    def __contains__(self, name) -> bool:
+        try:
+            self[name]
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._by_name)
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    def values(self):
+        return self._by_id.keys()
+
+    def has_id(self, object_id) -> bool:
+        return object_id in self._by_id
+
+    def id_for_recordno(self, recordno) -> Any:
+        if recordno is None:
+            return None
+        return self._by_recordno.get(str(recordno))
+
+    def name_for_id(self, object_id) -> Optional[str]:
+        return self._by_id.get(object_id)
+
+    def __repr__(self) -> str:
+        return f"LookupTable({len(self)} objects)"
+
+
+class PointLookupTable(LookupTable):
+    """
+    LookupTable of an object type too large to download, holding the objects
+    looked up so far.
+
+    resolve(values) fetches the objects whose name, business id or RECORDNO
+    (or only those of them in `query_fields`) is one of values, with `in`
+    filters of up to `batch_size` values per query, and remembers for each
+    field the values no object matched so they aren't queried again. A lookup
+    of a value that wasn't resolved beforehand resolves it on the spot by the
+    field looked up, so the lookups answer as a full table would; only len(),
+    keys() and values() are limited to the objects fetched.
+
+    With normalize, names are matched ignoring case and whitespace among the
+    fetched objects only, the queries compare them exactly.
+    """
+
+    __slots__ = (
+        "count", "batch_size", "_client", "_object_type", "_fields", "_query_fields", "_missing", "_lock", "_stats",
+    )
+
+    def __init__(
+        self,
+        client: SageIntacctSDK,
+        object_type: str,
+        name_field: str,
+        id_field: str,
+        count: Optional[int] = None,
+        recordno_field: str = "RECORDNO",
+        normalize: bool = False,
+        batch_size: int = LOOKUP_POINT_BATCH,
+        query_fields: Optional[Iterable[str]] = None,
+    ):
+        super().__init__((), name_field, id_field, recordno_field, normalize)
+        self.count = count
+        self.batch_size = batch_size
+        self._client = client
+        self._object_type = object_type
+        self._fields = (name_field, id_field, recordno_field)
+        self._query_fields = tuple(dict.fromkeys(query_fields or self._fields))
+        self._missing = {field: set() for field in self._fields}
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    def _found(self, field: str) -> Mapping:
+        """The index of the objects fetched by field."""
+        name_field, id_field, recordno_field = self._fields
+        if field == recordno_field:
+            return self._by_recordno
+        return self._by_id if field == id_field else self._by_name
+
+    def _known(self, field: str, value: str) -> bool:
+        """Whether the object with value in field was fetched, or is known not to exist."""
+        return value in self._found(field) or value in self._missing[field]
+
+    def resolve(self, values: Iterable, fields: Optional[Iterable[str]] = None) -> None:
+        """
+        Fetches the objects matching values by the query fields, or only by
+        those of `fields`, that weren't looked up by these fields yet.
+        """
+        fields = [field for field in self._query_fields if fields is None or field in fields]
+        recordno_field = self._fields[2]
+        with self._lock:
+            wanted = {}
+            for value in dict.fromkeys(str(value) for value in values if value not in (None, "")):
+                for field in fields:
+                    if self._known(field, value):
+                        continue
+                    # RECORDNO is an integer, other values can't match it
+                    if field == recordno_field and not value.isdigit():
+                        self._missing[field].add(value)
+                        continue
+                    wanted.setdefault(value, []).append(field)
+
+            wanted_values = list(wanted)
+            for start in range(0, len(wanted_values), self.batch_size):
+                batch = wanted_values[start:start + self.batch_size]
+                conditions = []
+                for field in fields:
+                    field_values = [value for value in batch if field in wanted[value]]
+                    if field_values:
+                        conditions.append({"field": field, "value": field_values})
+                rows = self._client.query_entity(
+                    object_type=self._object_type,
+                    fields=sorted(set(self._fields)),
+                    filters={"or": {"in": conditions}} if len(conditions) > 1 else {"in": conditions[0]},
+                ) or []
+                self._stats["queries"] += 1
+                self._stats["fetched"] += len(rows)
+                self._add(rows, *self._fields)
+                for value in batch:
+                    for field in wanted[value]:
+                        if value not in self._found(field):
+                            self._missing[field].add(value)
+
+    def add(self, name: str, object_id, recordno=None) -> None:
+        with self._lock:
+            name_field, id_field, recordno_field = self._fields
+            self._missing[name_field].discard(name)
+            self._missing[id_field].discard(object_id)
+            self._missing[recordno_field].discard(str(recordno))
+            super().add(name, object_id, recordno)
+
+    def __getitem__(self, name: str) -> Any:
+        try:
+            return super().__getitem__(name)
+        except KeyError:
+            if name in self._missing[self._fields[0]]:
+                raise
+        self.resolve([name], [self._fields[0]])
+        return super().__getitem__(name)
+
+    def has_id(self, object_id) -> bool:
+        if not super().has_id(object_id):
+            self.resolve([object_id], [self._fields[1]])
+        return super().has_id(object_id)
+
+    def id_for_recordno(self, recordno) -> Any:
+        if super().id_for_recordno(recordno) is None:
+            self.resolve([recordno], [self._fields[2]])
+        return super().id_for_recordno(recordno)
+
+    def name_for_id(self, object_id) -> Optional[str]:
+        if super().name_for_id(object_id) is None:
+            self.resolve([object_id], [self._fields[1]])
+        return super().name_for_id(object_id)
+
+    def stats(self) -> Dict:
+        """Objects in Intacct when counted, queries sent, objects fetched and values no object matched by any field."""
+        return {
+            "objects": self.count,
+            "queries": self._stats["queries"],
+            "fetched": self._stats["fetched"],
+            "missing": len({
+                value for missing in self._missing.values() for value in missing
+                if not any(value in self._found(field) for field in self._fields)
+            }),
+        }
+
+    def __repr__(self) -> str:
+        return f"PointLookupTable({len(self)} of {self.count or 'uncounted'} objects)"
+
+
+class LookupCache:
+    """
+    Keeps the reference tables the sinks look names and ids up in, so each
+    table is downloaded once per run rather than once per stream.
+
+    Tables are keyed by the data scope of the client that loaded them (the
+    company, user and location it is logged in with, see
+    SageIntacctSDK.data_scope) and the table name, since a location-scoped
+    session doesn't see the same objects as a top-level one.
+
+    Loading is single-flight: when several threads ask for a table that isn't
+    loaded yet, the first one loads it and the others wait for its result. If
+    the load fails, the error is raised to the loading thread and one of the
+    waiting threads tries again.
+    """
+
+    def __init__(self):
+        self._tables: Dict[Hashable, Any] = {}
+        self._loading: Dict[Hashable, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    def get(self, scope: str, name: str, load: Callable[[], Any]) -> Any:
+        """Returns the table `name` of `scope`, calling `load` to build it on the first request."""
+        key = (scope, name)
+        waited = False
+        while True:
+            with self._lock:
+                if key in self._tables:
+                    self._stats["hits"] += 1
+                    if waited:
+                        self._stats["waits"] += 1
+                    return self._tables[key]
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = threading.Event()
+                    self._stats["misses"] += 1
+                    break
+            loading.wait()
+            waited = True
+
+        try:
+            table = load()
+        except BaseException:
+            with self._lock:
+                del self._loading[key]
+            loading.set()
+            raise
+        with self._lock:
+            self._tables[key] = table
+            del self._loading[key]
+        loading.set()
+        return table
+
+    def loaded(self, name: str) -> List[Any]:
+        """The tables `name` loaded so far, of every scope."""
+        with self._lock:
+            return [table for key, table in self._tables.items() if key[1] == name]
+
+    def invalidate(self, scope: str = None, name: str = None) -> None:
+        """Drops the tables of scope and/or name, all of them by default."""
+        with self._lock:
+            for key in list(self._tables):
+                if (scope is None or key[0] == scope) and (name is None or key[1] == name):
+                    del self._tables[key]
+
+    def stats(self) -> Dict:
+        """Hits, misses (loads), waits on a load in progress and tables held."""
+        with self._lock:
+            return {
+                "hits": self._stats["hits"],
+                "misses": self._stats["misses"],
+                "waits": self._stats["waits"],
+                "tables": len(self._tables),
+            }
+
+
+def _parse_modified(value) -> Optional[str]:
+    """Sortable 'YYYY-MM-DD HH:MM:SS' of a WHENMODIFIED value, None when it can't be read."""
+    if not value:
+        return None
+    for date_format in ("%m/%d/%Y %H:%M:%S", "%m/%d/%Y"):
+        try:
+            return dt.datetime.strptime(value, date_format).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            pass
+    return None
+
+
+class LookupStore:
+    """
+    Keeps the reference objects in a SQLite database, so a run only fetches
+    the objects modified since the previous one.
+
+    The first load of an object type in a data scope reads all its objects.
+    The next ones read the objects whose WHENMODIFIED is at least the newest
+    one stored, minus LOOKUP_REFRESH_OVERLAP seconds. Deletions don't show up
+    in these reads: every `reconcile_interval` seconds the RECORDNOs of the
+    objects are read to drop the deleted ones.
+
+    The database can be shared by the processes of a tenant, SQLite locks it
+    on writes.
+    """
+
+    def __init__(self, path: str, reconcile_interval: float = LOOKUP_RECONCILE_INTERVAL):
+        self.path = path
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS objects (
+                    scope TEXT NOT NULL,
+                    object_type TEXT NOT NULL,
+                    recordno TEXT NOT NULL,
+                    modified TEXT,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (scope, object_type, recordno)
+                );
+                CREATE TABLE IF NOT EXISTS syncs (
+                    scope TEXT NOT NULL,
+                    object_type TEXT NOT NULL,
+                    fields TEXT NOT NULL,
+                    synced_at REAL NOT NULL,
+                    reconciled_at REAL NOT NULL,
+                    PRIMARY KEY (scope, object_type)
+                );
+                """
+            )
+
+    def rows(self, client: SageIntacctSDK, object_type: str, fields: List[str]) -> List[Dict]:
+        """
+        Returns the objects of object_type in the data scope of client, with
+        at least `fields`, after bringing the store up to date.
+        """
+        scope = client.data_scope
+        fields = sorted({*fields, "RECORDNO", GET_BY_DATE_FIELD})
+        sync = self._sync(scope, object_type)
+        now = time.time()
+
+        if sync is None or sync["fields"] != fields:
+            self._stats["full_loads"] += 1
+            self._replace(scope, object_type, client.iter_entity(object_type=object_type, fields=fields))
+            self._set_sync(scope, object_type, fields, now, now)
+        else:
+            since = self._newest_modified(scope, object_type)
+            if since is None:
+                filter = {}
+            else:
+                since = dt.datetime.strptime(since, "%Y-%m-%d %H:%M:%S") - dt.timedelta(seconds=LOOKUP_REFRESH_OVERLAP)
+                filter = {"filter": {"greaterthanorequalto": {
+                    "field": GET_BY_DATE_FIELD, "value": _format_date_for_intacct(since),
+                }}}
+            self._stats["incremental_loads"] += 1
+            self._upsert(scope, object_type, client.iter_entity(object_type=object_type, fields=fields, filter=filter))
+            reconciled_at = sync["reconciled_at"]
+            if now - reconciled_at >= self.reconcile_interval:
+                self._reconcile(client, scope, object_type)
+                reconciled_at = now
+            self._set_sync(scope, object_type, fields, now, reconciled_at)
+
+        with self._lock:
+            cursor = self._db.execute(
+                "SELECT data FROM objects WHERE scope = ? AND object_type = ? ORDER BY CAST(recordno AS INTEGER)",
+                (scope, object_type),
+            )
+            return [json.loads(data) for (data,) in cursor]
+
+    def _reconcile(self, client: SageIntacctSDK, scope: str, object_type: str) -> None:
+        """Drops the stored objects deleted in Intacct."""
+        self._stats["reconciles"] += 1
+        # counts can't tell a deletion from a deletion and a creation, the RECORDNOs are compared
+        recordnos = {row["RECORDNO"] for row in client.iter_entity(object_type=object_type, fields=["RECORDNO"])}
+        with self._lock:
+            stored_recordnos = {recordno for (recordno,) in self._db.execute(
+                "SELECT recordno FROM objects WHERE scope = ? AND object_type = ?", (scope, object_type)
+            )}
+            deleted = stored_recordnos - recordnos
+            self._db.executemany(
+                "DELETE FROM objects WHERE scope = ? AND object_type = ? AND recordno = ?",
+                [(scope, object_type, recordno) for recordno in deleted],
+            )
+        self._stats["deleted"] += len(deleted)
+        logging.info(f"Dropped {len(deleted)} deleted {object_type} from the lookup store")
+
+    def count(self, scope: str, object_type: str) -> Optional[int]:
+        """Objects of object_type stored for scope, None when they were never loaded."""
+        if self._sync(scope, object_type) is None:
+            return None
+        with self._lock:
+            (count,) = self._db.execute(
+                "SELECT count(*) FROM objects WHERE scope = ? AND object_type = ?", (scope, object_type)
+            ).fetchone()
+        return count
+
+    def _sync(self, scope: str, object_type: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT fields, synced_at, reconciled_at FROM syncs WHERE scope = ? AND object_type = ?",
+                (scope, object_type),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"fields": json.loads(row[0]), "synced_at": row[1], "reconciled_at": row[2]}
+
+    def _set_sync(self, scope: str, object_type: str, fields: List[str], synced_at: float, reconciled_at: float) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO syncs VALUES (?, ?, ?, ?, ?)",
+                (scope, object_type, json.dumps(fields), synced_at, reconciled_at),
+            )
+
+    def _newest_modified(self, scope: str, object_type: str) -> Optional[str]:
+        with self._lock:
+            (modified,) = self._db.execute(
+                "SELECT max(modified) FROM objects WHERE scope = ? AND object_type = ?", (scope, object_type)
+            ).fetchone()
+        return modified
+
+    def _values(self, scope: str, object_type: str, rows: Iterable[Dict]) -> Iterable:
+        for row in rows:
+            self._stats["rows_fetched"] += 1
+            yield (scope, object_type, row["RECORDNO"], _parse_modified(row.get(GET_BY_DATE_FIELD)), json.dumps(row))
+
+    def _replace(self, scope: str, object_type: str, rows: Iterable[Dict]) -> None:
+        # rows are fetched before the write transaction, so the database isn't locked during the requests
+        values = list(self._values(scope, object_type, rows))
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM objects WHERE scope = ? AND object_type = ?", (scope, object_type))
+                self._db.executemany("INSERT INTO objects VALUES (?, ?, ?, ?, ?)", values)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _upsert(self, scope: str, object_type: str, rows: Iterable[Dict]) -> None:
+        values = list(self._values(scope, object_type, rows))
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)", values)
+
+    def stats(self) -> Dict:
+        """Full and incremental loads, objects fetched, reconciliations and objects deleted."""
+        return {
+            key: self._stats[key]
+            for key in ("full_loads", "incremental_loads", "rows_fetched", "reconciles", "deleted")
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def get_lookup_store(path: str, reconcile_interval: float = LOOKUP_RECONCILE_INTERVAL) -> LookupStore:
+    """
+    Returns the store of the process kept in `path`.
+    """
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = LookupStore(path, reconcile_interval)
+        return _stores[path]
@@ -0,0 +1,134 @@
+"""
+Adaptive token bucket limiting the requests sent to Sage Intacct
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every client, sink and thread of the target.
+
+    Tokens are refilled at `rate` per second up to `burst`. The rate is halved
+    (down to `min_rate`) when the API signals it is overloaded, and raised
+    by the `increase` share of itself per successful request, so it recovers
+    in a number of requests that doesn't depend on how low it went.
+
+    `max_rate` is a hard ceiling, it defaults to `rate`: without it the limiter
+    only slows down from the configured rate and never probes above it.
+
+    With `state_path` the bucket lives in a file locked on every update, so the
+    worker processes of a tenant draw from the same bucket.
+    """
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        burst: float = None,
+        min_rate: float = 1.0,
+        max_rate: float = None,
+        increase: float = 0.1,
+        state_path: str = None,
+    ):
+        self.max_rate = max_rate or rate
+        self.min_rate = min(min_rate, self.max_rate)
+        self.burst = burst or rate
+        self.increase = increase
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._state = {"rate": rate, "tokens": self.burst, "updated": time.time()}
+
+    def _update(self, update) -> float:
+        """Applies update to the bucket state and returns its result."""
+        with self._lock:
+            if not self.state_path:
+                return update(self._state)
+
+            with open(f"{self.state_path}.lock", "a") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    with open(self.state_path) as f:
+                        state = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    state = dict(self._state)
+                result = update(state)
+                tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self.state_path)
+                return result
+
+    def reserve(self) -> float:
+        """
+        Takes a token and returns how many seconds to wait before using it.
+        """
+        def take(state):
+            now = time.time()
+            elapsed = max(now - state["updated"], 0)
+            state["tokens"] = min(self.burst, state["tokens"] + elapsed * state["rate"]) - 1
+            state["updated"] = now
+            # a negative balance is paid back by waiting
+            return max(-state["tokens"] / state["rate"], 0)
+
+        return self._update(take)
+
+    def acquire(self) -> None:
+        """Blocks until a request can be sent."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self) -> None:
+        def speed_up(state):
+            state["rate"] = min(state["rate"] * (1 + self.increase), self.max_rate)
+
+        self._update(speed_up)
+
+    def on_throttle(self) -> None:
+        def slow_down(state):
+            state["rate"] = max(state["rate"] / 2, self.min_rate)
+
+        self._update(slow_down)
+
+    @property
+    def rate(self) -> float:
+        return self._update(lambda state: state["rate"])
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "RateLimiter":
+        return get_rate_limiter(
+            rate=float(config.get("rate_limit", 10)),
+            burst=config.get("rate_limit_burst"),
+            state_path=config.get("rate_limit_path"),
+            max_rate=config.get("rate_limit_max"),
+        )
+
+
+def get_rate_limiter(
+    rate: float = 10.0, burst: float = None, state_path: str = None, max_rate: float = None
+) -> RateLimiter:
+    """
+    Returns the limiter of the process for these settings, so all the sinks share it.
+    """
+    key = (rate, burst, state_path, max_rate)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(
+                rate=rate,
+                burst=float(burst) if burst else None,
+                max_rate=float(max_rate) if max_rate else None,
+                state_path=state_path,
+            )
+        return _limiters[key]
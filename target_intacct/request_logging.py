@@ -0,0 +1,239 @@
+"""
+Request/response logging for the Sage Intacct client
+"""
+import atexit
+import copy
+import logging
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict
+
+LOGGER_NAME = "target_intacct.requests"
+VERBOSITY_LEVELS = ("none", "summary", "full")
+
+_queue_listener = None
+_queue_filter = None
+_queue_lock = threading.Lock()
+
+
+def clean_creds(key_field: str, request_body: dict):
+    """
+    Masks the control and authentication blocks of a request or response.
+
+    Only the dicts on the path to those blocks are copied, the rest of the
+    body is shared with the original, which is left untouched.
+    """
+    request_body = request_body.copy()
+    content = request_body.get(key_field)
+    if not isinstance(content, dict):
+        return request_body
+    content = request_body[key_field] = content.copy()
+
+    if content.get("control", {}):
+        content["control"] = {key: "***" for key in content["control"]}
+
+    operation = content.get("operation", {})
+    if isinstance(operation, dict) and operation.get("authentication", {}):
+        operation = content["operation"] = operation.copy()
+        operation["authentication"] = {key: "***" for key in operation["authentication"]}
+
+    return request_body
+
+
+def truncate(text: str, max_chars: int = None) -> str:
+    if max_chars and len(text) > max_chars:
+        return f"{text[:max_chars]}... [{len(text) - max_chars} more chars]"
+    return text
+
+
+class _LazyBody:
+    """
+    Log argument that redacts and stringifies a body only when the log line is formatted.
+    """
+
+    __slots__ = ("body", "key_field", "max_chars")
+
+    def __init__(self, body, key_field: str = None, max_chars: int = None):
+        self.body = body
+        self.key_field = key_field
+        self.max_chars = max_chars
+
+    def __str__(self):
+        body = self.body
+        if self.key_field:
+            body = clean_creds(self.key_field, body)
+        return truncate(str(body), self.max_chars)
+
+    def snapshot(self) -> "_LazyBody":
+        """A copy of the argument the client can't change after the call, for a deferred log line."""
+        return _LazyBody(copy.deepcopy(self.body), self.key_field, self.max_chars)
+
+
+class _QueueFilter(logging.Filter):
+    """
+    Sends the records of the request logger to the queue instead of letting
+    the calling thread run the handlers.
+
+    A handler can't stop a record from propagating, so the records are
+    diverted by a filter on the logger. The listener passes them back to the
+    logger, which then handles and propagates them as usual.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__()
+        self.queue_handler = QueueHandler(log_queue)
+
+    def filter(self, record):
+        if getattr(record, "intacct_dequeued", False):
+            return True
+        # the bodies are mutated by the client once logged
+        if isinstance(record.args, tuple):
+            record.args = tuple(
+                arg.snapshot() if isinstance(arg, _LazyBody) else arg for arg in record.args
+            )
+        self.queue_handler.enqueue(record)
+        return False
+
+
+class _LoggerHandler(logging.Handler):
+    """Hands the dequeued records back to their logger."""
+
+    def emit(self, record):
+        record.intacct_dequeued = True
+        logging.getLogger(record.name).handle(record)
+
+
+def enable_queue_logging() -> None:
+    """
+    Sends the request logs through a queue, so formatting and log I/O don't
+    block the request threads. The records still reach the handlers of the
+    logger and of its parents. The queue is flushed at exit.
+    """
+    global _queue_listener, _queue_filter
+    with _queue_lock:
+        if _queue_listener is not None:
+            return
+        log_queue = queue.SimpleQueue()
+        _queue_listener = QueueListener(log_queue, _LoggerHandler())
+        _queue_filter = _QueueFilter(log_queue)
+        logging.getLogger(LOGGER_NAME).addFilter(_queue_filter)
+        _queue_listener.start()
+        atexit.register(disable_queue_logging)
+
+
+def disable_queue_logging() -> None:
+    """Flushes the queued request logs and handles the next ones in the calling thread."""
+    global _queue_listener, _queue_filter
+    with _queue_lock:
+        if _queue_listener is None:
+            return
+        logging.getLogger(LOGGER_NAME).removeFilter(_queue_filter)
+        _queue_listener.stop()
+        _queue_listener = _queue_filter = None
+
+
+class RequestLogger:
+    """
+    Logs the requests sent and responses received by the client.
+
+    Parameters:
+        verbosity (str): "none" logs nothing, "summary" logs one line per request
+            and response, "full" also logs the redacted bodies.
+        sample_rate (float): share of the requests whose bodies are logged when
+            verbosity is "full", the others are logged as a summary.
+        max_chars (int): bodies longer than this are truncated.
+        use_queue (bool): format and write the logs in a background thread.
+    """
+
+    def __init__(self, verbosity="full", sample_rate=1.0, max_chars=None, use_queue=False):
+        if verbosity not in VERBOSITY_LEVELS:
+            raise ValueError(f"request log verbosity must be one of {VERBOSITY_LEVELS}, got {verbosity}")
+        self.verbosity = verbosity
+        self.sample_rate = sample_rate
+        self.max_chars = max_chars
+        self.logger = logging.getLogger(LOGGER_NAME)
+        if use_queue:
+            enable_queue_logging()
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "RequestLogger":
+        max_chars = config.get("request_log_max_chars")
+        return cls(
+            verbosity=config.get("request_log_verbosity", "full"),
+            sample_rate=float(config.get("request_log_sample_rate", 1.0)),
+            max_chars=int(max_chars) if max_chars else None,
+            use_queue=bool(config.get("request_log_async", False)),
+        )
+
+    def sample(self) -> bool:
+        """Decides if the bodies of a request are logged."""
+        if self.verbosity != "full":
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def _enabled(self) -> bool:
+        return self.verbosity != "none" and self.logger.isEnabledFor(logging.INFO)
+
+    def log_function(self, object_type: str, action: Dict) -> None:
+        if not self._enabled():
+            return
+        extra = {"intacct": {"event": "function", "object_type": object_type}}
+        if self.sample():
+            self.logger.info(
+                "Creating request with object_type: %s and action %s",
+                object_type, _LazyBody(action, max_chars=self.max_chars), extra=extra,
+            )
+        else:
+            self.logger.info("Creating request with object_type: %s", object_type, extra=extra)
+
+    def log_request(self, dict_body: Dict, body_size: int, status_code: int, sampled: bool) -> None:
+        if not self._enabled():
+            return
+        extra = {"intacct": {"event": "request", "status_code": status_code, "bytes": body_size}}
+        if sampled:
+            self.logger.info(
+                "Raw response %s with status code %s",
+                _LazyBody(dict_body, "request", self.max_chars), status_code, extra=extra,
+            )
+        else:
+            self.logger.info("Request of %s bytes with status code %s", body_size, status_code, extra=extra)
+
+    def log_response(
+        self, parsed_response: Dict, response_size: int, status_code: int, url: str, sampled: bool
+    ) -> None:
+        if not self._enabled():
+            return
+        extra = {"intacct": {"event": "response", "status_code": status_code, "bytes": response_size, "url": url}}
+        if sampled:
+            self.logger.info(
+                "parsed response %s with status code %s for request to %s",
+                _LazyBody(parsed_response, "response", self.max_chars), status_code, url, extra=extra,
+            )
+        else:
+            self.logger.info(
+                "response of %s chars with status code %s for request to %s",
+                response_size, status_code, url, extra=extra,
+            )
+
+    def log_transfer(self, url: str, sent: int, wire_sent: int, received: int, wire_received: int) -> None:
+        if self.verbosity == "none" or not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        self.logger.debug(
+            "Sent %s bytes (%s on the wire) and received %s bytes (%s on the wire) for request to %s",
+            sent, wire_sent, received, wire_received, url,
+            extra={"intacct": {
+                "event": "transfer",
+                "url": url,
+                "bytes_sent": sent,
+                "wire_bytes_sent": wire_sent,
+                "bytes_received": received,
+                "wire_bytes_received": wire_received,
+            }},
+        )
+
+    def log_failed_request(self, dict_body: Dict) -> None:
+        self.logger.info(
+            "Error while sending request data: %s", _LazyBody(dict_body, "request", self.max_chars)
+        )
@@ -0,0 +1,111 @@
+"""
+Caches of Sage Intacct API sessions, shared by the clients logged in with the same credentials
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def session_key(api_url: str, sender_id: str, company_id: str, user_id: str, location_id: str = None) -> str:
+    """
+    Key of the sessions opened with a set of credentials, hashed so the ids aren't stored in clear.
+    """
+    key = "|".join([api_url, sender_id, company_id, user_id, location_id or ""])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class SessionCache:
+    """
+    Keeps the API sessions in memory, they are shared by the clients of the process.
+
+    A session is a dict with the sessionid, the endpoint it was opened on and
+    the epoch time it expires at.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            return self._sessions.get(key)
+
+    def set(self, key: str, session: Dict) -> None:
+        with self._lock:
+            self._sessions[key] = session
+
+    def invalidate(self, key: str, sessionid: str) -> None:
+        """Drops the session, unless it was already replaced by a new one."""
+        with self._lock:
+            if self._sessions.get(key, {}).get("sessionid") == sessionid:
+                del self._sessions[key]
+
+
+class FileSessionCache(SessionCache):
+    """
+    Keeps the API sessions in a JSON file, so they are reused by the next processes.
+
+    Writes are serialized with a lock file between processes and the file is
+    replaced atomically, it is only readable by its owner.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+
+    def _read(self) -> Dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _update(self, update) -> None:
+        with self._lock, open(f"{self.path}.lock", "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            sessions = self._read()
+            now = time.time()
+            sessions = {key: session for key, session in sessions.items() if session["expires_at"] > now}
+            update(sessions)
+
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(sessions, f)
+            os.replace(tmp_path, self.path)
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            return self._read().get(key)
+
+    def set(self, key: str, session: Dict) -> None:
+        self._update(lambda sessions: sessions.update({key: session}))
+
+    def invalidate(self, key: str, sessionid: str) -> None:
+        def drop(sessions):
+            if sessions.get(key, {}).get("sessionid") == sessionid:
+                del sessions[key]
+
+        self._update(drop)
+
+
+def get_session_cache(path: str = None) -> SessionCache:
+    """
+    Returns the cache of the process, or the one stored in `path`.
+    """
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = FileSessionCache(path) if path else SessionCache()
+        return _caches[path]
@@ -2,6 +2,12 @@
 
 from __future__ import annotations
 
+import copy
+import hashlib
+import itertools
+import json
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from typing import Any, Dict, List, Mapping, Optional, Union
 from target_hotglue.client import HotglueSink
@@ -11,7 +17,19 @@ from singer_sdk.sinks import RecordSink
 from target_intacct.mapping import UnifiedMapping
 
 from .client import SageIntacctSDK, get_client
-from .const import DEFAULT_API_URL, KEY_PROPERTIES, REQUIRED_CONFIG_KEYS
+from .concurrency import get_concurrency_controller
+from .const import (
+    DEFAULT_API_URL,
+    KEY_PROPERTIES,
+    LOOKUP_POINT_THRESHOLD,
+    LOOKUP_RECONCILE_INTERVAL,
+    REQUIRED_CONFIG_KEYS,
+)
+from .exceptions import DuplicateRequestError
+from .lookups import LookupTable, PointLookupTable, get_lookup_store
+from .rate_limit import RateLimiter
+from .request_logging import RequestLogger
+from .sessions import get_session_cache
 import re
 # import xmltodict
 
@@ -19,6 +37,91 @@ import re
 class intacctSink(HotglueSink):
     """intacct target sink class."""
 
+    # streams that can be sent in batches: payload method and object for the record url
+    batch_uploads = {
+        "Bills": ("bills_payload", "APBILL"),
+        "PurchaseInvoices": ("purchase_invoices_payload", "APBILL"),
+        "JournalEntries": ("journal_entries_payload", "GLBATCH"),
+        "Suppliers": ("suppliers_payload", "VENDOR"),
+        "APAdjustment": ("apadjustment_payload", "APADJUSTMENT"),
+    }
+
+    # object and field to look the objects created by an upload up by, when its request was replayed
+    replay_lookups = {
+        "APBILL": ("accounts_payable_bills", "RECORDID"),
+        "VENDOR": ("accounts_payable_vendors", "VENDORID"),
+    }
+
+    # endpoint of each stream in the mapping file
+    mapping_endpoints = {
+        "Suppliers": "account_payable_vendors",
+        "Bills": "bills",
+        "PurchaseInvoices": "purchase_invoices",
+        "JournalEntries": "journal_entries",
+        "APAdjustment": "apadjustment",
+        "PurchaseOrders": "purchase_orders",
+    }
+
+    # payload fields resolved with a reference table, by endpoint
+    reference_fields = {
+        "account_payable_vendors": {"VENDORID": "vendors", "NAME": "vendors"},
+        "bills": {
+            "VENDORNAME": "vendors",
+            "VENDORNUMBER": "vendors",
+            "LOCATIONNAME": "locations",
+            "CLASSNAME": "classes",
+            "PROJECTNAME": "projects",
+            "ITEMNAME": "items",
+            "ACCOUNTID": "accounts",
+            "ACCOUNTNAME": "accounts",
+            "DEPARTMENT": "departments",
+            "DEPARTMENTNAME": "departments",
+            "EMPLOYEENO": "employees",
+        },
+        "purchase_invoices": {
+            "VENDORID": "vendors",
+            "VENDORNAME": "vendors",
+            "LOCATIONNAME": "locations",
+            "CLASSNAME": "classes",
+            "PROJECTNAME": "projects",
+            "ITEMNAME": "items",
+            "ACCOUNTID": "accounts",
+            "ACCOUNTNAME": "accounts",
+            "DEPARTMENT": "departments",
+            "DEPARTMENTNAME": "departments",
+            "EMPLOYEENO": "employees",
+        },
+        "journal_entries": {
+            "ACCOUNTID": "accounts",
+            "ACCOUNTNAME": "accounts",
+            "DEPARTMENT": "departments",
+            "DEPARTMENTNAME": "departments",
+            "LOCATIONNAME": "locations",
+            "CLASSNAME": "classes",
+            "CUSTOMERNAME": "customers",
+            "VENDORNAME": "vendors",
+        },
+        "apadjustment": {
+            "vendorname": "vendors",
+            "accountid": "accounts",
+            "accountlabel": "accounts",
+            "projectname": "projects",
+            "locationname": "locations",
+            "classname": "classes",
+            "departmentname": "departments",
+        },
+        "purchase_orders": {
+            "vendorname": "vendors",
+            "itemid": "items",
+            "itemname": "items",
+            "locationname": "locations",
+            "departmentname": "departments",
+            "projectid": "projects",
+            "projectname": "projects",
+            "classname": "classes",
+        },
+    }
+
     def __init__(
         self,
         target: PluginBase,
@@ -43,7 +146,23 @@ class intacctSink(HotglueSink):
             if "user_agent" in target.config
             else {},
             use_locations=target.config.get("use_locations", False) and self.stream_name != "Suppliers",
-            location_id=target.config.get("location_id")
+            location_id=target.config.get("location_id"),
+            pool_size=target.config.get(
+                "pool_size",
+                max(10, int(target.config.get("max_workers", 1)), int(target.config.get("page_parallelism", 1))),
+            ),
+            warm_connections=target.config.get("warm_connections", 1),
+            request_logger=RequestLogger.from_config(target.config),
+            page_parallelism=int(target.config.get("page_parallelism", 1)),
+            session_cache=get_session_cache(target.config.get("session_cache_path")),
+            rate_limiter=RateLimiter.from_config(target.config),
+            concurrency=get_concurrency_controller(
+                max(int(target.config.get("max_workers", 1)), int(target.config.get("page_parallelism", 1)))
+            )
+            if target.config.get("adaptive_concurrency")
+            else None,
+            idempotent=bool(target.config.get("idempotent_writes")),
+            compress_requests=bool(target.config.get("compress_requests", False)),
         )
 
         self.vendors = None
@@ -57,6 +176,36 @@ class intacctSink(HotglueSink):
         self.po_transaction_types = None
         self.customers = None
         self.journal_entries = None
+        self.employees = None
+        # reference tables shared with the other sinks of the target
+        self.lookup_cache = target.lookup_cache
+        self.lookup_store = (
+            get_lookup_store(
+                target.config["lookup_store_path"],
+                float(target.config.get("lookup_reconcile_interval", LOOKUP_RECONCILE_INTERVAL)),
+            )
+            if target.config.get("lookup_store_path")
+            else None
+        )
+        # match reference names ignoring case and whitespace
+        self.normalize_lookup_keys = bool(target.config.get("normalize_lookup_keys", False))
+        # tables with more objects are looked up by value, 0 downloads every table
+        self.lookup_point_threshold = int(target.config.get("lookup_point_threshold", LOOKUP_POINT_THRESHOLD))
+
+        # batch mode sends buffered records as multi-function requests,
+        # max_workers > 1 uploads buffered records concurrently
+        self.batch_mode = bool(target.config.get("batch_mode")) and self.stream_name in self.batch_uploads
+        self.max_workers = int(target.config.get("max_workers", 1))
+        self.batch_size = 1
+        if self.batch_mode or self.max_workers > 1:
+            self.batch_size = int(target.config.get("batch_size", 50))
+        self.batch_flush_interval = float(target.config.get("batch_flush_interval", 30))
+        self._pending_records = []
+        self._pending_since = None
+        self._dispatched = {}
+        self._executor = None
+        # record fields resolved with a reference table, scanned to prefetch the tables
+        self._reference_paths = self.reference_paths()
 
 
     @property
@@ -67,70 +216,113 @@ class intacctSink(HotglueSink):
         """Preprocess the record."""
         return record
 
+    def clean_up(self) -> None:
+        """Report connection reuse and release the pooled connections."""
+        self.flush_pending_records()
+        if self._executor:
+            self._executor.shutdown()
+        self.logger.info(f"Connection stats for {self.stream_name}: {self.client.get_connection_stats()}")
+        self.logger.info(f"Lookup cache stats after {self.stream_name}: {self.lookup_cache.stats()}")
+        if self.lookup_store:
+            self.logger.info(f"Lookup store stats after {self.stream_name}: {self.lookup_store.stats()}")
+        for name, table in vars(self).items():
+            if isinstance(table, PointLookupTable):
+                self.logger.info(f"Point lookup stats of {name} after {self.stream_name}: {table.stats()}")
+        self.client.close()
+        super().clean_up()
+
+    def lookup_table(self, name: str, load):
+        """Returns a reference table from the cache shared by the sinks of the target."""
+        return self.lookup_cache.get(self.client.data_scope, name, load)
+
+    def reference_rows(self, *, object_type: str, fields: List[str]):
+        """Objects of a reference table, read through the lookup store when one is configured."""
+        if self.lookup_store is None:
+            return self.client.iter_entity(object_type=object_type, fields=fields)
+        return self.lookup_store.rows(self.client, object_type, fields)
+
+    def reference_table(self, name: str, object_type: str, name_field: str, id_field: str) -> LookupTable:
+        """
+        LookupTable of the objects of object_type by name, id and RECORDNO, shared by the sinks.
+
+        When the objects are more than lookup_point_threshold, a PointLookupTable
+        fetching only the objects looked up is returned instead. The objects
+        are counted with the first page read, which the download goes on from.
+        """
+        def load():
+            fields = sorted({"RECORDNO", id_field, name_field})
+            rows = None
+            if self.lookup_point_threshold:
+                # a table held by the lookup store is sized by its stored objects
+                count = self.lookup_store.count(self.client.data_scope, object_type) if self.lookup_store else None
+                if count is None:
+                    page, remaining = self.client.get_entity_page(object_type=object_type, fields=fields)
+                    count = len(page) + remaining
+                    if self.lookup_store is None:
+                        rows = page
+                        if remaining:
+                            rows = itertools.chain(page, self.client.iter_entity(
+                                object_type=object_type, fields=fields, after=page[-1]["RECORDNO"]
+                            ))
+                if count > self.lookup_point_threshold:
+                    self.logger.info(
+                        f"Looking {name} up by value: {count} objects, above the lookup_point_threshold "
+                        f"of {self.lookup_point_threshold}"
+                    )
+                    return PointLookupTable(
+                        self.client, object_type, name_field, id_field, count, normalize=self.normalize_lookup_keys
+                    )
+                self.logger.info(
+                    f"Loading the {count} {name}, within the lookup_point_threshold of {self.lookup_point_threshold}"
+                )
+            if rows is None:
+                rows = self.reference_rows(object_type=object_type, fields=fields)
+            return LookupTable(rows, name_field, id_field, normalize=self.normalize_lookup_keys)
+
+        return self.lookup_table(name, load)
+
     def get_vendors(self):
         # Lookup for vendors
         if self.vendors is None:
-            vendors = self.client.get_entity(
-                object_type="accounts_payable_vendors", fields=["VENDORID", "NAME"]
-            )
-            self.vendors = self.dictify(vendors, "NAME", "VENDORID")
+            self.vendors = self.reference_table("vendors", "accounts_payable_vendors", "NAME", "VENDORID")
         return self.vendors
 
     def get_classes(self):
         # Lookup for vendors
         if self.classes is None:
-            classes = self.client.get_entity(
-                object_type="classes", fields=["CLASSID", "NAME"]
-            )
-            self.classes = self.dictify(classes, "NAME", "CLASSID")
+            self.classes = self.reference_table("classes", "classes", "NAME", "CLASSID")
         return self.classes
 
     def get_projects(self): 
         # Lookup for vendors
         if self.projects is None:
-            projects = self.client.get_entity(
-                object_type="projects", fields=["RECORDNO", "PROJECTID", "NAME"]
-            )
-            self.projects = self.dictify(projects, "NAME", "PROJECTID")
-            self.projects_recordno = self.dictify(projects, "RECORDNO", "PROJECTID")
+            self.projects = self.reference_table("projects", "projects", "NAME", "PROJECTID")
         return self.projects
 
     def get_locations(self):
         # Lookup for Locations
         if self.locations is None:
-            locations = self.client.get_entity(
-                object_type="locations", fields=["LOCATIONID", "NAME"]
-            )
-            self.locations = self.dictify(locations, "NAME", "LOCATIONID")
+            self.locations = self.reference_table("locations", "locations", "NAME", "LOCATIONID")
         return self.locations
 
     def get_accounts(self):
         if self.accounts is None:
             # Lookup for accounts
-            accounts = self.client.get_entity(
-                object_type="general_ledger_accounts",
-                fields=["RECORDNO", "ACCOUNTNO", "TITLE"],
-            )
-            self.accounts = self.dictify(accounts, "TITLE", "ACCOUNTNO")
-            self.accounts_recordno = self.dictify(accounts, "RECORDNO", "ACCOUNTNO")
+            self.accounts = self.reference_table("accounts", "general_ledger_accounts", "TITLE", "ACCOUNTNO")
         return self.accounts
 
     def get_departments(self):
         if self.departments is None:
             # Lookup for accounts
-            departments = self.client.get_entity(
-                object_type="departments",
-                fields=["DEPARTMENTID", "TITLE"],
-            )
-            self.departments = self.dictify(departments, "TITLE", "DEPARTMENTID")
+            self.departments = self.reference_table("departments", "departments", "TITLE", "DEPARTMENTID")
         return self.departments
 
     def get_po_transaction_types(self):
         if self.po_transaction_types is None:
             # Lookup for accounts
-            self.po_transaction_types = self.client.get_entity(
-                object_type="po_transaction_types",
-                fields=["DOCID", "DOCCLASS"],
+            self.po_transaction_types = self.lookup_table(
+                "po_transaction_types",
+                lambda: self.client.get_entity(object_type="po_transaction_types", fields=["DOCID", "DOCCLASS"]),
             )
         return self.po_transaction_types
 
@@ -154,37 +346,115 @@ class intacctSink(HotglueSink):
     def get_items(self):
         if self.items is None:
             # Lookup for items
-            items = self.client.get_entity(
-                object_type="item", fields=["RECORDNO", "ITEMID", "NAME"]
-            )
-            self.items = self.dictify(items, "NAME", "ITEMID")
-            self.items_recordno = self.dictify(items, "RECORDNO", "ITEMID")
+            self.items = self.reference_table("items", "item", "NAME", "ITEMID")
         return self.items
 
     def get_customers(self):
         # Lookup for customers
         if self.customers is None:
-            customers = self.client.get_entity(
-                object_type="customers", fields=["CUSTOMERID", "NAME"]
-            )
-            self.customers = self.dictify(customers, "NAME", "CUSTOMERID")
+            self.customers = self.reference_table("customers", "customers", "NAME", "CUSTOMERID")
         return self.customers
 
     def get_journal_entries(self):
         # Lookup for journal_entries
         if self.journal_entries is None:
-            journal_entries = self.client.get_entity(
-                object_type="general_ledger_journal_entries", fields=["BATCH_TITLE", "RECORDNO"]
+            self.journal_entries = self.reference_table(
+                "journal_entries", "general_ledger_journal_entries", "BATCH_TITLE", "RECORDNO"
             )
-            self.journal_entries = self.dictify(journal_entries, "BATCH_TITLE", "RECORDNO")
         return self.journal_entries
 
+    def get_employees(self):
+        # Employees are only read by RECORDNO, a query per batch of the RECORDNOs referenced
+        if self.employees is None:
+            self.employees = self.lookup_table("employees", lambda: PointLookupTable(
+                self.client, "employees", "EMPLOYEEID", "EMPLOYEEID", query_fields=["RECORDNO"]
+            ))
+        return self.employees
 
-    def dictify(sefl, array, key, value):
-        array_ = {}
-        for i in array:
-            array_[i[key]] = i[value]
-        return array_
+    def reference_paths(self) -> List[tuple]:
+        """
+        (record field, line field, table) of the record fields the payload of the
+        stream resolves with a reference table, the line field is None for the
+        fields at the top of the record.
+        """
+        endpoint = self.mapping_endpoints.get(self.stream_name)
+        fields = self.reference_fields.get(endpoint, {})
+        if not fields:
+            return []
+        mapping = UnifiedMapping().read_json_file(f"mapping_{self.target_name}.json")[endpoint]
+        paths = []
+        for key, value in mapping.items():
+            if isinstance(value, list) and value:
+                value = value[0]
+            if isinstance(value, dict):
+                paths += [(key, field, fields[name]) for field, name in value.items() if name in fields]
+            elif value in fields:
+                paths.append((key, None, fields[value]))
+        if endpoint == "purchase_orders" and not self._target.config.get("po_transaction_type"):
+            paths.append((None, None, "po_transaction_types"))
+        return paths
+
+    def referenced_values(self, records: list) -> Dict[str, set]:
+        """Values each reference table is looked up with in records, by table."""
+        values = {}
+        for record in records:
+            for key, field, table in self._reference_paths:
+                if key is None:
+                    values.setdefault(table, set())
+                    continue
+                value = record.get(key)
+                if not value:
+                    continue
+                if field is None:
+                    found = [value]
+                else:
+                    # line items and addresses, the mapping accepts them as JSON strings too
+                    if isinstance(value, str):
+                        try:
+                            value = json.loads(value)
+                        except ValueError:
+                            continue
+                    if isinstance(value, dict):
+                        value = [value]
+                    if not isinstance(value, list):
+                        continue
+                    found = [line.get(field) for line in value if isinstance(line, dict)]
+                found = {str(value) for value in found if value}
+                if found:
+                    values.setdefault(table, set()).update(found)
+        return values
+
+    def prefetch_references(self, records: list) -> None:
+        """
+        Load the reference tables records are resolved with before their payloads
+        are built, in parallel, so the first record doesn't wait for each table in
+        turn. Tables none of the records reference aren't loaded, and the tables
+        looked up by value (see reference_table) only fetch the values of records.
+
+        A table that fails to load is only logged, the record that needs it loads
+        it again and fails on its own.
+        """
+        values = self.referenced_values(records)
+        loading = [table for table in values if getattr(self, table) is None]
+        tables = sorted(loading + [
+            table for table in values if isinstance(getattr(self, table), PointLookupTable)
+        ])
+        if not tables:
+            return
+
+        def prefetch(table):
+            loaded = getattr(self, f"get_{table}")()
+            if isinstance(loaded, PointLookupTable):
+                loaded.resolve(values[table])
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=len(tables), thread_name_prefix=f"{self.stream_name}-prefetch") as executor:
+            futures = {table: executor.submit(prefetch, table) for table in tables}
+        for table, future in futures.items():
+            if future.exception():
+                self.logger.warning(f"Failed to prefetch the {table} of {self.stream_name}: {future.exception()}")
+        if loading:
+            self.logger.info(f"Prefetched {sorted(loading)} for {self.stream_name} in {time.monotonic() - start:.2f}s")
 
     def post_attachments(self, payload, record):
         mapping = UnifiedMapping(config=self.config)
@@ -231,19 +501,111 @@ class intacctSink(HotglueSink):
         return None
     
     def get_employee_id_by_recordno(self, recordno):
-        employee = self.client.query_entity(
-            object_type="employees",
-                fields={
-                    "RECORDNO",
-                    "EMPLOYEEID",
-                },
-                filters={"equalto": {"field": "RECORDNO", "value": f"{recordno}"}},
-        )
-        if employee:
-            return employee["EMPLOYEEID"]
+        employee_id = self.get_employees().id_for_recordno(recordno)
+        if employee_id:
+            return employee_id
         raise Exception(f"Employee with recordno {recordno} not found.")
 
+    def send_upload(self, upload, record=None):
+        """Send a payload prepared by one of the *_payload methods and parse its response."""
+        if "result" in upload:
+            return upload["result"]
+        controlid = self.upload_controlid(upload, record)
+        try:
+            try:
+                response = self.client.format_and_send_request(
+                    upload["data"],
+                    use_payload=upload.get("use_payload", False),
+                    controlid=controlid,
+                )
+            except DuplicateRequestError:
+                return self.resolve_duplicate(upload, controlid)
+        except Exception as e:
+            self.delete_failed_supdoc(upload)
+            raise Exception(e)
+        return self.parse_upload_response(upload, response)
+
+    def resolve_duplicate(self, upload, controlid):
+        """
+        Finds out what became of an upload Intacct rejected as the replay of an earlier request.
+
+        The earlier request may have failed, so a created object is looked up by
+        its id and the upload is sent again when it isn't found. An update is
+        sent again, it gives the same result. The other creates can't be looked
+        up, they fail rather than risk a second object.
+        """
+        action, body = next(iter(upload["data"].items()))
+        if not action.startswith("update"):
+            object_type = next((key for key in body if key in self.replay_lookups), None)
+            if object_type is not None:
+                object_name, field = self.replay_lookups[object_type]
+                value = body[object_type].get(field)
+            if object_type is None or not value:
+                raise Exception(
+                    f"{self.stream_name} record was already sent with controlid {controlid}, "
+                    "check in Intacct whether it was created"
+                )
+            found = self.client.get_entity(
+                object_type=object_name,
+                fields=["RECORDNO"],
+                filter={"filter": {"equalto": {"field": field, "value": value}}},
+            )
+            if found:
+                found = found[0] if isinstance(found, list) else found
+                self.logger.info(f"{self.stream_name} record with controlid {controlid} was already created")
+                self.add_created_vendor(upload, found["RECORDNO"])
+                return found["RECORDNO"], True, {}
+
+        self.logger.info(f"{self.stream_name} record with controlid {controlid} was not written, sending it again")
+        response = self.client.format_and_send_request(upload["data"], use_payload=upload.get("use_payload", False))
+        return self.parse_upload_response(upload, response)
+
+    def upload_controlid(self, upload, record=None):
+        """
+        With idempotent_writes, a controlid derived from the stream, the record key
+        and the payload, so a retry or a replay of the record reuses it.
+        """
+        if not self.config.get("idempotent_writes"):
+            return None
+        record = record or {}
+        key = record.get("id") or record.get("externalId") or ""
+        payload = json.dumps(upload["data"], sort_keys=True, default=str)
+        return hashlib.sha256(f"{self.stream_name}|{key}|{payload}".encode("utf-8")).hexdigest()
+
+    def parse_upload_response(self, upload, response):
+        if upload.get("response_object"):
+            record_number = response.get("data", {}).get(upload["response_object"], {}).get("RECORDNO")
+        else:
+            record_number = response.get("key")
+        success = response.get("status") == "success"
+        if success:
+            self.add_created_vendor(upload, record_number)
+        return record_number, success, {}
+
+    def add_created_vendor(self, upload, record_number):
+        """
+        Adds a vendor the upload created to the vendor tables loaded in the run,
+        so the records of every sink referencing it find it.
+        """
+        action, body = next(iter(upload["data"].items()))
+        vendor = body.get("VENDOR") if action == "create" else None
+        if not vendor:
+            return
+        for table in self.lookup_cache.loaded("vendors"):
+            table.add(vendor.get("NAME"), vendor.get("VENDORID"), record_number)
+
+    def delete_failed_supdoc(self, upload):
+        # if the document is new and attachments were posted, delete attachments
+        supdoc_id = upload.get("supdoc_id")
+        if supdoc_id and list(upload["data"].keys())[0] == "create":
+            del_supdoc = {"delete_supdoc": {"@key": supdoc_id, "object": "supdoc"}}
+            self.client.format_and_send_request(del_supdoc)
+            self.logger.info(f"Supdoc '{supdoc_id}' deleted due {upload.get('document')} failed while being created.")
+
     def purchase_invoices_upload(self, record):
+        return self.send_upload(self.purchase_invoices_payload(record), record)
+
+    def purchase_invoices_payload(self, record):
         # Format data
         mapping = UnifiedMapping()
         payload = mapping.prepare_payload(record, "purchase_invoices", self.target_name)
@@ -287,7 +649,7 @@ class intacctSink(HotglueSink):
                 )
         payload.pop("VENDORNAME", None)
         
-        if payload.get("VENDORID") not in self.vendors.values():
+        if not self.vendors.has_id(payload.get("VENDORID")):
             raise Exception(
                 f"ERROR: VENDORID {payload['VENDORID']} not found for this account."
             )
@@ -335,9 +697,10 @@ class intacctSink(HotglueSink):
             if custom_fields:
                 [item.update({cf.get("name"): cf.get("value")}) for cf in custom_fields]
 
-            self.get_accounts()
+            if item.get("ACCOUNTID") or item.get("ACCOUNTNAME"):
+                self.get_accounts()
             if item.get("ACCOUNTID"):
-                item["ACCOUNTNO"] = next(( self.accounts_recordno.get(x) for x in self.accounts_recordno if x == item['ACCOUNTID']), None)
+                item["ACCOUNTNO"] = self.accounts.id_for_recordno(item["ACCOUNTID"])
                 item.pop("ACCOUNTID", None)
             if item.get("ACCOUNTNAME") and not item.get("ACCOUNTNO"):
                 item["ACCOUNTNO"] = self.accounts.get(item["ACCOUNTNAME"])
@@ -346,14 +709,14 @@ class intacctSink(HotglueSink):
                     f"ERROR: Account not provided or not valid for this tenant in item {item}. \n Intaccts Requires an ACCOUNTNO associated with each line item"
                 )                
 
-            self.get_items()
-            if payload.get("ITEMNAME") and self.items.get(payload.get("ITEMNAME")):
+            if payload.get("ITEMNAME") and self.get_items().get(payload.get("ITEMNAME")):
                 item["ITEMID"] = self.items.get(payload.get("ITEMNAME"))
                 item.pop("ITEMNAME")
 
-            self.get_departments()
             department_name = item.pop("DEPARTMENTNAME", None)
             department = item.pop("DEPARTMENT", None)
+            if (department_name or department) and not item.get("DEPARTMENTID"):
+                self.get_departments()
             if department and not item.get("DEPARTMENTID"):
                 item["DEPARTMENTID"] = self.departments.get(department)
             elif department_name and not item.get("DEPARTMENTID"):
@@ -374,19 +737,12 @@ class intacctSink(HotglueSink):
         else:
             data = {"create": {"object": "accounts_payable_bills", "APBILL": payload}}
 
-        try:
-            response = self.client.format_and_send_request(data)
-            record_number = response.get("data", {}).get("apbill", {}).get("RECORDNO")
-            return record_number, True, {}
-        except Exception as e:
-            # if invoice is new and attachments were posted, delete attachments
-            if supdoc_id and list(data.keys())[0] == "create": 
-                del_supdoc = {"delete_supdoc": {"@key": supdoc_id, "object": "supdoc"}}
-                self.client.format_and_send_request(del_supdoc)
-                self.logger.info(f"Supdoc '{supdoc_id}' deleted due invoice failed while being created.")
-            raise Exception(e)
+        return {"data": data, "response_object": "apbill", "supdoc_id": supdoc_id, "document": "invoice"}
 
     def bills_upload(self, record):
+        return self.send_upload(self.bills_payload(record), record)
+
+    def bills_payload(self, record):
         # Format data
         mapping = UnifiedMapping()
         payload = mapping.prepare_payload(record, "bills", self.target_name)
@@ -442,7 +798,7 @@ class intacctSink(HotglueSink):
 
             elif payload.get("VENDORNUMBER"):
                 vendor_id = payload.pop("VENDORNUMBER")
-                if vendor_id in self.vendors.values():
+                if self.vendors.has_id(vendor_id):
                     payload["VENDORID"] = vendor_id
                 else:
                     raise Exception(f"ERROR: VENDORID {payload['VENDORNUMBER']} not found for this account.")
@@ -488,9 +844,10 @@ class intacctSink(HotglueSink):
             item.pop("ITEMNAME", None)
 
             #use account instead of accountno
-            self.get_accounts()
+            if item.get("ACCOUNTID") or item.get("ACCOUNTNAME"):
+                self.get_accounts()
             if item.get("ACCOUNTID"):
-                item["ACCOUNTNO"] = next(( self.accounts_recordno.get(x) for x in self.accounts_recordno if x == item['ACCOUNTID']), None)
+                item["ACCOUNTNO"] = self.accounts.id_for_recordno(item["ACCOUNTID"])
                 item.pop("ACCOUNTID", None)
             if item.get("ACCOUNTNAME") and not item.get("ACCOUNTNO"):
                 item["ACCOUNTNO"] = self.accounts.get(item["ACCOUNTNAME"])
@@ -500,7 +857,8 @@ class intacctSink(HotglueSink):
                 )
 
             #departmentid is optional
-            self.get_departments()
+            if (item.get("DEPARTMENT") or item.get("DEPARTMENTNAME")) and not item.get("DEPARTMENTID"):
+                self.get_departments()
             if item.get("DEPARTMENT") and not item.get("DEPARTMENTID"):
                 item["DEPARTMENTID"] = self.departments.get(item.get("DEPARTMENT"))
             item.pop("DEPARTMENT", None)
@@ -528,20 +886,12 @@ class intacctSink(HotglueSink):
         else:
             data = {"create": {"object": "accounts_payable_bills", "APBILL": payload}}
 
-        try:
-            response = self.client.format_and_send_request(data)
-            record_number = response.get("data", {}).get("apbill", {}).get("RECORDNO")
-            return record_number, response.get("status") == "success", {}
-        except Exception as e:
-            # if invoice is new and attachments were posted, delete attachments
-            if supdoc_id and list(data.keys())[0] == "create": 
-                del_supdoc = {"delete_supdoc": {"@key": supdoc_id, "object": "supdoc"}}
-                self.client.format_and_send_request(del_supdoc)
-                self.logger.info(f"Supdoc '{supdoc_id}' deleted due bill failed while being created.")
-            raise Exception(e)
+        return {"data": data, "response_object": "apbill", "supdoc_id": supdoc_id, "document": "bill"}
 
     def journal_entries_upload(self, record):
+        return self.send_upload(self.journal_entries_payload(record), record)
 
+    def journal_entries_payload(self, record):
         # Format data
         mapping = UnifiedMapping()
         payload = mapping.prepare_payload(record, "journal_entries", self.target_name)
@@ -553,11 +903,12 @@ class intacctSink(HotglueSink):
             payload.pop("APBILLITEMS")
 
         for item in payload.get("ENTRIES").get("GLENTRY"):
-            self.get_accounts()
+            if item.get("ACCOUNTID") or item.get("ACCOUNTNAME"):
+                self.get_accounts()
             if item.get("ACCOUNTID"):
-                item["ACCOUNTNO"] = next(( self.accounts_recordno.get(x) for x in self.accounts_recordno if x == item['ACCOUNTID']), None)
+                item["ACCOUNTNO"] = self.accounts.id_for_recordno(item["ACCOUNTID"])
                 item.pop("ACCOUNTID", None)
-            if item.get("ACCOUNTNAME") and item.get("ACCOUNTNO") not in self.accounts.values():
+            if item.get("ACCOUNTNAME") and not self.accounts.has_id(item.get("ACCOUNTNO")):
                 item["ACCOUNTNO"] = self.accounts.get(item["ACCOUNTNAME"])
                 item.pop("ACCOUNTNAME")
             if not item.get("ACCOUNTNO"):
@@ -568,8 +919,9 @@ class intacctSink(HotglueSink):
                 value = 1 if item.get("TR_TYPE").lower() == "debit" else -1
                 item["TR_TYPE"] = value
 
-            self.get_departments()
             if not item.get("DEPARTMENTID"):
+                if item.get("DEPARTMENT") or item.get("DEPARTMENTNAME"):
+                    self.get_departments()
                 if item.get("DEPARTMENT"):
                     item["DEPARTMENT"] = self.departments[item.get("DEPARTMENT")]
                     item.pop("DEPARTMENT")
@@ -579,9 +931,9 @@ class intacctSink(HotglueSink):
             elif item.get("DEPARTMENTID"):
                 item["DEPARTMENT"] = item.get("DEPARTMENTID")
 
-            self.get_locations()
             if not item.get("LOCATION"):
                 if item.get("LOCATIONNAME"):
+                    self.get_locations()
                     item["LOCATION"] = self.locations[item.get("LOCATIONNAME")]
                     item.pop("LOCATIONNAME")
 
@@ -604,11 +956,12 @@ class intacctSink(HotglueSink):
 
         data = {"create": {"object": "GLBATCH", "GLBATCH": payload}}
 
-        response = self.client.format_and_send_request(data)
-        record_number = response.get("data", {}).get("glbatch", {}).get("RECORDNO")
-        return record_number, True, {}
+        return {"data": data, "response_object": "glbatch"}
 
     def suppliers_upload(self, record):
+        return self.send_upload(self.suppliers_payload(record), record)
+
+    def suppliers_payload(self, record):
         # Format data
         mapping = UnifiedMapping()
         payload = mapping.prepare_payload(
@@ -627,21 +980,20 @@ class intacctSink(HotglueSink):
                 data = {"create": {"object": "account_payable_vendors", "VENDOR": payload}}
 
                 self.get_vendors()
-                if (not payload["VENDORID"] in self.vendors.values()) and (
-                    not payload["NAME"] in self.vendors.keys()
-                ):
-                    response =self.client.format_and_send_request(data)
-                    record_number = response.get("data", {}).get("vendor", {}).get("RECORDNO")
-                    return record_number, True, {}
+                if not self.vendors.has_id(payload["VENDORID"]) and payload["NAME"] not in self.vendors:
+                    return {"data": data, "response_object": "vendor"}
                 else:
-                    return "", False, { "error": f"Vendor {payload['NAME']} already exists" }
+                    return {"result": ("", False, { "error": f"Vendor {payload['NAME']} already exists" })}
             else:
-                return "", False, { "error": f"Skipping vendor with {vendor_id} due to unsupported chars. Only letters, numbers and dashes accepted" }
+                return {"result": ("", False, { "error": f"Skipping vendor with {vendor_id} due to unsupported chars. Only letters, numbers and dashes accepted" })}
         else:
-            return "", False, { "error": f"Skipping vendor {payload} because vendorid is empty" }
-            
+            return {"result": ("", False, { "error": f"Skipping vendor {payload} because vendorid is empty" })}
+
 
     def apadjustment_upload(self, record):
+        return self.send_upload(self.apadjustment_payload(record), record)
+
+    def apadjustment_payload(self, record):
         # Format data
         mapping = UnifiedMapping()
         payload = mapping.prepare_payload(
@@ -662,7 +1014,7 @@ class intacctSink(HotglueSink):
         for item in payload.get("apadjustmentitems").get("lineitem", []):
             if item.get("accountid") and not item.get("glaccountno") and not item.get("accountlabel"):
                 self.get_accounts()
-                item["glaccountno"] = self.accounts_recordno.get(item["accountid"])
+                item["glaccountno"] = self.accounts.id_for_recordno(item["accountid"])
                 item.pop("accountid")
             elif item.get("accountlabel") and not item.get("glaccountno"):
                 self.get_accounts()
@@ -749,9 +1101,7 @@ class intacctSink(HotglueSink):
                 ordered_payload[key] = "Intacct Daily Rate"
 
         data = {"create_apadjustment": {"object": "apadjustment", "APADJUSTMENT": ordered_payload}}
-        response = self.client.format_and_send_request(data, use_payload=True)
-        key = response.get("key")
-        return key, response.get("status") == "success", {}
+        return {"data": data, "use_payload": True}
 
 
     def purchase_orders_upload(self, record):
@@ -775,9 +1125,9 @@ class intacctSink(HotglueSink):
                 order_lines = self.client.get_entity(object_type="purchase_orders_entry", fields=["RECORDNO"], filter={"filter": {"equalto":{"field":"DOCHDRNO","value": recordno}}, "pagesize": "2000"}, docparid="Purchase Order")
 
         # Get the matching values for the payload :
-        self.get_vendors()
         vendor_name = payload.pop("vendorname", None)
         if vendor_name and not payload.get("vendorid"):
+            self.get_vendors()
             try:
                 payload["vendorid"] = self.vendors[vendor_name]
             except:
@@ -817,9 +1167,9 @@ class intacctSink(HotglueSink):
         for item in items:
             item["unit"] = "Each"
 
-            self.get_locations()
             location_name = item.pop("locationname", None)
             if location_name and not item.get("locationid"):
+                self.get_locations()
                 try:
                     item["locationid"] = self.locations[location_name]
                 except:
@@ -827,9 +1177,9 @@ class intacctSink(HotglueSink):
                         "error": f"ERROR: Location {location_name} does not exist. Did you mean any of these: {list(self.locations.keys())}?"
                     }
             
-            self.get_departments()
             department_name = item.pop("departmentname", None)
             if department_name and not item.get("departmentid"):
+                self.get_departments()
                 try:
                     item["departmentid"] = self.departments[department_name]
                 except:
@@ -837,8 +1187,9 @@ class intacctSink(HotglueSink):
                         "error": f"ERROR: Department {department_name} does not exist. Did you mean any of these: {list(self.departments.keys())}?"
                     }
                 
-            self.get_projects()
             project_name = item.pop("projectname", None)
+            if project_name or item.get("projectid"):
+                self.get_projects()
             if project_name and not item.get("projectid"):
                 try:
                     item["projectid"] = self.projects[project_name]
@@ -847,18 +1198,18 @@ class intacctSink(HotglueSink):
                         "error": f"ERROR: Project {project_name} does not exist. Did you mean any of these: {list(self.projects.keys())}?"
                     }
 
-            if item.get("projectid") and item.get("projectid") in self.projects_recordno.keys():
-                item["projectid"] = self.projects_recordno.get(item.get("projectid"))
-            elif item.get("projectid") and item.get("projectid") in self.projects.values():
+            if item.get("projectid") and self.projects.id_for_recordno(item.get("projectid")):
+                item["projectid"] = self.projects.id_for_recordno(item.get("projectid"))
+            elif item.get("projectid") and self.projects.has_id(item.get("projectid")):
                 item["projectid"] = item.get("projectid")
             elif item.get("projectid"):
                 return None, False, {
                     "error": f"ERROR: Project {item.get('projectid')} does not exist. Did you mean any of these: {list(self.projects.values())}?"
                 }
                 
-            self.get_classes()
             class_name = item.pop("classname", None)
             if class_name and not item.get("classid"):
+                self.get_classes()
                 try:
                     item["classid"] = self.classes[class_name]
                 except:
@@ -866,12 +1217,13 @@ class intacctSink(HotglueSink):
                         "error": f"ERROR: Class {class_name} does not exist. Did you mean any of these: {list(self.classes.keys())}?"
                     }
 
-            self.get_items()
-            if item.get("itemid") and self.items_recordno.get(item.get("itemid")):
-                item["itemid"] = self.items_recordno.get(item.get("itemid"))
+            if item.get("itemid") or item.get("itemname"):
+                self.get_items()
+            if item.get("itemid") and self.items.id_for_recordno(item.get("itemid")):
+                item["itemid"] = self.items.id_for_recordno(item.get("itemid"))
             elif item.get("itemname") and self.items.get(item.get("itemname")):
                 item["itemid"] = self.items.get(item.get("itemname"))
-            elif item.get("itemid") and item.get("itemid") in self.items.values():
+            elif item.get("itemid") and self.items.has_id(item.get("itemid")):
                 item["itemid"] = item.get("itemid")
             elif item.get("itemid"):
                 return None, False, {
@@ -925,16 +1277,15 @@ class intacctSink(HotglueSink):
     def get_banks(self):
         # Lookup for banks
         if self.banks is None:
-            banks = self.client.get_entity(
+            self.banks = self.lookup_table("banks", lambda: self.client.get_entity(
                 object_type="payment_provider_bank_accounts",
                 fields=["BANKACCOUNTID", "PROVIDERID"],
-            )
-            self.banks = banks
+            ))
         return self.banks
 
     def get_record_url(self, object, record_id, state_updates):
         try:
-            if self.config.get("output_record_url"):
+            if self.config.get("output_record_url") and record_id:
                 record_url_payload = {
                     "readByQuery": {
                         "object": object,
@@ -957,30 +1308,204 @@ class intacctSink(HotglueSink):
         return state_updates
 
 
+    def process_record(self, record: dict, context: dict) -> None:
+        """Process the record, buffering it when the stream is sent in batches."""
+        if self.batch_size <= 1:
+            self.prefetch_references([record])
+            return super().process_record(record, context)
+
+        if not self._pending_records:
+            self._pending_since = time.monotonic()
+        self._pending_records.append((record, context))
+
+        if (
+            len(self._pending_records) >= self.batch_size
+            or time.monotonic() - self._pending_since >= self.batch_flush_interval
+        ):
+            self.flush_pending_records()
+
+    def process_batch(self, context: dict) -> None:
+        """Send the buffered records when the target drains the sink."""
+        self.flush_pending_records()
+        super().process_batch(context)
+
+    def flush_pending_records(self) -> None:
+        """
+        Upload the buffered records and emit their state in input order.
+
+        Records already synced, and the repeats of a record in the buffer, are
+        not dispatched: the base process_record skips them or, when the first
+        copy failed, uploads them again, the same as in a sequential run.
+        """
+        pending, self._pending_records = self._pending_records, []
+        if not pending:
+            return
+
+        if not self.latest_state:
+            self.init_state()
+        # not get_existing_state, which counts the record as existing: the
+        # base process_record does that when it skips the record
+        seen = {state.get("hash") for state in self.latest_state["bookmarks"][self.name] if state.get("success")}
+        records = {}
+        for record, context in pending:
+            hash = self.build_record_hash(record)
+            if hash in seen:
+                continue
+            seen.add(hash)
+            # the base process_record takes externalId out of the record it
+            # passes to upsert_record, the upload is keyed by the hash of that
+            upload = {key: value for key, value in record.items() if key != "externalId"}
+            records.setdefault(self.build_record_hash(upload), (upload, context))
+
+        self.prefetch_references([record for record, _ in records.values()])
+        self._dispatched = self.dispatch_records(records)
+        try:
+            for record, context in pending:
+                super().process_record(record, context)
+        finally:
+            self._dispatched = {}
+
+    def dispatch_records(self, records: Dict[str, tuple]) -> Dict[str, Future]:
+        """
+        Start the upload of the (record, context) pairs keyed by the hash of
+        the record upsert_record receives.
+
+        Returns the future of the (id, success, state) of each record by hash.
+        The uploads get copies: the payloads change the records (attachments),
+        which must keep the hash the base process_record builds for them.
+        """
+        records = {hash: copy.deepcopy(pair) for hash, pair in records.items()}
+        if not self.batch_mode:
+            executor = self.worker_pool()
+            return {
+                hash: executor.submit(self.write_record, record, context)
+                for hash, (record, context) in records.items()
+            }
+
+        futures = {}
+        results = self.upload_batch([record for record, _ in records.values()])
+        for hash, result in zip(records, results):
+            futures[hash] = Future()
+            if isinstance(result, Exception):
+                futures[hash].set_exception(result)
+            else:
+                futures[hash].set_result(result)
+        return futures
+
+    def upload_batch(self, records: list) -> list:
+        """
+        Send the payloads of many records in multi-function requests.
+
+        Returns a (id, success, state) tuple or the raised exception for each record.
+        """
+        payload_method, object = self.batch_uploads[self.stream_name]
+        results = [None] * len(records)
+        uploads = []
+        prepared = self.map_records(getattr(self, payload_method), records)
+        for index, upload in enumerate(prepared):
+            if isinstance(upload, Exception):
+                results[index] = upload
+                continue
+            if "result" in upload:
+                results[index] = upload["result"]
+            else:
+                # the controlids don't change when the batch is retried
+                controlid = self.upload_controlid(upload, records[index]) or f"{self.stream_name}-{index}"
+                uploads.append((index, upload, controlid))
+
+        if not uploads:
+            return results
+
+        # the same write of two records is sent once, both get its response
+        functions = {}
+        for _, upload, controlid in uploads:
+            functions.setdefault(controlid, upload["data"])
+        try:
+            responses = self.client.format_and_send_batch(
+                list(functions.values()),
+                use_payload=uploads[0][1].get("use_payload", False),
+                controlids=list(functions),
+                max_functions=self.batch_size,
+            )
+        except Exception as e:
+            responses = {controlid: e for controlid in functions}
+
+        for index, upload, controlid in uploads:
+            response = responses.get(controlid)
+            try:
+                if isinstance(response, DuplicateRequestError):
+                    record_number, success, state = self.resolve_duplicate(upload, controlid)
+                elif isinstance(response, Exception):
+                    raise response
+                else:
+                    record_number, success, state = self.parse_upload_response(upload, response)
+            except Exception as e:
+                try:
+                    self.delete_failed_supdoc(upload)
+                except Exception as delete_error:
+                    self.logger.error(f"Failed to delete supdoc '{upload.get('supdoc_id')}': {delete_error}")
+                results[index] = e
+                continue
+            if success:
+                state = self.get_record_url(object, record_number, state)
+            results[index] = (record_number, success, state)
+        return results
+
+    def map_records(self, function, items: list) -> list:
+        """
+        Apply function to each item, in the worker pool when max_workers > 1.
+
+        Returns the results in input order, with the raised exception in place
+        of the result of a failed item.
+        """
+        def call(item):
+            try:
+                return function(item)
+            except Exception as e:
+                return e
+
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [call(item) for item in items]
+        return list(self.worker_pool().map(call, items))
+
+    def worker_pool(self) -> ThreadPoolExecutor:
+        """The threads uploading the records of the sink, started on first use."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix=f"{self.stream_name}-worker"
+            )
+        return self._executor
+
     def upsert_record(self, record: dict, context: dict) -> None:
+        future = self._dispatched.pop(self.build_record_hash(record), None)
+        if future is not None:
+            return future.result()
+        return self.write_record(record, context)
 
+    def write_record(self, record: dict, context: dict):
+        """Upload the record and return its (id, success, state)."""
         if self.stream_name == "Suppliers":
-            id, success, state = self.suppliers_upload(record)
+            record_id, success, state = self.suppliers_upload(record)
             object = "VENDOR"
         if self.stream_name == "PurchaseInvoices":
-            id, success, state = self.purchase_invoices_upload(record)
+            record_id, success, state = self.purchase_invoices_upload(record)
             object = "APBILL"
         if self.stream_name == "Bills":
-            id, success, state = self.bills_upload(record)
+            record_id, success, state = self.bills_upload(record)
             object = "APBILL"
         if self.stream_name == "JournalEntries":
-            id, success, state = self.journal_entries_upload(record)
+            record_id, success, state = self.journal_entries_upload(record)
             object = "GLBATCH"
         if self.stream_name == "APAdjustment":
-            id, success, state = self.apadjustment_upload(record)
+            record_id, success, state = self.apadjustment_upload(record)
             object = "APADJUSTMENT"
         if self.stream_name == "PurchaseOrders":
-            id, success, state = self.purchase_orders_upload(record)
+            record_id, success, state = self.purchase_orders_upload(record)
             object = "PODOCUMENT"
 
         if success:
-            state = self.get_record_url(object, id, state)
-        return id, success, state
+            state = self.get_record_url(object, record_id, state)
+        return record_id, success, state
 
 
 class BillPaymentsSink(intacctSink):
@@ -1093,7 +1618,7 @@ class BillPaymentsSink(intacctSink):
         return payload
 
 
-    def upsert_record(self, record, context):
+    def write_record(self, record, context):
         """Process the record."""
 
         state = {}
@@ -0,0 +1,324 @@
+"""
+Deterministic synthetic Singer input for load tests.
+
+Writes the SCHEMA and RECORD messages of every stream the sinks accept, with
+the field names of mapping_intacct-v2.json. The records reference the objects
+the gateway emulator seeds (vendor "Vendor 12", account "00012", etc.), except
+for a configurable share of references to unknown objects. Each record is
+derived from the seed, stream and record number only, so the same settings
+always give the same bytes, and records are written as they are generated.
+
+Usage:
+    python -m target_intacct.synthetic --streams Bills,JournalEntries --records 100000 \\
+        --lines 5 --vendors 100 --unknown-share 0.01 --seed 0 > input.singer
+
+Attachments are read by the target from its `input_path`, pass the same
+directory as --attachments-dir with --attachment-kb.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from typing import Dict, Iterator, List, Optional, Sequence, TextIO
+
+from target_intacct.emulator import SEED_FIELDS
+
+MAPPING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mapping_intacct-v2.json")
+
+# stream of each sink and its endpoint in the mapping, BillPayments is not mapped
+STREAMS = {
+    "Suppliers": "account_payable_vendors",
+    "Bills": "bills",
+    "PurchaseInvoices": "purchase_invoices",
+    "JournalEntries": "journal_entries",
+    "APAdjustment": "apadjustment",
+    "PurchaseOrders": "purchase_orders",
+    "BillPayments": None,
+}
+
+NUMBER_FIELDS = {
+    "amount",
+    "amountDue",
+    "discountAmount",
+    "quantity",
+    "subTotal",
+    "taxAmount",
+    "totalAmount",
+    "totalDiscount",
+    "totalPrice",
+    "totalTaxAmount",
+    "unitPrice",
+}
+
+BILL_PAYMENT_FIELDS = ["billNumber", "billId", "vendorId", "vendorName", "paymentDate", "amount",
+                       "currency", "accountNumber", "paymentMethod"]
+
+ATTACHMENT_ID = "synthetic"
+ATTACHMENT_NAME = "invoice.pdf"
+
+
+def bill_number(n: int) -> str:
+    """Number of the n-th synthetic bill, the BillPayments records pay the same numbers."""
+    return f"BILL-{n:06d}"
+
+
+def attachment_id(kb: int) -> str:
+    return f"{ATTACHMENT_ID}-{kb}kb"
+
+
+def _field_schema(name: str, value) -> Dict:
+    if name == "customFields":
+        return {
+            "type": ["array", "null"],
+            "items": {"type": "object", "properties": {"name": {"type": ["string", "null"]}, "value": {}}},
+        }
+    if isinstance(value, dict):
+        return {
+            "type": ["object", "null"],
+            "properties": {key: _field_schema(key, v) for key, v in value.items()},
+        }
+    if isinstance(value, list):
+        return {"type": ["array", "null"], "items": _field_schema(name, value[0] if value else {})}
+    if name in NUMBER_FIELDS:
+        return {"type": ["number", "null"]}
+    return {"type": ["string", "null"]}
+
+
+def stream_schema(stream: str) -> Dict:
+    """JSON schema of a stream, with the fields its mapping endpoint reads."""
+    endpoint = STREAMS[stream]
+    if endpoint is None:
+        return {
+            "type": "object",
+            "properties": {field: _field_schema(field, None) for field in BILL_PAYMENT_FIELDS},
+        }
+    with open(MAPPING_PATH) as f:
+        fields = json.load(f)[endpoint]
+    schema = {
+        "type": "object",
+        "properties": {key: _field_schema(key, value) for key, value in fields.items()},
+    }
+    if endpoint in ("bills", "purchase_invoices", "purchase_orders"):
+        schema["properties"]["attachments"] = {
+            "type": ["array", "null"],
+            "items": {
+                "type": "object",
+                "properties": {key: {"type": ["string", "null"]} for key in ("id", "name", "url")},
+            },
+        }
+    return schema
+
+
+class SyntheticGenerator:
+    """
+    Synthetic records referencing the first `vendors`, `accounts` and
+    `departments` rows of the emulator reference data, and the first
+    `references` rows of the other reference objects.
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        lines: int = 5,
+        vendors: int = 100,
+        accounts: int = 100,
+        departments: int = 100,
+        references: int = 100,
+        attachment_kb: Sequence[int] = (),
+        unknown_share: float = 0.0,
+    ):
+        if not 0.0 <= unknown_share <= 1.0:
+            raise ValueError("unknown_share must be between 0 and 1")
+        self.seed = seed
+        self.lines = lines
+        self.cardinality = {
+            "VENDOR": vendors,
+            "GLACCOUNT": accounts,
+            "DEPARTMENT": departments,
+        }
+        self.references = references
+        self.attachment_kb = list(attachment_kb)
+        self.unknown_share = unknown_share
+
+    def write_attachments(self, directory: str) -> List[str]:
+        """Writes the attachment files the records reference in directory, returns their paths."""
+        paths = []
+        for kb in self.attachment_kb:
+            rng = random.Random(f"{self.seed}-attachment-{kb}")
+            size = kb * 1024
+            path = os.path.join(directory, f"{attachment_id(kb)}_{ATTACHMENT_NAME}")
+            with open(path, "wb") as f:
+                f.write(rng.getrandbits(8 * size).to_bytes(size, "little") if size else b"")
+            paths.append(path)
+        return paths
+
+    def record(self, stream: str, n: int) -> Dict:
+        """The n-th record of stream, n starting at 1."""
+        if stream not in STREAMS:
+            raise ValueError(f"Unknown stream {stream}")
+        rng = random.Random(f"{self.seed}-{stream}-{n}")
+
+        def ref(object_type, field):
+            rows = self.cardinality.get(object_type, self.references)
+            if self.unknown_share and rng.random() < self.unknown_share:
+                return f"Unknown {object_type.lower()} {rng.randint(1, 1_000_000)}"
+            return SEED_FIELDS[object_type][field].format(rng.randint(1, max(rows, 1)))
+
+        def amount():
+            return round(rng.uniform(1, 5000), 2)
+
+        attachments = []
+        if self.attachment_kb:
+            attachments = [{"id": attachment_id(rng.choice(self.attachment_kb)), "name": ATTACHMENT_NAME}]
+
+        if stream == "Suppliers":
+            return {
+                "vendorNumber": f"NV{n:06d}",
+                "vendorName": f"New vendor {n}",
+                "currency": "USD",
+                "note": f"Synthetic vendor {n}",
+                "addresses": {
+                    "line1": f"{n} Main St",
+                    "city": "Springfield",
+                    "state": "IL",
+                    "country": "US",
+                    "postalCode": f"{rng.randint(10000, 99999)}",
+                },
+            }
+        if stream in ("Bills", "PurchaseInvoices"):
+            record = {
+                "invoiceNumber": bill_number(n),
+                "createdAt": "2024-01-02T00:00:00Z",
+                "dueDate": "2024-02-01T00:00:00Z",
+                "currency": "USD",
+                "description": f"Synthetic bill {n}",
+                "lineItems": [
+                    {
+                        "accountNumber": ref("GLACCOUNT", "ACCOUNTNO"),
+                        "totalPrice": amount(),
+                        "description": f"Line {line}",
+                        "departmentName": ref("DEPARTMENT", "TITLE"),
+                        "className": ref("CLASS", "NAME"),
+                    }
+                    for line in range(self.lines)
+                ],
+                "attachments": attachments,
+            }
+            record["vendorName" if stream == "Bills" else "supplierName"] = ref("VENDOR", "NAME")
+            return record
+        if stream == "JournalEntries":
+            lines = []
+            for line in range(self.lines // 2 or 1):
+                value = amount()
+                lines.append({
+                    "accountNumber": ref("GLACCOUNT", "ACCOUNTNO"),
+                    "amount": value,
+                    "postingType": "Debit",
+                    "description": f"Line {line}",
+                    "departmentName": ref("DEPARTMENT", "TITLE"),
+                })
+                lines.append({
+                    "accountNumber": ref("GLACCOUNT", "ACCOUNTNO"),
+                    "amount": value,
+                    "postingType": "Credit",
+                    "description": f"Line {line}",
+                    "className": ref("CLASS", "NAME"),
+                })
+            return {"type": "GJ", "transactionDate": "2024-01-02T00:00:00Z", "lines": lines}
+        if stream == "APAdjustment":
+            return {
+                "vendorId": ref("VENDOR", "VENDORID"),
+                "transactionDate": "2024-01-02",
+                "adjustmentNumber": f"ADJ-{n:06d}",
+                "description": f"Synthetic adjustment {n}",
+                "currency": "USD",
+                "lineItems": [
+                    {"accountNumber": ref("GLACCOUNT", "ACCOUNTNO"), "amount": -amount(), "memo": f"Line {line}"}
+                    for line in range(self.lines)
+                ],
+            }
+        if stream == "PurchaseOrders":
+            return {
+                "vendorId": ref("VENDOR", "VENDORID"),
+                "transactionDate": "2024-01-02",
+                "number": f"PO-{n:06d}",
+                "description": f"Synthetic order {n}",
+                "currency": "USD",
+                "lineItems": [
+                    {
+                        "productId": ref("ITEM", "ITEMID"),
+                        "quantity": rng.randint(1, 20),
+                        "unitPrice": amount(),
+                        "departmentName": ref("DEPARTMENT", "TITLE"),
+                    }
+                    for _line in range(self.lines)
+                ],
+                "attachments": attachments,
+            }
+        # BillPayments
+        return {
+            "billNumber": bill_number(n),
+            "paymentDate": "2024-02-01T00:00:00Z",
+            "amount": amount(),
+            "currency": "USD",
+            "accountNumber": "BANK1",
+            "paymentMethod": "Printed Check",
+        }
+
+    def messages(self, stream: str, records: int) -> Iterator[Dict]:
+        """SCHEMA message of stream followed by its first `records` RECORD messages."""
+        yield {"type": "SCHEMA", "stream": stream, "schema": stream_schema(stream), "key_properties": []}
+        for n in range(1, records + 1):
+            yield {"type": "RECORD", "stream": stream, "record": self.record(stream, n)}
+
+    def write(self, out: TextIO, streams: Sequence[str], records: int) -> int:
+        """Writes the messages of each stream to out, one per line, returns the records written."""
+        written = 0
+        for stream in streams:
+            for message in self.messages(stream, records):
+                out.write(json.dumps(message) + "\n")
+            written += records
+        return written
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Deterministic synthetic Singer input for load tests")
+    parser.add_argument("--streams", default=",".join(STREAMS), help="comma separated, among " + ", ".join(STREAMS))
+    parser.add_argument("--records", type=int, default=1000, help="records per stream")
+    parser.add_argument("--lines", type=int, default=5, help="line items per record")
+    parser.add_argument("--vendors", type=int, default=100, help="distinct vendors referenced")
+    parser.add_argument("--accounts", type=int, default=100, help="distinct accounts referenced")
+    parser.add_argument("--departments", type=int, default=100, help="distinct departments referenced")
+    parser.add_argument("--references", type=int, default=100, help="distinct classes, items, etc. referenced")
+    parser.add_argument("--attachment-kb", default="", help="comma separated attachment sizes, none by default")
+    parser.add_argument("--attachments-dir", help="directory the attachment files are written to, the target input_path")
+    parser.add_argument("--unknown-share", type=float, default=0.0, help="share of the references to unknown objects")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    streams = [stream for stream in args.streams.split(",") if stream]
+    unknown = set(streams) - set(STREAMS)
+    if unknown:
+        parser.error(f"unknown streams: {sorted(unknown)}")
+    attachment_kb = [int(kb) for kb in args.attachment_kb.split(",") if kb]
+    if attachment_kb and not args.attachments_dir:
+        parser.error("--attachment-kb needs --attachments-dir")
+
+    generator = SyntheticGenerator(
+        seed=args.seed,
+        lines=args.lines,
+        vendors=args.vendors,
+        accounts=args.accounts,
+        departments=args.departments,
+        references=args.references,
+        attachment_kb=attachment_kb,
+        unknown_share=args.unknown_share,
+    )
+    if attachment_kb:
+        generator.write_attachments(args.attachments_dir)
+    generator.write(sys.stdout, streams, args.records)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@
 from singer_sdk import typing as th
 from singer_sdk.target_base import Target
 from target_hotglue.target import TargetHotglue
+from target_intacct.lookups import LookupCache
 from target_intacct.sinks import BillPaymentsSink, intacctSink
 
 
@@ -21,6 +22,15 @@ class Targetintacct(TargetHotglue):
     default_sink_class = intacctSink
     SINK_TYPES = [BillPaymentsSink, intacctSink]
 
+    _lookup_cache = None
+
+    @property
+    def lookup_cache(self) -> LookupCache:
+        """Reference tables shared by the sinks of the target."""
+        if self._lookup_cache is None:
+            self._lookup_cache = LookupCache()
+        return self._lookup_cache
+
     def get_sink_class(self, stream_name: str):
         """Get sink for a stream.
         """
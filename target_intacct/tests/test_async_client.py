@@ -0,0 +1,105 @@
+"""Tests of the asyncio client against the local gateway emulator."""
+
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from target_intacct.async_client import AsyncSageIntacctSDK
+from target_intacct.emulator import GatewayEmulator
+from target_intacct.rate_limit import RateLimiter
+from target_intacct.sessions import SessionCache
+
+from .test_client import CLIENT_KWARGS
+
+GET_SUPDOC = {"get": {"@object": "supdoc", "@key": "missing"}}
+
+
+@pytest.fixture
+def emulator():
+    with GatewayEmulator(reference_rows=250) as emulator:
+        yield emulator
+
+
+def make_client(emulator, **kwargs):
+    return AsyncSageIntacctSDK(**{
+        **CLIENT_KWARGS,
+        "api_url": emulator.url,
+        "session_cache": SessionCache(),
+        "rate_limiter": RateLimiter(rate=1000),
+        **kwargs,
+    })
+
+
+def test_concurrent_requests_share_one_login(emulator):
+    async def run():
+        client = make_client(emulator)
+        try:
+            results = await asyncio.gather(*[client.format_and_send_request(GET_SUPDOC) for _ in range(20)])
+            count = await client.count_entity(object_type="accounts_payable_vendors")
+            vendors = [vendor async for vendor in client.iter_entity(
+                object_type="accounts_payable_vendors", fields=["VENDORID"], pagesize=100
+            )]
+        finally:
+            await client.close()
+        return results, count, vendors
+
+    results, count, vendors = asyncio.run(run())
+    assert all(result["status"] == "success" for result in results)
+    assert count == 250
+    assert [vendor["VENDORID"] for vendor in vendors] == [f"V{n:05d}" for n in range(1, 251)]
+    assert emulator.stats()["logins"] == 1
+
+
+def test_expired_session_is_renewed_once_for_concurrent_requests(emulator):
+    async def run():
+        async with make_client(emulator) as client:
+            emulator._sessions.clear()
+            return await asyncio.gather(*[client.format_and_send_request(GET_SUPDOC) for _ in range(10)])
+
+    results = asyncio.run(run())
+    assert all(result["status"] == "success" for result in results)
+    stats = emulator.stats()
+    assert stats["logins"] == 2
+    assert stats["invalid_sessions"] == 10
+
+
+def test_rate_limited_requests_wait_without_blocking_the_loop(emulator, tmp_path):
+    limiter = RateLimiter(rate=20, burst=1, max_rate=40, state_path=str(tmp_path / "rate_limit.json"))
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        async with make_client(emulator, rate_limiter=limiter) as client:
+            started = time.monotonic()
+            await asyncio.gather(*[client.format_and_send_request(GET_SUPDOC) for _ in range(10)])
+            elapsed = time.monotonic() - started
+        ticker.cancel()
+        return elapsed, ticks
+
+    elapsed, ticks = asyncio.run(run())
+    # the login took the only token, the 10 requests are spread over 0.5s
+    assert elapsed >= 0.4
+    assert ticks >= 20
+    assert limiter.rate > 20
+
+
+def test_warm_connections_are_opened_on_login_and_reused(emulator):
+    async def run():
+        async with make_client(emulator, pool_size=4, warm_connections=3) as client:
+            opened = emulator.stats()["connections"]
+            await asyncio.gather(*[client.format_and_send_request(GET_SUPDOC) for _ in range(3)])
+            return opened
+
+    opened = asyncio.run(run())
+    # the login connection is reused by a HEAD request, the warm ones serve the requests
+    assert opened == emulator.stats()["connections"] == 3
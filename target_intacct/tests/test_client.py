@@ -0,0 +1,296 @@
+"""Tests for the Sage Intacct client."""
+
+import gzip
+import logging
+import threading
+
+import pytest
+import xmltodict
+
+from target_intacct.client import SageIntacctSDK
+from target_intacct.concurrency import ConcurrencyController
+from target_intacct.exceptions import (
+    DuplicateRequestError,
+    InvalidTokenError,
+    InvalidXMLResponseError,
+    TemporaryServerError,
+    WrongParamsError,
+)
+from target_intacct.rate_limit import RateLimiter
+from target_intacct.request_logging import LOGGER_NAME, RequestLogger, disable_queue_logging
+from target_intacct.sessions import FileSessionCache
+
+
+CLIENT_KWARGS = {
+    "api_url": "https://api.intacct.test/ia/xml/xmlgw.phtml",
+    "company_id": "company",
+    "sender_id": "sender",
+    "sender_password": "sender_password",
+    "user_id": "user",
+    "user_password": "user_password",
+    "headers": {},
+    "use_locations": False,
+    "location_id": None,
+    "warm_connections": 0,
+}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """A client that skips the getAPISession login."""
+    monkeypatch.setattr(SageIntacctSDK, "_set_session_id", lambda self, **kwargs: None)
+    client = SageIntacctSDK(**CLIENT_KWARGS)
+    client._SageIntacctSDK__session_id = "session"
+    return client
+
+
+def test_format_and_send_batch_splits_results_by_controlid(client, monkeypatch):
+    sent = []
+
+    def post_request(dict_body, api_url, raise_result_errors=True):
+        functions = dict_body["request"]["operation"]["content"]["function"]
+        functions = functions if isinstance(functions, list) else [functions]
+        sent.append(functions)
+        results = []
+        for function in functions:
+            if function["create"]["NAME"] == "bad":
+                results.append({
+                    "status": "failure",
+                    "controlid": function["@controlid"],
+                    "errormessage": {"error": {"errorno": "BL01001973", "description2": "Invalid vendor"}},
+                })
+            else:
+                results.append({
+                    "status": "success",
+                    "controlid": function["@controlid"],
+                    "data": {"vendor": {"RECORDNO": function["create"]["NAME"]}},
+                })
+        return {"result": results}
+
+    monkeypatch.setattr(client, "_post_request", post_request)
+
+    functions = [{"create": {"object": "VENDOR", "NAME": name}} for name in ["1", "bad", "3"]]
+    results = client.format_and_send_batch(functions, controlids=["a", "b", "c"], max_functions=2)
+
+    assert [len(functions) for functions in sent] == [2, 1]
+    assert list(results) == ["a", "b", "c"]
+    assert results["a"]["data"]["vendor"]["RECORDNO"] == "1"
+    assert isinstance(results["b"], WrongParamsError)
+    assert results["c"]["data"]["vendor"]["RECORDNO"] == "3"
+    # the action bodies are not mutated, so a retry can rebuild them
+    assert functions[0]["create"]["object"] == "VENDOR"
+
+
+def test_request_logger_redacts_truncates_and_samples(caplog):
+    body = {"request": {"control": {"senderid": "sender", "password": "secret"}, "operation": {"content": "x" * 100}}}
+
+    with caplog.at_level(logging.INFO, logger=LOGGER_NAME):
+        RequestLogger(max_chars=50).log_request(body, 120, 200, sampled=True)
+        RequestLogger(verbosity="summary").log_request(body, 120, 200, sampled=False)
+        RequestLogger(verbosity="none").log_request(body, 120, 200, sampled=True)
+
+    full, summary = [record.getMessage() for record in caplog.records]
+    assert "secret" not in full and "***" in full
+    assert full.endswith("more chars] with status code 200")
+    assert summary == "Request of 120 bytes with status code 200"
+    assert body["request"]["control"]["password"] == "secret"
+    assert not RequestLogger(sample_rate=0).sample()
+
+
+def test_queued_request_logs_propagate_and_keep_the_logged_body(caplog):
+    action = {"object": "VENDOR", "VENDOR": {"NAME": "Vendor"}}
+    handled = []
+    handler = logging.Handler()
+    handler.emit = lambda record: handled.append((threading.current_thread(), record.getMessage()))
+    logging.getLogger().addHandler(handler)
+
+    try:
+        with caplog.at_level(logging.INFO, logger=LOGGER_NAME):
+            RequestLogger(use_queue=True).log_function("VENDOR", action)
+            # the client pops the object once the function is logged
+            action.pop("object")
+            disable_queue_logging()
+    finally:
+        logging.getLogger().removeHandler(handler)
+
+    assert logging.getLogger(LOGGER_NAME).propagate
+    [(thread, message)] = handled
+    assert thread is not threading.current_thread()
+    assert "'object': 'VENDOR'" in message
+
+
+def test_iter_entity_pages_after_the_last_recordno(client, monkeypatch):
+    rows = [{"RECORDNO": str(i), "NAME": f"Vendor {i}"} for i in range(1, 6)]
+    queries = []
+
+    def format_and_send_request(data):
+        query = data["query"]
+        queries.append(query)
+        after = query.get("filter", {}).get("greaterthan", {}).get("value", "0")
+        page = [row for row in rows if int(row["RECORDNO"]) > int(after)][: query["pagesize"]]
+        remaining = len([row for row in rows if int(row["RECORDNO"]) > int(after)]) - len(page)
+        return {"data": {"@numremaining": str(remaining), "VENDOR": page[0] if len(page) == 1 else page}}
+
+    monkeypatch.setattr(client, "format_and_send_request", format_and_send_request)
+
+    objects = client.iter_entity(object_type="accounts_payable_vendors", fields=["NAME"], pagesize=2)
+
+    assert list(objects) == rows
+    assert len(queries) == 3
+    assert queries[0]["select"]["field"] == ["RECORDNO", "NAME"]
+    assert "filter" not in queries[0]
+    assert queries[2]["filter"] == {"greaterthan": {"field": "RECORDNO", "value": "4"}}
+
+
+def test_entity_keyset_request_combines_filters(client):
+    filter = {"filter": {"equalto": {"field": "STATUS", "value": "active"}}}
+
+    data = client._entity_keyset_request("VENDOR", ["NAME"], 100, "42", filter)
+
+    assert data["query"]["filter"] == {
+        "and": {
+            "equalto": {"field": "STATUS", "value": "active"},
+            "greaterthan": {"field": "RECORDNO", "value": "42"},
+        }
+    }
+    assert list(data["query"]) == ["object", "select", "filter", "orderby", "options", "pagesize"]
+    assert "<ascending></ascending>" in client._serialize_request(client._build_request([{"@controlid": "1", **data}])).decode()
+
+
+def test_query_entity_request_shows_private_objects(client):
+    data = client._query_entity_request("VENDOR", ["VENDORID"], {"in": {"field": "NAME", "value": ["Vendor 1"]}})
+
+    assert data["query"]["options"] == {"showprivate": "true"}
+    assert list(data["query"]) == ["object", "select", "filter", "options", "pagesize"]
+
+
+def test_iter_entity_fetches_pages_in_parallel_and_retries_a_failed_page(client, monkeypatch):
+    monkeypatch.setattr("target_intacct.client.time.sleep", lambda seconds: None)
+    rows = [{"RECORDNO": str(i)} for i in range(1, 11)]
+    failed = []
+
+    def format_and_send_request(data):
+        query = data["query"]
+        if "offset" not in query:
+            return {"data": {"@totalcount": str(len(rows))}}
+        if query["offset"] == 4 and not failed:
+            failed.append(query["offset"])
+            raise InvalidXMLResponseError("truncated response")
+        return {"data": {"VENDOR": rows[query["offset"]:query["offset"] + query["pagesize"]]}}
+
+    monkeypatch.setattr(client, "format_and_send_request", format_and_send_request)
+
+    objects = client.iter_entity(
+        object_type="accounts_payable_vendors", fields=["RECORDNO"], pagesize=2, parallelism=3
+    )
+
+    assert list(objects) == rows
+    assert failed == [4]
+
+
+def test_sessions_are_shared_and_renewed_when_rejected(tmp_path, monkeypatch):
+    cache = FileSessionCache(str(tmp_path / "sessions.json"))
+    logins, sent = [], []
+
+    def post_request(self, dict_body, api_url, raise_result_errors=True):
+        operation = dict_body["request"]["operation"]
+        if "login" in operation["authentication"]:
+            logins.append(api_url)
+            return {
+                "authentication": {"status": "success", "sessiontimeout": "2999-01-01T00:00:00+00:00"},
+                "result": {"data": {"api": {"sessionid": f"session{len(logins)}", "endpoint": "https://endpoint.test/"}}},
+            }
+        sent.append(operation["authentication"]["sessionid"])
+        if sent == ["session1"]:
+            raise InvalidTokenError("Invalid token / Incorrect credentials", {})
+        return {"result": {"status": "success"}}
+
+    monkeypatch.setattr(SageIntacctSDK, "_post_request", post_request)
+
+    SageIntacctSDK(**CLIENT_KWARGS, session_cache=cache)
+    # a client of another process finds the session in the file
+    client = SageIntacctSDK(**CLIENT_KWARGS, session_cache=FileSessionCache(cache.path))
+    result = client.format_and_send_request({"query": {"object": "VENDOR"}})
+
+    assert result == {"status": "success"}
+    assert logins == [CLIENT_KWARGS["api_url"], "https://endpoint.test/"]
+    assert sent == ["session1", "session2"]
+    assert [session["sessionid"] for session in cache._read().values()] == ["session2"]
+
+
+def test_rate_limiter_adapts_and_is_shared_through_its_file(tmp_path):
+    path = str(tmp_path / "rate_limit.json")
+    limiter = RateLimiter(rate=10, burst=2, state_path=path)
+    other_process = RateLimiter(rate=10, burst=2, state_path=path)
+
+    assert limiter.reserve() == 0
+    assert other_process.reserve() == 0
+    # the bucket is empty, the next request waits for a token
+    assert 0.05 < limiter.reserve() <= 0.1
+
+    other_process.on_throttle()
+    assert limiter.rate == 5
+    limiter.on_success()
+    assert other_process.rate == pytest.approx(5.5)
+    # the rate doubles back in a handful of requests, and stops at the ceiling
+    for _i in range(7):
+        limiter.on_success()
+    assert limiter.rate == 10
+
+    probing = RateLimiter(rate=10, max_rate=20)
+    for _i in range(8):
+        probing.on_success()
+    assert probing.rate == 20
+
+
+def test_concurrency_window_grows_on_success_and_halves_on_overload():
+    controller = ConcurrencyController(initial_window=4, max_window=8)
+
+    for _i in range(4):
+        with controller.slot("VENDOR"):
+            pass
+    assert controller.window("VENDOR") == 4
+    with controller.slot("VENDOR"):
+        pass
+    assert controller.window("VENDOR") == 5
+
+    with pytest.raises(TemporaryServerError):
+        with controller.slot("VENDOR"):
+            raise TemporaryServerError("Server temporarily unavailable (HTTP 503)")
+    assert controller.window("VENDOR") == 2
+    # the other object types keep their own window
+    assert controller.window("GLBATCH") == 4
+
+
+def test_idempotent_replay_raises_a_duplicate_request_error(client):
+    client._SageIntacctSDK__idempotent = True
+    function = {"@controlid": "stable", "create": {"NAME": "Vendor"}}
+    dict_body = client._build_request([function])
+    duplicate = {
+        "response": {
+            "control": {"status": "failure"},
+            "errormessage": {"error": {"errorno": "XL03000009", "description2": "already recorded"}},
+        }
+    }
+    text = xmltodict.unparse(duplicate)
+
+    with pytest.raises(DuplicateRequestError):
+        client._handle_response(dict_body, client._serialize_request(dict_body), 200, text, "url")
+
+    assert dict_body["request"]["control"]["uniqueid"] is True
+    assert dict_body == client._build_request([function])
+    # the functions of a batch can't be replayed one by one under a request uniqueid
+    batch = client._build_request([function, {**function, "@controlid": "other"}])
+    assert batch["request"]["control"]["uniqueid"] is False
+
+
+def test_large_request_bodies_are_gzipped_when_enabled(client):
+    small, large = b"<request/>", b"<request>" + b"x" * 4096 + b"</request>"
+
+    assert client._encode_body(large) == (large, client._request_headers())
+
+    client._SageIntacctSDK__compress_requests = True
+    data, headers = client._encode_body(large)
+    assert headers["content-encoding"] == "gzip"
+    assert gzip.decompress(data) == large and len(data) < len(large)
+    assert "content-encoding" not in client._encode_body(small)[1]
@@ -0,0 +1,160 @@
+"""Tests of the client against the local gateway emulator."""
+
+import pytest
+import xmltodict
+
+from target_intacct.client import SageIntacctSDK
+from target_intacct.emulator import GatewayEmulator
+from target_intacct.exceptions import DuplicateRequestError, SageIntacctSDKError, TemporaryServerError
+from target_intacct.sessions import SessionCache
+
+from .test_client import CLIENT_KWARGS
+
+
+@pytest.fixture
+def emulator():
+    with GatewayEmulator(reference_rows=250) as emulator:
+        yield emulator
+
+
+def make_client(emulator, **kwargs):
+    return SageIntacctSDK(**{
+        **CLIENT_KWARGS,
+        "api_url": emulator.url,
+        "session_cache": SessionCache(),
+        **kwargs,
+    })
+
+
+def test_client_reads_and_writes_against_emulator(emulator):
+    client = make_client(emulator, compress_requests=True)
+
+    vendors = list(client.iter_entity(object_type="accounts_payable_vendors", fields=["VENDORID", "NAME"], pagesize=100))
+    assert [vendor["VENDORID"] for vendor in vendors] == [f"V{n:05d}" for n in range(1, 251)]
+    pages = list(client.iter_entity(object_type="accounts_payable_vendors", fields=["NAME"], pagesize=100, parallelism=3))
+    assert [vendor["NAME"] for vendor in pages] == [vendor["NAME"] for vendor in vendors]
+    page, remaining = client.get_entity_page(object_type="accounts_payable_vendors", fields=["NAME"], pagesize=100)
+    assert len(page) == 100 and remaining == 150
+    for parallelism in (1, 3):
+        rest = list(client.iter_entity(
+            object_type="accounts_payable_vendors", fields=["NAME"], pagesize=100, parallelism=parallelism,
+            after=page[-1]["RECORDNO"],
+        ))
+        assert [vendor["NAME"] for vendor in page + rest] == [vendor["NAME"] for vendor in vendors]
+
+    bill = client.format_and_send_request({"create": {"object": "APBILL", "APBILL": {"VENDORID": "V00001"}}})
+    recordno = bill["data"]["apbill"]["RECORDNO"]
+    found = client.get_entity(
+        object_type="accounts_payable_bills",
+        fields=["RECORDNO"],
+        filter={"filter": {"equalto": {"field": "VENDORID", "value": "V00001"}}},
+    )
+    assert found["RECORDNO"] == recordno
+    url = client.format_and_send_request(
+        {"readByQuery": {"object": "APBILL", "fields": "RECORD_URL", "query": f"RECORDNO = {recordno}"}}
+    )
+    assert url["data"]["apbill"]["RECORD_URL"].endswith(f"/{recordno}")
+
+    folder = client.format_and_send_request({"get": {"@object": "supdocfolder", "@key": "BILL-1"}})
+    assert not folder["data"].get("supdocfolder")
+    client.format_and_send_request({"create_supdocfolder": {"supdocfoldername": "BILL-1", "object": "supdocfolder"}})
+    client.format_and_send_request({"create_supdoc": {
+        "object": "supdoc",
+        "supdocid": "BILL-1",
+        "attachments": {"attachment": {"attachmentname": "invoice", "attachmentdata": "JVBERi0x" * 500}},
+    }})
+    supdoc = client.format_and_send_request({"get": {"@object": "supdoc", "@key": "BILL-1"}})
+    assert supdoc["data"]["supdoc"]["attachments"]["attachment"]["attachmentname"] == "invoice"
+
+    order = client.format_and_send_request({"create_potransaction": {"object": "PODOCUMENT", "PODOCUMENT": {
+        "transactiontype": "Purchase Order",
+        "vendorid": "V00001",
+        "potransitems": {"potransitem": [{"itemid": "I00001"}, {"itemid": "I00002"}]},
+    }}}, use_payload=True)
+    docno = order["key"].split("-")[1]
+    found = client.get_entity(
+        object_type="purchase_orders",
+        fields=["DOCNO"],
+        filter={"filter": {"equalto": {"field": "DOCNO", "value": docno}}, "select": {"field": ["RECORDNO", "DOCNO"]}},
+    )
+    assert found["DOCNO"] == docno
+
+    stats = emulator.stats()
+    assert stats["logins"] == 1
+    assert stats["function.query"] >= 5
+    assert stats["function.create_potransaction"] == 1
+
+
+def test_pool_settings_apply_and_warming_opens_connections(emulator):
+    client = make_client(emulator, pool_size=4, warm_connections=3)
+
+    adapter = client._SageIntacctSDK__http_session.get_adapter(emulator.url)
+    assert adapter.poolmanager.connection_pool_kw["maxsize"] == 4
+    assert adapter.poolmanager.connection_pool_kw["block"]
+    # the login connection is reused by the first HEAD request
+    assert emulator.stats()["connections"] == 3
+
+    # the warm connections serve the next requests
+    for _ in range(3):
+        client.format_and_send_request({"get": {"@object": "supdoc", "@key": "missing"}})
+    assert emulator.stats()["connections"] == 3
+
+    client.warm_connections(10)
+    assert emulator.stats()["connections"] == 4
+
+
+def test_emulator_rejects_replayed_controlids(emulator):
+    client = make_client(emulator, idempotent=True)
+    data = {"create": {"object": "VENDOR", "VENDOR": {"VENDORID": "NEW", "NAME": "New vendor"}}}
+
+    first = client.format_and_send_request(data, controlid="vendor-new")
+    with pytest.raises(DuplicateRequestError):
+        client.format_and_send_request(data, controlid="vendor-new")
+
+    assert first["data"]["vendor"]["VENDORID"] == "NEW"
+    assert len([vendor for vendor in emulator.objects("VENDOR") if vendor["VENDORID"] == "NEW"]) == 1
+
+    # a failed request is recorded too, its replay isn't run again
+    bill = {"create": {"object": "APBILL", "APBILL": {"VENDORID": "MISSING"}}}
+    with pytest.raises(SageIntacctSDKError, match="Invalid Vendor"):
+        client.format_and_send_request(bill, controlid="bill-missing")
+    with pytest.raises(DuplicateRequestError):
+        client.format_and_send_request(bill, controlid="bill-missing")
+    assert emulator.stats()["function.create"] == 2
+
+
+def test_emulator_records_the_controlid_of_a_partially_failed_request(emulator):
+    client = make_client(emulator)
+    body = client._build_request([
+        {"@controlid": "ok", "create": {"APBILL": {"VENDORID": "V00001"}}},
+        {"@controlid": "failed", "create": {"APBILL": {"VENDORID": "MISSING"}}},
+    ])
+    body["request"]["control"].update({"controlid": "partial", "uniqueid": True})
+    body = client._serialize_request(body)
+
+    first = xmltodict.parse(emulator.handle(body))["response"]
+    replay = xmltodict.parse(emulator.handle(body))["response"]
+
+    assert [result["status"] for result in first["operation"]["result"]] == ["success", "failure"]
+    assert replay["control"]["status"] == "failure"
+    assert replay["errormessage"]["error"]["errorno"] == "XL03000009"
+    assert len(emulator.objects("APBILL")) == 1
+
+
+def test_emulator_expired_sessions_and_injected_errors(emulator):
+    client = make_client(emulator)
+    emulator._sessions.clear()
+    # the client logs in again when its session is rejected
+    assert client.format_and_send_request({"get": {"@object": "supdoc", "@key": "missing"}})["status"] == "success"
+    assert emulator.stats()["logins"] == 2
+
+    body = client._build_request([{"@controlid": "q", "get": {"@object": "supdoc", "@key": "x"}}])
+    for kind in ["503", "html"]:
+        emulator.error_rate, emulator.error_kinds = 1.0, (kind,)
+        with pytest.raises(TemporaryServerError):
+            client._post_request(body, emulator.url)
+
+    emulator.error_rate, emulator.rate_limit, emulator._tokens = 0.0, 1.0, 0.0
+    with pytest.raises(TemporaryServerError):
+        client._post_request(body, emulator.url)
+    assert emulator.stats()["throttled"] == 1
@@ -0,0 +1,205 @@
+"""Tests of the reference tables cache shared by the sinks and of their store on disk."""
+
+import json
+import logging
+import threading
+import time
+
+import pytest
+
+from target_intacct.emulator import GatewayEmulator
+from target_intacct.lookups import LookupCache, LookupStore, LookupTable, PointLookupTable
+
+from .test_emulator import make_client
+
+
+def test_lookup_table_indexes_names_ids_and_recordnos():
+    rows = [
+        {"RECORDNO": "1", "VENDORID": "V00001", "NAME": "Acme Corp"},
+        {"RECORDNO": "2", "VENDORID": "V00002", "NAME": "Globex"},
+    ]
+    vendors = LookupTable(iter(rows), "NAME", "VENDORID")
+
+    assert vendors == {"Acme Corp": "V00001", "Globex": "V00002"}
+    assert vendors["Globex"] == "V00002" and vendors.get("Initech") is None
+    assert "Acme Corp" in vendors and list(vendors.keys()) == ["Acme Corp", "Globex"]
+    assert vendors.has_id("V00002") and "V00001" in vendors.values() and not vendors.has_id("Globex")
+    assert vendors.id_for_recordno("2") == vendors.id_for_recordno(2) == "V00002"
+    assert vendors.name_for_id("V00001") == "Acme Corp"
+    with pytest.raises(KeyError):
+        vendors["acme corp"]
+
+    normalized = LookupTable(rows, "NAME", "VENDORID", normalize=True)
+    assert normalized["  acme   CORP "] == "V00001"
+    assert "GLOBEX" in normalized and normalized.get("Initech") is None
+
+
+def test_point_lookup_table_queries_only_the_values_looked_up():
+    with GatewayEmulator(reference_rows=500) as emulator:
+        client = make_client(emulator)
+        vendors = PointLookupTable(client, "accounts_payable_vendors", "NAME", "VENDORID", count=500, batch_size=2)
+        vendors.resolve(["Vendor 3", "V00004", "5", "Vendor 3", "Initech"])
+        assert emulator.stats()["function.query"] == 2
+        assert len(vendors) == 3 and vendors["Vendor 3"] == "V00003"
+        assert vendors.has_id("V00004") and vendors.id_for_recordno("5") == "V00005"
+
+        # unresolved values are fetched on the spot, missing ones only once
+        assert vendors.get("Vendor 42") == "V00042"
+        assert vendors.get("Initech") is None and "Initech" not in vendors
+        assert not vendors.has_id("V99999") and not vendors.has_id("V99999")
+        assert emulator.stats()["function.query"] == 4
+        assert vendors.stats() == {"objects": 500, "queries": 4, "fetched": 4, "missing": 2}
+
+
+def test_point_lookup_table_looks_values_up_by_the_field_asked_for():
+    with GatewayEmulator(reference_rows=20) as emulator:
+        emulator.insert("VENDOR", {"VENDORID": "12", "NAME": "5"})
+        vendors = PointLookupTable(make_client(emulator), "accounts_payable_vendors", "NAME", "VENDORID")
+        # the vendor with id 12 and name 5 is fetched, not the ones with RECORDNO 12 and 5
+        assert vendors.has_id("12") and vendors["5"] == "12"
+        assert vendors.id_for_recordno("12") == "V00012" and vendors.id_for_recordno("5") == "V00005"
+        assert vendors.name_for_id("V00012") == "Vendor 12" and not vendors.has_id("Vendor 12")
+        assert emulator.stats()["function.query"] == 4
+
+
+def test_point_lookup_table_by_recordno_only():
+    with GatewayEmulator(reference_rows=50) as emulator:
+        employees = PointLookupTable(
+            make_client(emulator), "employees", "EMPLOYEEID", "EMPLOYEEID", query_fields=["RECORDNO"]
+        )
+        employees.resolve(["2", 7, "2", "99999", "E00003"])
+        assert employees.id_for_recordno(7) == "E00007" and employees.id_for_recordno("2") == "E00002"
+        assert employees.id_for_recordno("99999") is None and employees.id_for_recordno("99999") is None
+        assert emulator.stats()["function.query"] == 1
+        assert employees.stats() == {"objects": None, "queries": 1, "fetched": 2, "missing": 2}
+
+
+def test_lookup_cache_loads_each_table_once_per_scope():
+    cache = LookupCache()
+    loads = []
+
+    def load(table):
+        def loader():
+            loads.append(table)
+            return {"Vendor 1": "V00001"}
+        return loader
+
+    assert cache.get("company", "vendors", load("vendors")) == {"Vendor 1": "V00001"}
+    assert cache.get("company", "vendors", load("vendors")) is cache.get("company", "vendors", load("vendors"))
+    cache.get("company|location", "vendors", load("location vendors"))
+    assert loads == ["vendors", "location vendors"]
+    assert cache.stats() == {"hits": 2, "misses": 2, "waits": 0, "tables": 2}
+
+    cache.invalidate(scope="company")
+    cache.get("company", "vendors", load("vendors"))
+    assert loads == ["vendors", "location vendors", "vendors"]
+
+
+def test_lookup_cache_single_flight():
+    cache = LookupCache()
+    started = threading.Event()
+    loads = []
+
+    def load():
+        loads.append(1)
+        started.set()
+        time.sleep(0.1)
+        return {"Account 1": "00001"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("company", "accounts", load))) for _i in range(8)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(loads) == 1
+    assert len(results) == 8 and all(result is results[0] for result in results)
+    assert cache.stats()["waits"] == 7
+
+
+def test_lookup_cache_failed_load_is_retried():
+    cache = LookupCache()
+
+    def fail():
+        raise ConnectionError("gateway down")
+
+    with pytest.raises(ConnectionError):
+        cache.get("company", "classes", fail)
+    assert cache.get("company", "classes", lambda: {"Class 1": "C00001"}) == {"Class 1": "C00001"}
+    assert cache.stats()["misses"] == 2
+
+
+def test_lookup_store_refreshes_incrementally(tmp_path):
+    path = str(tmp_path / "lookups.db")
+    with GatewayEmulator(reference_rows=50) as emulator:
+        client = make_client(emulator)
+        store = LookupStore(path)
+        vendors = store.rows(client, "accounts_payable_vendors", ["VENDORID", "NAME"])
+        assert [vendor["VENDORID"] for vendor in vendors] == [f"V{n:05d}" for n in range(1, 51)]
+        assert store.stats()["full_loads"] == 1
+
+        emulator.insert("VENDOR", {"VENDORID": "NEW", "NAME": "New vendor"})
+        store.rows(client, "accounts_payable_vendors", ["VENDORID", "NAME"])
+        queries = emulator.stats()["function.query"]
+
+        # the next run reads the objects modified since the newest one stored
+        store = LookupStore(path)
+        vendors = store.rows(client, "accounts_payable_vendors", ["VENDORID", "NAME"])
+        assert len(vendors) == 51 and vendors[-1]["NAME"] == "New vendor"
+        assert store.stats() == {
+            "full_loads": 0, "incremental_loads": 1, "rows_fetched": 1, "reconciles": 0, "deleted": 0,
+        }
+        assert emulator.stats()["function.query"] == queries + 1
+
+        # asking for other fields reloads the table
+        store.rows(client, "accounts_payable_vendors", ["VENDORID", "NAME", "STATUS"])
+        assert store.stats()["full_loads"] == 1
+
+        # a deletion and a creation leave the count unchanged
+        deleted = emulator.objects("VENDOR")[0]["RECORDNO"]
+        del emulator._objects["VENDOR"][deleted]
+        emulator.insert("VENDOR", {"VENDORID": "NEWER", "NAME": "Newer vendor"})
+        store = LookupStore(path, reconcile_interval=0)
+        vendors = store.rows(client, "accounts_payable_vendors", ["VENDORID", "NAME", "STATUS"])
+        assert deleted not in [vendor["RECORDNO"] for vendor in vendors]
+        assert vendors[-1]["NAME"] == "Newer vendor"
+        assert store.stats()["deleted"] == 1
+        assert store.count(client.data_scope, "accounts_payable_vendors") == 51
+        assert store.count(client.data_scope, "classes") is None
+
+
+def test_prefetch_loads_only_the_referenced_tables():
+    pytest.importorskip("target_hotglue")
+    from target_intacct.sinks import intacctSink
+
+    with GatewayEmulator(reference_rows=50) as emulator:
+        sink = intacctSink.__new__(intacctSink)
+        sink.stream_name, sink.target_name, sink.logger = "Bills", "intacct-v2", logging.getLogger(__name__)
+        sink._target = type("Target", (), {"config": {}})()
+        sink.client, sink.lookup_cache, sink.lookup_store = make_client(emulator), LookupCache(), None
+        sink.normalize_lookup_keys, sink.lookup_point_threshold = False, 0
+        for table in ("vendors", "locations", "accounts", "items", "classes", "projects", "departments",
+                      "po_transaction_types", "customers"):
+            setattr(sink, table, None)
+        sink._reference_paths = sink.reference_paths()
+
+        bills = [
+            {"vendorName": "Vendor 1", "lineItems": [{"accountNumber": "00001", "departmentName": "Department 2"}]},
+            {"vendorName": "Vendor 3", "lineItems": json.dumps([{"accountNumber": "00002", "className": "Class 1"}])},
+        ]
+        assert sink.referenced_values(bills) == {
+            "vendors": {"Vendor 1", "Vendor 3"}, "departments": {"Department 2"}, "classes": {"Class 1"},
+        }
+
+        sink.prefetch_references(bills)
+        assert sink.lookup_cache.stats()["tables"] == 3
+        assert sink.vendors["Vendor 3"] == "V00003" and sink.departments["Department 2"] == "D00002"
+        assert sink.accounts is None and sink.items is None and sink.locations is None
+
+        # above the threshold only the referenced vendors are fetched
+        sink.vendors, sink.lookup_cache, sink.lookup_point_threshold = None, LookupCache(), 20
+        sink.prefetch_references(bills)
+        assert isinstance(sink.vendors, PointLookupTable) and sorted(sink.vendors) == ["Vendor 1", "Vendor 3"]
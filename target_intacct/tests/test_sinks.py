@@ -0,0 +1,232 @@
+"""Tests of the buffered uploads of the sink against the local gateway emulator."""
+
+import copy
+
+import pytest
+
+pytest.importorskip("target_hotglue")
+
+from target_intacct.client import SageIntacctSDK
+from target_intacct.emulator import GatewayEmulator
+from target_intacct.exceptions import TemporaryServerError
+from target_intacct.lookups import PointLookupTable
+from target_intacct.sinks import intacctSink
+from target_intacct.synthetic import SyntheticGenerator
+from target_intacct.target import Targetintacct
+
+from .test_client import CLIENT_KWARGS
+
+
+def bill(number, vendor="Vendor 1", **fields):
+    return {
+        "invoiceNumber": f"INV-{number}",
+        "vendorName": vendor,
+        "lineItems": [{"accountNumber": "00001", "totalPrice": number}],
+        **fields,
+    }
+
+
+BILLS = [
+    bill(1),
+    bill(2, vendor="Vendor 2"),
+    bill(3, vendor="Unknown vendor"),
+    bill(1),
+    bill(4, invoiceNumber="INV#4"),
+    bill(5, vendor="Vendor 3"),
+    bill(6),
+]
+
+
+def make_sink(emulator, stream="Bills", target=None, **config):
+    target = target or Targetintacct(config={
+        **{key: CLIENT_KWARGS[key] for key in ("company_id", "sender_id", "sender_password", "user_id", "user_password")},
+        "api_url": emulator.url,
+        "warm_connections": 0,
+        **config,
+    })
+    return intacctSink(target, stream, {"type": "object", "properties": {}}, None)
+
+
+def run_bills(records, **config):
+    """Sends the bills through a sink, returns its states and the bills written."""
+    with GatewayEmulator(reference_rows=10) as emulator:
+        sink = make_sink(emulator, **config)
+        # the uploads change the records, each run gets its own
+        for record in copy.deepcopy(records):
+            sink.process_record(record, {})
+        sink.flush_pending_records()
+
+        bills = {bill["RECORDNO"]: bill["RECORDID"] for bill in emulator.objects("APBILL")}
+        states = [
+            # ids are given in the order the bills are created, compare the bills they point to
+            {**state, "id": bills.get(state.get("id"))}
+            for state in sink.latest_state["bookmarks"][sink.name]
+        ]
+        return states, sorted(bills.values()), emulator.stats()
+
+
+def test_concurrent_uploads_match_a_sequential_run():
+    sequential = run_bills(BILLS)
+    concurrent = run_bills(BILLS, max_workers=4, batch_size=5)
+
+    states, bills, stats = concurrent
+    assert (states, bills) == sequential[:2]
+    assert bills == ["INV-1", "INV-2", "INV-5", "INV-6"]
+    assert {state.get("id") for state in states if state.get("success")} == set(bills)
+    assert len([state for state in states if state.get("error")]) == 2
+    # the repeated bill is deduplicated before dispatch, not uploaded twice
+    assert stats["function.create"] == sequential[2]["function.create"] == 4
+
+
+def test_concurrent_uploads_of_records_with_an_external_id_are_written_once():
+    records = [bill(number, externalId=f"external-{number}") for number in range(1, 5)]
+    sequential = run_bills(records)
+    concurrent = run_bills(records, max_workers=4, batch_size=4)
+
+    states, bills, stats = concurrent
+    assert (states, bills) == sequential[:2]
+    assert [state["externalId"] for state in states] == [f"external-{number}" for number in range(1, 5)]
+    assert stats["function.create"] == 4 and "function.update" not in stats
+
+
+def test_concurrent_uploads_of_bills_with_attachments_are_written_once(tmp_path):
+    # the upload of the attachments rewrites the attachments of the record
+    SyntheticGenerator(attachment_kb=[1]).write_attachments(str(tmp_path))
+    records = [
+        bill(number, attachments=[{"id": "synthetic-1kb", "name": "invoice.pdf"}])
+        for number in range(1, 9)
+    ]
+    sequential = run_bills(records, input_path=str(tmp_path))
+    concurrent = run_bills(records, input_path=str(tmp_path), max_workers=4, batch_size=8)
+
+    states, bills, stats = concurrent
+    assert (states, bills) == sequential[:2]
+    assert len(bills) == 8 and all(state["success"] for state in states)
+    assert stats["function.create"] == 8 and "function.update" not in stats
+
+
+def test_batch_uploads_match_a_sequential_run():
+    # the chunk of the first three bills has a bill for a vendor the gateway rejects
+    records = [bill(1), bill(2, vendorId="V99999"), bill(3, vendor="Vendor 2"), *BILLS[3:]]
+    sequential = run_bills(records)
+    batched = run_bills(records, batch_mode=True, batch_size=3)
+
+    states, bills, stats = batched
+    assert (states, bills) == sequential[:2]
+    assert bills == ["INV-1", "INV-3", "INV-5", "INV-6"]
+    assert any("V99999" in state.get("error", "") for state in states)
+    assert stats["function.create"] == 5
+    assert stats["requests"] < sequential[2]["requests"]
+
+
+def test_batch_uploads_of_records_with_an_external_id_are_written_once():
+    records = [bill(number, externalId=f"external-{number}") for number in range(1, 5)]
+    sequential = run_bills(records)
+    batched = run_bills(records, batch_mode=True, batch_size=4)
+
+    states, bills, stats = batched
+    assert (states, bills) == sequential[:2]
+    assert stats["function.create"] == 4 and "function.update" not in stats
+
+
+def test_records_synced_in_an_earlier_flush_are_counted_as_in_a_sequential_run():
+    summaries = []
+    for config in ({}, {"max_workers": 4, "batch_size": 2}, {"batch_mode": True, "batch_size": 2}):
+        with GatewayEmulator(reference_rows=10) as emulator:
+            sink = make_sink(emulator, **config)
+            for record in [bill(1), bill(2), bill(1), bill(2)]:
+                sink.process_record(record, {})
+            sink.flush_pending_records()
+            summaries.append(sink.latest_state["summary"][sink.name])
+        assert len(emulator.objects("APBILL")) == 2
+    assert summaries[1] == summaries[2] == summaries[0]
+
+
+def test_batch_controlids_are_the_same_when_a_batch_is_retried(monkeypatch):
+    sent = []
+
+    def fail_batch(self, functions, use_payload=False, controlids=None, max_functions=None):
+        sent.append(controlids)
+        raise TemporaryServerError("Server temporarily unavailable")
+
+    monkeypatch.setattr("target_intacct.client.SageIntacctSDK.format_and_send_batch", fail_batch)
+    for config in ({}, {"idempotent_writes": True}):
+        sent.clear()
+        run_bills(BILLS[:2], batch_mode=True, batch_size=2, **config)
+        run_bills(BILLS[:2], batch_mode=True, batch_size=2, **config)
+        assert len(sent) == 2 and sent[0] == sent[1] and len(set(sent[0])) == 2
+
+
+def test_replayed_uploads_are_looked_up_rather_than_assumed_created():
+    with GatewayEmulator(reference_rows=10) as emulator:
+        sink = make_sink(emulator, idempotent_writes=True)
+        record = bill(1)
+        upload = sink.bills_payload(record)
+        record_number, _, _ = sink.send_upload(upload, record)
+        # the same write sent again, like a retry of a request whose response was lost
+        assert sink.send_upload(upload, record) == (record_number, True, {})
+        assert len(emulator.objects("APBILL")) == 1
+
+        # the first request failed, the write is sent again once the vendor exists
+        record = bill(2, vendorId="V99999")
+        upload = sink.bills_payload(record)
+        with pytest.raises(Exception, match="Invalid Vendor"):
+            sink.send_upload(upload, record)
+        emulator.insert("VENDOR", {"VENDORID": "V99999", "NAME": "Vendor 99999"})
+        record_number, success, _ = sink.send_upload(upload, record)
+        assert success and emulator.objects("APBILL")[-1]["RECORDID"] == "INV-2"
+        assert emulator.stats()["duplicates"] == 2
+
+
+def test_created_vendors_are_found_by_the_other_sinks():
+    with GatewayEmulator(reference_rows=10) as emulator:
+        bills = make_sink(emulator)
+        suppliers = make_sink(emulator, stream="Suppliers", target=bills._target)
+        assert "New vendor" not in bills.get_vendors()
+
+        suppliers.process_record({"vendorNumber": "NEW-1", "vendorName": "New vendor"}, {})
+
+        assert bills.get_vendors()["New vendor"] == "NEW-1"
+        assert bills.write_record(bill(1, vendor="New vendor"), {})[1]
+        # the vendors were loaded once, not again after the create
+        assert bills.lookup_cache.stats()["misses"] == 1
+
+
+def test_employees_are_found_by_recordno_when_an_employee_id_is_another_recordno():
+    with GatewayEmulator(reference_rows=12) as emulator:
+        emulator._objects["EMPLOYEE"]["5"]["EMPLOYEEID"] = "12"
+        sink = make_sink(emulator, stream="PurchaseInvoices")
+        assert sink.get_employee_id_by_recordno("5") == "12"
+        assert sink.get_employee_id_by_recordno("12") == "E00012"
+        with pytest.raises(Exception, match="Employee with recordno 13 not found"):
+            sink.get_employee_id_by_recordno("13")
+
+
+def test_reference_tables_are_sized_by_their_first_page(monkeypatch):
+    def count_entity(self, **kwargs):
+        raise AssertionError("the vendors are counted with a request of their own")
+
+    monkeypatch.setattr(SageIntacctSDK, "count_entity", count_entity)
+    with GatewayEmulator(reference_rows=1500) as emulator:
+        # the download goes on from the first page
+        vendors = make_sink(emulator).get_vendors()
+        assert len(vendors) == 1500 and vendors["Vendor 1500"] == "V01500"
+        assert emulator.stats()["function.query"] == 2
+
+    with GatewayEmulator(reference_rows=1500) as emulator:
+        vendors = make_sink(emulator, lookup_point_threshold=1000).get_vendors()
+        assert isinstance(vendors, PointLookupTable) and vendors.count == 1500
+        assert emulator.stats()["function.query"] == 1
+
+
+def test_reference_tables_of_the_lookup_store_are_not_counted(tmp_path, monkeypatch):
+    config = {"lookup_store_path": str(tmp_path / "lookups.db")}
+    with GatewayEmulator(reference_rows=10) as emulator:
+        make_sink(emulator, **config).get_vendors()
+
+        def count_entity(self, **kwargs):
+            raise AssertionError("the vendors are counted in the lookup store")
+
+        monkeypatch.setattr(SageIntacctSDK, "count_entity", count_entity)
+        # a new target doesn't share the lookup cache of the first one
+        assert len(make_sink(emulator, **config).get_vendors()) == 10
@@ -0,0 +1,209 @@
+"""The fast serializer must write the same bytes as xmltodict.unparse."""
+
+import datetime as dt
+import random
+from collections import OrderedDict
+from decimal import Decimal
+
+import pytest
+import xmltodict
+
+from target_intacct.xml_serializer import EnvelopeTemplate, unparse, unparse_fragment
+
+TEMPLATE = EnvelopeTemplate("sender & co", "p<a>ss'\"")
+
+
+def envelope(functions, controlid=dt.datetime(2024, 1, 2, 3, 4, 5, 678), uniqueid=False):
+    """Same shape as SageIntacctSDK._build_request."""
+    return {
+        "request": {
+            "control": {
+                "senderid": "sender & co",
+                "password": "p<a>ss'\"",
+                "controlid": controlid,
+                "uniqueid": uniqueid,
+                "dtdversion": 3.0,
+                "includewhitespace": False,
+            },
+            "operation": {
+                "authentication": {"sessionid": "session&id"},
+                "content": {"function": functions[0] if len(functions) == 1 else functions},
+            },
+        }
+    }
+
+
+def login_request():
+    return {
+        "request": {
+            "control": {"senderid": "sender", "password": "pass", "controlid": dt.datetime(2024, 1, 2)},
+            "operation": {
+                "authentication": {"login": {"userid": "user", "companyid": "company", "password": "p&ss"}},
+                "content": {"function": {"@controlid": "1", "getAPISession": None}},
+            },
+        }
+    }
+
+
+def journal_entry(lines):
+    return {
+        "@controlid": "glbatch",
+        "create": {
+            "GLBATCH": {
+                "JOURNAL": "GJ",
+                "BATCH_DATE": "01/02/2024",
+                "BATCH_TITLE": "Payroll & benefits <January>",
+                "ENTRIES": {
+                    "GLENTRY": [
+                        {
+                            "ACCOUNTNO": str(1000 + i),
+                            "TR_TYPE": 1 if i % 2 else -1,
+                            "TRX_AMOUNT": round(i * 1.37, 2),
+                            "DEPARTMENT": None,
+                            "LOCATION": "",
+                            "MEMO": f"Line {i} — café",
+                            "CUSTOMFIELDS": {"CUSTOMFIELD": [{"CUSTOMFIELDNAME": "REF", "CUSTOMFIELDVALUE": i}]},
+                        }
+                        for i in range(lines)
+                    ]
+                },
+            }
+        },
+    }
+
+
+def purchase_order(lines):
+    key_order = ["itemid", "quantity", "unit", "price", "tax", "locationid", "departmentid", "memo"]
+    items = [
+        {"memo": f"Item {i}", "price": Decimal("10.50"), "quantity": i, "itemid": f"I{i}", "unit": "Each"}
+        for i in range(lines)
+    ]
+    return {
+        "@controlid": "po",
+        "create_potransaction": OrderedDict([
+            ("transactiontype", "Purchase Order"),
+            ("datecreated", {"year": 2024, "month": 1, "day": 2}),
+            ("vendorid", "V1"),
+            ("returnto", {"contactname": None}),
+            ("potransitems", {"potransitem": [
+                {key: item[key] for key in key_order if key in item} for item in items
+            ]}),
+        ]),
+    }
+
+
+def bill_with_attachment():
+    return [
+        {
+            "@controlid": "supdoc",
+            "create_supdoc": {
+                "object": "supdoc",
+                "supdocid": "BILL-1",
+                "supdocfoldername": "Bills",
+                "attachments": {"attachment": [
+                    {"attachmentname": "invoice", "attachmenttype": "pdf", "attachmentdata": "JVBERi0xLjQK" * 500},
+                    {"attachmentname": "notes", "attachmenttype": "txt", "attachmentdata": ""},
+                ]},
+            },
+        },
+        {
+            "@controlid": "apbill",
+            "create": {"APBILL": {"VENDORID": "V1", "WHENCREATED": dt.date(2024, 1, 2), "ONHOLD": False}},
+        },
+    ]
+
+
+def edge_cases():
+    return {
+        "@controlid": "edge",
+        "update": {
+            "VENDOR": {
+                "@key": 42,
+                "@note": "say \"hi\"\n\tit's",
+                "@quote": 'say "hi"',
+                "@flag": True,
+                "#text": "text & <cdata>",
+                "NAME": "A & B <C> 'x' \"y\"",
+                "EMPTY": [],
+                "TUPLE": ("a", "b"),
+                "NESTED": [["x", "y"], {"z": None}],
+                "SET": {"only"},
+                "ZERO": 0,
+                "CDATA": {"#text": "", "@a": ""},
+                "XMLNS": {"@xmlns": {"": "urn:default", "x": "urn:x"}, "x:child": "value"},
+            }
+        },
+    }
+
+
+CORPUS = {
+    "journal_entry": lambda: envelope([journal_entry(2000)]),
+    "purchase_order": lambda: envelope([purchase_order(500)]),
+    "bill_with_attachment": lambda: envelope(bill_with_attachment(), controlid="a" * 64, uniqueid=True),
+    "query": lambda: envelope([{
+        "@controlid": "q",
+        "query": {
+            "object": "VENDOR",
+            "select": {"field": ["RECORDNO", "NAME"]},
+            "filter": {"and": {"greaterthan": [{"field": "RECORDNO", "value": "1"}], "equalto": {"field": "STATUS", "value": "active"}}},
+            "orderby": {"order": {"field": "RECORDNO", "ascending": None}},
+            "options": {"showprivate": "true"},
+            "pagesize": 1000,
+        },
+    }]),
+    "read_by_query": lambda: envelope([{"@controlid": "r", "readByQuery": {"object": "APBILL", "fields": "*", "query": None, "pagesize": "10"}}]),
+    "edge_cases": lambda: envelope([edge_cases()]),
+    "login": login_request,
+}
+
+
+@pytest.mark.parametrize("name", CORPUS)
+def test_corpus_is_byte_identical(name):
+    document = CORPUS[name]()
+    expected = xmltodict.unparse(document).encode("utf-8")
+
+    assert unparse(document) == expected
+    if name != "login":
+        assert TEMPLATE.matches(document)
+        assert TEMPLATE.render(document) == expected
+    else:
+        assert not TEMPLATE.matches(document)
+    function = document["request"]["operation"]["content"]["function"]
+    assert unparse_fragment("function", function) == xmltodict.unparse(
+        {"function": function}, full_document=False
+    ).encode("utf-8")
+
+
+def random_value(rng, depth=0):
+    choice = rng.randrange(10 if depth < 4 else 6)
+    if choice == 0:
+        return None
+    if choice == 1:
+        return rng.choice([True, False])
+    if choice == 2:
+        return rng.choice([0, 1, -7, 3.0, 2.5, Decimal("1.10")])
+    if choice in (3, 4, 5):
+        return "".join(rng.choice("ab <>&'\"\n\té€") for _i in range(rng.randrange(6)))
+    if choice in (6, 7):
+        return [random_value(rng, depth + 1) for _i in range(rng.randrange(4))]
+    value = {}
+    for _i in range(rng.randrange(5)):
+        key = rng.choice(["A", "B", "C", "@attr", "@other", "#text"])
+        if key.startswith("@") or key == "#text":
+            value[key] = rng.choice(["x", "", "a & \"b\" 'c'", 5, True])
+        else:
+            value[key] = random_value(rng, depth + 1)
+    return value
+
+
+def test_random_documents_are_byte_identical():
+    rng = random.Random(14)
+    for _i in range(500):
+        document = {"root": random_value(rng)}
+        try:
+            expected = xmltodict.unparse(document).encode("utf-8")
+        except (TypeError, ValueError) as e:
+            with pytest.raises(type(e)):
+                unparse(document)
+            continue
+        assert unparse(document) == expected